@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for both map generators across map sizes and parameter settings.
+
+PROVIDED AS IS WITHOUT WARRANTY OR GUARANTEE THAT IT WILL WORK.
+"""
+
+import argparse
+import itertools
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from ProcGenExample_AgentDigger import BlindDigger, DiggingMap, generateAgentDiggerMap
+from ProcGenExample_BSP import generateBSPMap, partitionAreaTree
+
+'''
+Every combination of map size and parameter setting is a case, and every case
+is run for each of a fixed list of seeds, so two runs do exactly the same work.
+Each phase of a generator is timed on its own:
+
+digger - initialize (map and digger set up), dig (the performDigIteration
+         loop), generate (generateAgentDiggerMap as a whole). generate digs
+         the same map again, so it is skipped for maps larger than
+         GENERATEPHASESIZELIMIT, where dig alone takes minutes.
+bsp    - partition (partitionAreaTree, i.e. every AreaTree.partitionNode),
+         construct (one AreaTree.constructSubAreas), connect (one attempt of
+         AreaTree.connectSubAreas on that construction), generate
+         (generateBSPMap as a whole, including any retries)
+
+For each phase the result holds the median wall time over all seeds and
+repeats, the corresponding rate (phases, i.e. maps, per second) and the peak
+memory allocated during the phase. Memory is measured with tracemalloc in a
+separate run per seed, since tracing slows everything down.
+
+By default the sizes are DEFAULTSIZES, which take a few minutes in all; --full
+runs FULLSIZES instead, up to 4096 by 4096, which takes hours for the digger.
+
+Usage from the command line, e.g.:
+python ProcGenBenchmark.py run --generator bsp --sizes 64,256,1024 --output current.json
+python ProcGenBenchmark.py run --full --no-memory --output full.json
+python ProcGenBenchmark.py compare baseline.json current.json --threshold 0.1
+
+compare matches cases and phases between two result files and exits with
+status 1 if any phase got slower (or used more memory) by more than the
+threshold, so it can fail a build.
+'''
+
+BENCHMARKFORMATVERSION = 1
+DEFAULTSIZES = (64, 128, 256, 512)
+FULLSIZES = (64, 128, 256, 512, 1024, 2048, 4096)
+GENERATEPHASESIZELIMIT = 512
+DEFAULTSEEDS = (0, 1, 2)
+DEFAULTMINIMUMAREAFRACTIONS = (0.03125, 0.0078125)
+DEFAULTCOVERAGES = (20, 40)
+DEFAULTROOMCHANCES = (1, 5)
+DEFAULTREGRESSIONTHRESHOLD = 0.10
+
+DIGGERPHASES = ("initialize", "dig", "generate")
+BSPPHASES = ("partition", "construct", "connect", "generate")
+
+
+'''
+Runs one map through every phase, calling measure(phaseName, function) for
+each phase. Returns extra counters to store with the case.
+'''
+def runDiggerPhases(seed, size, parameters, measure):
+    state = {}
+    def initializeDig():
+        state["diggingMap"] = DiggingMap(size, size, rng = random.Random(seed))
+        state["digger"] = BlindDigger(parameters["directionPercentChance"], parameters["roomPercentChance"])
+        state["digger"].initializeDig(state["diggingMap"])
+    def dig():
+        diggingMap = state["diggingMap"]
+        digger = state["digger"]
+        tilesDugTarget = diggingMap.getTilesDugTarget(parameters["percentAreaTarget"])
+        iterations = 0
+        while (diggingMap.tilesDug < tilesDugTarget):
+            digger.performDigIteration(diggingMap)
+            iterations += 1
+        state["iterations"] = iterations
+    measure("initialize", initializeDig)
+    measure("dig", dig)
+    if (size <= GENERATEPHASESIZELIMIT):
+        measure("generate", lambda: generateAgentDiggerMap(seed, size, size, showPlot = False, **parameters))
+    return {"digIterations": state["iterations"]}
+
+
+def runBSPPhases(seed, size, parameters, measure):
+    state = {}
+    def partition():
+        state["tree"] = partitionAreaTree(random.Random(seed), size, size, parameters["minimumAreaFraction"])
+    def connect():
+        connectionStatus = []
+        state["tree"].connectSubAreas(connectionStatus)
+        state["connected"] = (connectionStatus == [True])
+    def generate():
+        state["generated"] = generateBSPMap(seed, size, size, showPlot = False, **parameters)
+    measure("partition", partition)
+    measure("construct", lambda: state["tree"].constructSubAreas())
+    measure("connect", connect)
+    measure("generate", generate)
+    return {"nodeCount": len(state["tree"].nodeTable),
+            "firstAttemptConnected": state["connected"],
+            "generatedConnected": state["generated"] is not None}
+
+
+GENERATORPHASES = {"digger": (runDiggerPhases, DIGGERPHASES),
+                   "bsp": (runBSPPhases, BSPPHASES)}
+
+
+def getParameterSettings(generatorKind, minimumAreaFractions, coverages, roomChances):
+    if (generatorKind == "bsp"):
+        return [{"minimumAreaFraction": fraction} for fraction in minimumAreaFractions]
+    return [{"percentAreaTarget": coverage, "roomPercentChance": roomChance, "directionPercentChance": 5}
+            for coverage, roomChance in itertools.product(coverages, roomChances)]
+
+
+def measureTime(phaseTimes):
+    def measure(phaseName, function):
+        startTime = time.perf_counter()
+        function()
+        phaseTimes.setdefault(phaseName, []).append(time.perf_counter() - startTime)
+    return measure
+
+
+def measureMemory(phasePeaks):
+    def measure(phaseName, function):
+        tracemalloc.reset_peak()
+        startSize = tracemalloc.get_traced_memory()[0]
+        function()
+        peakSize = tracemalloc.get_traced_memory()[1]
+        phasePeaks[phaseName] = max(phasePeaks.get(phaseName, 0), peakSize - startSize)
+    return measure
+
+
+'''
+Runs every seed of one case. A case whose parameters cannot produce a map
+(e.g. cells too small to hold a room) is recorded with its error message.
+'''
+def runCase(generatorKind, size, parameters, seeds, repeat, measureMemoryUse = True):
+    runPhases, phaseNames = GENERATORPHASES[generatorKind]
+    result = {"generator": generatorKind, "size": size, "parameters": parameters, "seeds": list(seeds)}
+    phaseTimes = {}
+    phasePeaks = {}
+    counters = []
+    try:
+        for seed in seeds:
+            for repeatIndex in range(repeat):
+                counters.append(runPhases(seed, size, parameters, measureTime(phaseTimes)))
+            if (measureMemoryUse):
+                tracemalloc.start()
+                try:
+                    runPhases(seed, size, parameters, measureMemory(phasePeaks))
+                finally:
+                    tracemalloc.stop()
+    except ValueError as error:
+        result["error"] = str(error)
+        return result
+
+    phases = {}
+    for phaseName in phaseNames:
+        if (phaseName not in phaseTimes):
+            continue
+        seconds = statistics.median(phaseTimes[phaseName])
+        phases[phaseName] = {"seconds": seconds,
+                             "perSecond": (1.0 / seconds) if seconds > 0 else None,
+                             "samples": len(phaseTimes[phaseName])}
+        if (phaseName in phasePeaks):
+            phases[phaseName]["peakBytes"] = phasePeaks[phaseName]
+    result["phases"] = phases
+    result["counters"] = counters[::repeat]
+    return result
+
+
+def runBenchmarks(generatorKinds, sizes = DEFAULTSIZES, seeds = DEFAULTSEEDS, repeat = 1,
+                  minimumAreaFractions = DEFAULTMINIMUMAREAFRACTIONS, coverages = DEFAULTCOVERAGES,
+                  roomChances = DEFAULTROOMCHANCES, measureMemoryUse = True, progress = None):
+    results = []
+    for generatorKind in generatorKinds:
+        for size in sizes:
+            for parameters in getParameterSettings(generatorKind, minimumAreaFractions, coverages, roomChances):
+                result = runCase(generatorKind, size, parameters, seeds, repeat, measureMemoryUse)
+                if (progress is not None):
+                    progress(result)
+                results.append(result)
+    return {"formatVersion": BENCHMARKFORMATVERSION,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "results": results}
+
+
+def getCaseKey(result):
+    return (result["generator"], result["size"], json.dumps(result["parameters"], sort_keys = True))
+
+
+'''
+Compares two sets of results and returns a list of (case key, phase, metric,
+baseline value, current value, ratio, isRegression) for every phase present
+in both. A ratio above 1 + threshold for seconds or peakBytes is a regression.
+'''
+def compareBenchmarks(baseline, current, threshold = DEFAULTREGRESSIONTHRESHOLD):
+    baselineResults = {getCaseKey(result): result for result in baseline["results"]}
+    comparisons = []
+    for result in current["results"]:
+        baselineResult = baselineResults.get(getCaseKey(result))
+        if (baselineResult is None or "phases" not in result or "phases" not in baselineResult):
+            continue
+        for phaseName, phase in result["phases"].items():
+            baselinePhase = baselineResult["phases"].get(phaseName)
+            if (baselinePhase is None):
+                continue
+            for metric in ("seconds", "peakBytes"):
+                if (metric not in phase or metric not in baselinePhase or baselinePhase[metric] <= 0):
+                    continue
+                ratio = phase[metric] / baselinePhase[metric]
+                comparisons.append((getCaseKey(result), phaseName, metric, baselinePhase[metric],
+                                    phase[metric], ratio, ratio > 1.0 + threshold))
+    return comparisons
+
+
+def formatResult(result):
+    caseName = "%s %dx%d %s" % (result["generator"], result["size"], result["size"],
+                                json.dumps(result["parameters"], sort_keys = True))
+    if ("error" in result):
+        return caseName + ": " + result["error"]
+    phaseStrings = []
+    for phaseName, phase in result["phases"].items():
+        phaseString = "%s %.4f s" % (phaseName, phase["seconds"])
+        if ("peakBytes" in phase):
+            phaseString += " %.1f MB" % (phase["peakBytes"] / 1e6)
+        phaseStrings.append(phaseString)
+    return caseName + ": " + ", ".join(phaseStrings)
+
+
+def getNumberList(text, numberType):
+    return [numberType(value) for value in text.split(",") if value != ""]
+
+
+def buildArgumentParser():
+    parser = argparse.ArgumentParser(description = "Benchmark the map generators.")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+
+    runParser = subparsers.add_parser("run", help = "Run the benchmarks")
+    runParser.add_argument("--generator", dest = "kinds", action = "append", choices = sorted(GENERATORPHASES),
+                           help = "Generator to benchmark, may be repeated (default: all)")
+    runParser.add_argument("--sizes", default = ",".join(str(size) for size in DEFAULTSIZES), help = "Comma separated map sizes")
+    runParser.add_argument("--full", action = "store_true",
+                           help = "Run every size in " + ",".join(str(size) for size in FULLSIZES) + " instead of --sizes")
+    runParser.add_argument("--seeds", default = ",".join(str(seed) for seed in DEFAULTSEEDS), help = "Comma separated seeds")
+    runParser.add_argument("--repeat", type = int, default = 1, help = "Timed runs per seed")
+    runParser.add_argument("--minimum-area-fractions", default = ",".join(str(value) for value in DEFAULTMINIMUMAREAFRACTIONS),
+                           help = "BSP: comma separated smallest cell sizes as fractions of the map area")
+    runParser.add_argument("--coverages", default = ",".join(str(value) for value in DEFAULTCOVERAGES),
+                           help = "Digger: comma separated percentages of the map to dig")
+    runParser.add_argument("--room-chances", default = ",".join(str(value) for value in DEFAULTROOMCHANCES),
+                           help = "Digger: comma separated initial percent chances of building a room")
+    runParser.add_argument("--no-memory", action = "store_true", help = "Skip the peak memory runs")
+    runParser.add_argument("--output", default = None, help = "Write the results as JSON to this file")
+
+    compareParser = subparsers.add_parser("compare", help = "Compare two result files")
+    compareParser.add_argument("baseline", help = "Results to compare against")
+    compareParser.add_argument("current", help = "New results")
+    compareParser.add_argument("--threshold", type = float, default = DEFAULTREGRESSIONTHRESHOLD,
+                               help = "Relative slow down (or memory growth) counted as a regression")
+
+    return parser
+
+
+def main(argumentList = None):
+    arguments = buildArgumentParser().parse_args(argumentList)
+    if (arguments.command == "compare"):
+        with open(arguments.baseline) as baselineFile:
+            baseline = json.load(baselineFile)
+        with open(arguments.current) as currentFile:
+            current = json.load(currentFile)
+        comparisons = compareBenchmarks(baseline, current, arguments.threshold)
+        for caseKey, phaseName, metric, baselineValue, currentValue, ratio, isRegression in comparisons:
+            print("%s %s %s %s: %.4g -> %.4g (x%.2f)%s" % (caseKey[0], caseKey[1], caseKey[2], phaseName + " " + metric,
+                  baselineValue, currentValue, ratio, "  REGRESSION" if isRegression else ""))
+        regressionCount = sum(1 for comparison in comparisons if comparison[-1])
+        print("%d comparisons, %d regressions" % (len(comparisons), regressionCount))
+        return 1 if regressionCount > 0 else 0
+
+    generatorKinds = arguments.kinds if arguments.kinds else sorted(GENERATORPHASES)
+    sizes = FULLSIZES if arguments.full else getNumberList(arguments.sizes, int)
+    results = runBenchmarks(generatorKinds, sizes, getNumberList(arguments.seeds, int),
+                            arguments.repeat, getNumberList(arguments.minimum_area_fractions, float),
+                            getNumberList(arguments.coverages, float), getNumberList(arguments.room_chances, float),
+                            not arguments.no_memory, progress = lambda result: print(formatResult(result)))
+    if (arguments.output is not None):
+        with open(arguments.output, "w") as outputFile:
+            json.dump(results, outputFile, indent = 1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Content addressed cache in front of both map generators.
+
+PROVIDED AS IS WITHOUT WARRANTY OR GUARANTEE THAT IT WILL WORK.
+"""
+
+from collections import OrderedDict
+import hashlib
+import inspect
+import json
+import os
+import random
+
+from ProcGenDiagnostics import getDiagnosticsLogger
+import ProcGenExample_AgentDigger
+import ProcGenExample_BSP
+from ProcGenMapFormat import KINDBSP, KINDDIGGER, MAPFILEEXTENSION, readMapBytes, saveGeneratedMap
+
+'''
+A generated map is fully determined by its generator, the generator's code,
+its parameters and its seed, so the map can be stored under a hash of exactly
+those:
+
+key = sha256 of the JSON of the generator kind, its GENERATORVERSION, the
+      module constants it depends on (GENERATORSETTINGS), every parameter of
+      the generator function with defaults filled in (so leaving a parameter
+      out and passing its default give the same key) and the seed
+
+Maps are kept as map files (see ProcGenMapFormat) in two tiers:
+memory - an LRU of map file bytes, at most memoryLimitBytes in total
+disk   - <key>.pgmap files in directory, at most diskLimitBytes in total.
+         Reading a file marks it as recently used by touching its
+         modification time, and the least recently used files are deleted
+         first. Several processes can share a directory.
+
+Every hit hands out a new object, so callers are free to change what they get.
+The state of the map's rng after generation is stored with it (as the
+"rngState" parameter of its map file), so a map from the cache goes on making
+the same random choices a freshly generated one would if it is dug or
+partitioned further. Map files written without it come back with a new,
+unseeded rng.
+Maps that failed to generate (generateBSPMap returning None) are cached as
+failures too. Without a seed the generator is simply called, since its result
+cannot be reproduced, and so it is when generateBSPMap is asked for its
+collectStats or profile, which describe a run rather than the map. Results are
+never plotted.
+
+cache = GenerationCache("mapCache")
+tree = cache.generateBSPMap(seed = 5, mapWidth = 512, mapHeight = 512)
+'''
+
+logger = getDiagnosticsLogger("cache")
+
+DEFAULTMEMORYLIMITBYTES = 256 * 1024 * 1024
+DEFAULTDISKLIMITBYTES = 4 * 1024 * 1024 * 1024
+
+GENERATORMODULES = {KINDDIGGER: ProcGenExample_AgentDigger,
+                    KINDBSP: ProcGenExample_BSP}
+GENERATORFUNCTIONNAMES = {KINDDIGGER: "generateAgentDiggerMap",
+                          KINDBSP: "generateBSPMap"}
+GENERATORSETTINGS = {KINDDIGGER: ("DEFAULTCHANGEDIRECTIONCHANCE", "DEFAULTROOMBUILDINGCHANCE",
+                                  "INCREMENTOFDIRECTIONCHANGE", "INCREMENTOFROOMBUILDING"),
+                     KINDBSP: ("MAGICPADDINGNUMBER", "MAGICWIDTHTHRESHOLD", "MAGICHEIGHTTHRESHOLD",
+                               "MAGICSUBAREAFRACTION", "MAXLOCALREPAIRRETRIES")}
+UNCACHEDPARAMETERS = ("seed", "showPlot", "collectStats", "profile")
+
+# Stored in place of a map file for maps that failed to generate.
+FAILEDMAP = b""
+
+
+def getGenerator(generatorKind):
+    return getattr(GENERATORMODULES[generatorKind], GENERATORFUNCTIONNAMES[generatorKind])
+
+
+'''
+Returns the cache key of a map. Raises TypeError for parameters the generator
+does not take.
+'''
+def getCacheKey(generatorKind, seed, parameters):
+    module = GENERATORMODULES[generatorKind]
+    boundArguments = inspect.signature(getGenerator(generatorKind)).bind(seed = seed, **parameters)
+    boundArguments.apply_defaults()
+    keyParameters = {name: value for name, value in boundArguments.arguments.items()
+                     if name not in UNCACHEDPARAMETERS}
+    keyFields = {"kind": generatorKind,
+                 "version": module.GENERATORVERSION,
+                 "settings": {name: getattr(module, name) for name in GENERATORSETTINGS[generatorKind]},
+                 "parameters": keyParameters,
+                 "seed": seed}
+    return hashlib.sha256(json.dumps(keyFields, sort_keys = True).encode("utf-8")).hexdigest()
+
+
+'''
+Returns a random.Random in the state rngState (random.Random.getstate() after
+a round trip through JSON), or a new unseeded one if there is no state.
+'''
+def getRestoredRng(rngState):
+    rng = random.Random()
+    if (rngState is not None):
+        version, internalState, gaussNext = rngState
+        rng.setstate((version, tuple(internalState), gaussNext))
+    return rng
+
+
+class GenerationCache(object):
+    def __init__(self, directory = None, memoryLimitBytes = DEFAULTMEMORYLIMITBYTES,
+                 diskLimitBytes = DEFAULTDISKLIMITBYTES):
+        self.directory = directory
+        self.memoryLimitBytes = memoryLimitBytes
+        self.diskLimitBytes = diskLimitBytes
+        self.memoryEntries = OrderedDict()
+        self.memoryBytes = 0
+        self.memoryHits = 0
+        self.diskHits = 0
+        self.misses = 0
+        self.uncached = 0
+        self.memoryEvictions = 0
+        self.diskEvictions = 0
+        self.diskBytes = 0
+        if (directory is not None):
+            os.makedirs(directory, exist_ok = True)
+            self.diskBytes = sum(size for path, size, modificationTime in self.getDiskEntries())
+
+    def __repr__(self):
+        return ("GenerationCache: " + str(self.hits) + " hits (" + str(self.memoryHits) + " memory, "
+                + str(self.diskHits) + " disk), " + str(self.misses) + " misses, "
+                + str(len(self.memoryEntries)) + " maps in memory")
+
+    @property
+    def hits(self):
+        return self.memoryHits + self.diskHits
+
+    def getStats(self):
+        return {"hits": self.hits, "memoryHits": self.memoryHits, "diskHits": self.diskHits,
+                "misses": self.misses, "uncached": self.uncached,
+                "memoryEvictions": self.memoryEvictions, "diskEvictions": self.diskEvictions,
+                "memoryEntries": len(self.memoryEntries), "memoryBytes": self.memoryBytes,
+                "diskBytes": self.diskBytes}
+
+    def getDiskPath(self, key):
+        return os.path.join(self.directory, key + MAPFILEEXTENSION)
+
+    def getDiskEntries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if (entry.name.endswith(MAPFILEEXTENSION)):
+                try:
+                    status = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, status.st_size, status.st_mtime))
+        return entries
+
+    def storeInMemory(self, key, mapBytes):
+        if (len(mapBytes) > self.memoryLimitBytes):
+            return
+        self.memoryEntries[key] = mapBytes
+        self.memoryBytes += len(mapBytes)
+        while (self.memoryBytes > self.memoryLimitBytes):
+            evictedKey, evictedBytes = self.memoryEntries.popitem(last = False)
+            self.memoryBytes -= len(evictedBytes)
+            self.memoryEvictions += 1
+
+    def loadFromDisk(self, key):
+        path = self.getDiskPath(key)
+        try:
+            with open(path, "rb") as mapFile:
+                mapBytes = mapFile.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return mapBytes
+
+    '''
+    Writes the map file for key, replacing any file already there, whose size
+    no longer counts towards diskBytes.
+    '''
+    def storeOnDisk(self, key, mapBytes):
+        path = self.getDiskPath(key)
+        temporaryPath = path + ".tmp" + str(os.getpid())
+        with open(temporaryPath, "wb") as mapFile:
+            mapFile.write(mapBytes)
+        try:
+            replacedBytes = os.path.getsize(path)
+        except FileNotFoundError:
+            replacedBytes = 0
+        os.replace(temporaryPath, path)
+        self.diskBytes += len(mapBytes) - replacedBytes
+        if (self.diskBytes > self.diskLimitBytes):
+            self.evictFromDisk()
+
+    '''
+    Deletes the least recently used files until the directory is within its
+    limit. Other processes may have added or deleted files, so the directory
+    is rescanned rather than trusting diskBytes.
+    '''
+    def evictFromDisk(self):
+        entries = sorted(self.getDiskEntries(), key = lambda entry: entry[2])
+        self.diskBytes = sum(size for path, size, modificationTime in entries)
+        for path, size, modificationTime in entries:
+            if (self.diskBytes <= self.diskLimitBytes):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.diskBytes -= size
+            self.diskEvictions += 1
+
+    '''
+    Returns the map file bytes for key, or None if it is in neither tier.
+    '''
+    def lookup(self, key):
+        mapBytes = self.memoryEntries.get(key)
+        if (mapBytes is not None):
+            self.memoryEntries.move_to_end(key)
+            self.memoryHits += 1
+            return mapBytes
+        if (self.directory is not None):
+            mapBytes = self.loadFromDisk(key)
+            if (mapBytes is not None):
+                self.diskHits += 1
+                self.storeInMemory(key, mapBytes)
+                return mapBytes
+        return None
+
+    def store(self, key, mapBytes):
+        self.storeInMemory(key, mapBytes)
+        if (self.directory is not None):
+            self.storeOnDisk(key, mapBytes)
+
+    def clearMemory(self):
+        self.memoryEntries.clear()
+        self.memoryBytes = 0
+
+    '''
+    Returns the map generatorKind ("digger" or "bsp") makes for seed and
+    parameters, generating and storing it only if it is not cached yet.
+    '''
+    def generate(self, generatorKind, seed = None, **parameters):
+        parameters.pop("showPlot", None)
+        if (seed is None or parameters.get("collectStats") or parameters.get("profile") is not None):
+            self.uncached += 1
+            return getGenerator(generatorKind)(seed = seed, showPlot = False, **parameters)
+        key = getCacheKey(generatorKind, seed, parameters)
+        mapBytes = self.lookup(key)
+        if (mapBytes is None):
+            self.misses += 1
+            generatedMap = getGenerator(generatorKind)(seed = seed, showPlot = False, **parameters)
+            if (generatedMap is None):
+                mapBytes = FAILEDMAP
+            else:
+                mapBytes = saveGeneratedMap(None, generatedMap,
+                                            dict(parameters, seed = seed, rngState = generatedMap.rng.getstate()))
+            self.store(key, mapBytes)
+            return generatedMap
+        if (mapBytes == FAILEDMAP):
+            return None
+        mapFile = readMapBytes(mapBytes, key)
+        rng = getRestoredRng(mapFile.parameters.get("rngState"))
+        if (generatorKind == KINDBSP):
+            return mapFile.toAreaTree(rng)
+        return mapFile.toDiggingMap(rng)
+
+    def generateAgentDiggerMap(self, seed = None, **parameters):
+        return self.generate(KINDDIGGER, seed, **parameters)
+
+    def generateBSPMap(self, seed = None, **parameters):
+        return self.generate(KINDBSP, seed, **parameters)
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Chunked, unbounded worlds dug by blind diggers.
+
+PROVIDED AS IS WITHOUT WARRANTY OR GUARANTEE THAT IT WILL WORK.
+"""
+
+from collections import OrderedDict
+import hashlib
+import os
+import random
+
+import numpy as np
+
+from ProcGenDiagnostics import getDiagnosticsLogger
+from ProcGenExample_AgentDigger import BlindDigger, DiggingMap, CORRIDORTILE, DIRECTIONLIST, TILEDTYPE, getTilesDugTargetForArea
+from ProcGenExample_AgentDigger import GENERATORVERSION as DIGGERGENERATORVERSION
+from ProcGenMapFormat import MAPFILEEXTENSION, loadMapFile, writeMapFile
+
+'''
+A ChunkedWorld is an endless grid of tiles, addressed by integer world
+coordinates (x, y) that may be negative, split into square chunks of
+chunkSize by chunkSize tiles. Chunk (cx, cy) covers x from cx * chunkSize to
+(cx + 1) * chunkSize - 1, and likewise for y.
+
+Each chunk is dug on its own, from a random.Random seeded by a hash of the
+world seed and its chunk coordinates, so a chunk always comes out the same no
+matter which chunks were made before it or in which process:
+
+1. Every edge shared by two chunks gets PORTALSPEREDGE portal tiles, drawn
+   from a hash of the world seed and the edge. Both chunks see the same
+   portals, so corridors meet across the seam.
+2. A corridor is dug from each portal on the edges of the chunk to its
+   centre, so all portals of a chunk are connected.
+3. A BlindDigger starting at the centre digs the rest of the chunk, until
+   percentAreaTarget percent of it is dug.
+
+The digging is all done inside the outermost ring of tiles of the chunk, and
+only the portals are dug in the ring itself. Corridors and rooms therefore
+only cross a seam at a portal, where the chunk on the other side has a portal
+too, and never run into an undug wall there.
+
+Chunks are made on demand by getTile, getRegion or getChunk, and kept in an
+LRU cache of at most cacheSize chunks. Chunks falling out of the cache are
+written to cacheDirectory (in the ProcGenMapFormat map file format) when one
+is given, and read back from there rather than dug again when needed. Memory
+use therefore stays bounded by cacheSize however much of the world is visited.
+'''
+
+logger = getDiagnosticsLogger("world")
+
+DEFAULTCHUNKSIZE = 64
+DEFAULTCHUNKCACHESIZE = 64
+PORTALSPEREDGE = 1
+# Part of the parameters of every chunk, so that chunk files dug by older
+# versions of generateChunk or the digger are dug again.
+GENERATORVERSION = 2
+
+KINDCHUNK = "chunk"
+
+
+'''
+Returns a 64 bit seed for the given world seed and key, stable across runs,
+processes and platforms (unlike hash()).
+'''
+def getWorldSeed(worldSeed, *key):
+    keyText = ":".join(str(part) for part in (worldSeed,) + key)
+    return int.from_bytes(hashlib.sha256(keyText.encode("utf-8")).digest()[:8], "little")
+
+
+'''
+Returns the positions along an edge, between 1 and chunkSize - 2, of the
+portals on the west edge (axis "x") or south edge (axis "y") of chunk
+(cx, cy). The east and north edges of a chunk are the west and south edges of
+its neighbours.
+'''
+def getEdgePortals(worldSeed, axis, cx, cy, chunkSize):
+    rng = random.Random(getWorldSeed(worldSeed, "edge", axis, cx, cy))
+    return sorted(rng.sample(range(1, chunkSize - 1), min(PORTALSPEREDGE, chunkSize - 2)))
+
+
+'''
+Digs an L shaped corridor from start to end, first along x and then along y.
+'''
+def digCorridorPath(diggingMap, start, end):
+    (xStart, yStart), (xEnd, yEnd) = start, end
+    diggingMap.digCorridorTile(xStart, yStart)
+    diggingMap.digCorridorLine(xStart, yStart, int(np.sign(xEnd - xStart)), 0, abs(xEnd - xStart))
+    diggingMap.digCorridorLine(xEnd, yStart, 0, int(np.sign(yEnd - yStart)), abs(yEnd - yStart))
+
+
+'''
+Digs chunk (cx, cy) and returns its (chunkSize, chunkSize) tile array, indexed
+[x, y] relative to the corner of the chunk.
+'''
+def generateChunk(worldSeed, cx, cy, chunkSize = DEFAULTCHUNKSIZE, percentAreaTarget = 40,
+                  directionPercentChance = 5, roomPercentChance = 5, fastStepping = False):
+    rng = random.Random(getWorldSeed(worldSeed, "chunk", cx, cy))
+    # The digging map covers the chunk without its outer ring, offset by one
+    # tile. DiggingMap never digs its last row and column, so it is one tile
+    # wider and taller than that.
+    interiorSize = chunkSize - 2
+    diggingMap = DiggingMap(interiorSize + 1, interiorSize + 1, rng = rng)
+    centre = (chunkSize // 2 - 1, chunkSize // 2 - 1)
+    westPortals = getEdgePortals(worldSeed, "x", cx, cy, chunkSize)
+    eastPortals = getEdgePortals(worldSeed, "x", cx + 1, cy, chunkSize)
+    southPortals = getEdgePortals(worldSeed, "y", cx, cy, chunkSize)
+    northPortals = getEdgePortals(worldSeed, "y", cx, cy + 1, chunkSize)
+    for position in westPortals:
+        digCorridorPath(diggingMap, (0, position - 1), centre)
+    for position in eastPortals:
+        digCorridorPath(diggingMap, (interiorSize - 1, position - 1), centre)
+    for position in southPortals:
+        digCorridorPath(diggingMap, (position - 1, 0), centre)
+    for position in northPortals:
+        digCorridorPath(diggingMap, (position - 1, interiorSize - 1), centre)
+
+    digger = BlindDigger(directionPercentChance, roomPercentChance, location = centre,
+                         direction = rng.choice(DIRECTIONLIST))
+    tilesDugTarget = getTilesDugTargetForArea(interiorSize * interiorSize, percentAreaTarget)
+    while (diggingMap.tilesDug < tilesDugTarget):
+        if (fastStepping):
+            digger.performDigSegment(diggingMap, tilesDugTarget)
+        else:
+            digger.performDigIteration(diggingMap)
+
+    tileArray = np.zeros((chunkSize, chunkSize), dtype = TILEDTYPE)
+    tileArray[1:chunkSize - 1, 1:chunkSize - 1] = diggingMap.getTileArray()[:interiorSize, :interiorSize]
+    tileArray[0, westPortals] = CORRIDORTILE
+    tileArray[chunkSize - 1, eastPortals] = CORRIDORTILE
+    tileArray[southPortals, 0] = CORRIDORTILE
+    tileArray[northPortals, chunkSize - 1] = CORRIDORTILE
+    return tileArray
+
+
+class ChunkedWorld(object):
+    def __init__(self, worldSeed, chunkSize = DEFAULTCHUNKSIZE, percentAreaTarget = 40,
+                 directionPercentChance = 5, roomPercentChance = 5, fastStepping = False,
+                 cacheSize = DEFAULTCHUNKCACHESIZE, cacheDirectory = None):
+        if (chunkSize < 3):
+            raise ValueError("Chunks must be at least 3 tiles wide, not " + str(chunkSize))
+        self.worldSeed = worldSeed
+        self.chunkSize = chunkSize
+        self.parameters = {"version": GENERATORVERSION, "diggerVersion": DIGGERGENERATORVERSION,
+                           "worldSeed": worldSeed, "chunkSize": chunkSize,
+                           "percentAreaTarget": percentAreaTarget,
+                           "directionPercentChance": directionPercentChance,
+                           "roomPercentChance": roomPercentChance,
+                           "fastStepping": fastStepping}
+        self.cacheSize = cacheSize
+        self.cacheDirectory = cacheDirectory
+        if (cacheDirectory is not None):
+            os.makedirs(cacheDirectory, exist_ok = True)
+        self.chunks = OrderedDict()
+        # Cached chunks that were dug rather than read from cacheDirectory.
+        self.unstoredChunks = set()
+        self.hits = 0
+        self.misses = 0
+        self.chunksLoaded = 0
+        self.chunksGenerated = 0
+        self.chunksEvicted = 0
+
+    def __repr__(self):
+        return ("ChunkedWorld: seed " + str(self.worldSeed) + ", " + str(len(self.chunks)) + " of "
+                + str(self.cacheSize) + " chunks cached, " + str(self.hits) + " hits, "
+                + str(self.misses) + " misses")
+
+    def getChunkCoordinates(self, x, y):
+        return (x // self.chunkSize, y // self.chunkSize)
+
+    def getChunkPath(self, cx, cy):
+        return os.path.join(self.cacheDirectory, KINDCHUNK + "_" + str(cx) + "_" + str(cy) + MAPFILEEXTENSION)
+
+    def loadChunk(self, cx, cy):
+        path = self.getChunkPath(cx, cy)
+        if (not os.path.exists(path)):
+            return None
+        mapFile = loadMapFile(path, memoryMap = False)
+        chunkParameters = dict(mapFile.parameters)
+        if (chunkParameters.pop("cx", None) != cx or chunkParameters.pop("cy", None) != cy
+                or chunkParameters != self.parameters):
+            logger.info("Ignoring %s, which belongs to another world", path)
+            return None
+        self.chunksLoaded += 1
+        return np.array(mapFile.getTileArray())
+
+    def storeChunk(self, cx, cy, tileArray):
+        writeMapFile(self.getChunkPath(cx, cy), KINDCHUNK, tileArray,
+                     parameters = dict(self.parameters, cx = cx, cy = cy))
+        self.unstoredChunks.discard((cx, cy))
+
+    '''
+    Returns the tile array of chunk (cx, cy), from the cache, from disk or
+    freshly dug. The array belongs to the cache and must not be modified.
+    '''
+    def getChunk(self, cx, cy):
+        key = (cx, cy)
+        tileArray = self.chunks.get(key)
+        if (tileArray is not None):
+            self.hits += 1
+            self.chunks.move_to_end(key)
+            return tileArray
+        self.misses += 1
+        if (self.cacheDirectory is not None):
+            tileArray = self.loadChunk(cx, cy)
+        if (tileArray is None):
+            tileArray = generateChunk(self.worldSeed, cx, cy, self.chunkSize, self.parameters["percentAreaTarget"],
+                                      self.parameters["directionPercentChance"], self.parameters["roomPercentChance"],
+                                      self.parameters["fastStepping"])
+            self.chunksGenerated += 1
+            if (self.cacheDirectory is not None):
+                self.unstoredChunks.add(key)
+        self.chunks[key] = tileArray
+        while (len(self.chunks) > self.cacheSize):
+            self.evictChunk()
+        return tileArray
+
+    def evictChunk(self):
+        (cx, cy), tileArray = self.chunks.popitem(last = False)
+        self.chunksEvicted += 1
+        if ((cx, cy) in self.unstoredChunks):
+            self.storeChunk(cx, cy, tileArray)
+
+    '''
+    Writes every cached chunk that is not on disk yet to cacheDirectory.
+    '''
+    def flush(self):
+        for cx, cy in list(self.unstoredChunks):
+            self.storeChunk(cx, cy, self.chunks[(cx, cy)])
+
+    def getTile(self, x, y):
+        cx, cy = self.getChunkCoordinates(x, y)
+        return int(self.getChunk(cx, cy)[x - cx * self.chunkSize, y - cy * self.chunkSize])
+
+    '''
+    Returns a (width, height) tile array of the region with its lower left
+    corner at world coordinates (x, y), e.g. for a viewport.
+    '''
+    def getRegion(self, x, y, width, height):
+        region = np.empty((width, height), dtype = TILEDTYPE)
+        cxStart, cyStart = self.getChunkCoordinates(x, y)
+        cxEnd, cyEnd = self.getChunkCoordinates(x + width - 1, y + height - 1)
+        for cx in range(cxStart, cxEnd + 1):
+            chunkX = cx * self.chunkSize
+            xStart = max(x, chunkX)
+            xStop = min(x + width, chunkX + self.chunkSize)
+            for cy in range(cyStart, cyEnd + 1):
+                chunkY = cy * self.chunkSize
+                yStart = max(y, chunkY)
+                yStop = min(y + height, chunkY + self.chunkSize)
+                region[xStart - x:xStop - x, yStart - y:yStop - y] = \
+                    self.getChunk(cx, cy)[xStart - chunkX:xStop - chunkX, yStart - chunkY:yStop - chunkY]
+        return region
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Diagnostics shared by the procedural generation prototypes.
+
+PROVIDED AS IS WITHOUT WARRANTY OR GUARANTEE THAT IT WILL WORK.
+"""
+
+import logging
+
+'''
+All of the generators log through children of the "procgen" logger rather
+than printing. Nothing is emitted unless enableDiagnostics() is called (or the
+application configures logging itself), so the generators stay quiet and fast
+by default.
+
+Levels in use:
+INFO    - one line per major step (initializing a dig, connecting sub areas, ...)
+DEBUG   - verbose tracing: every tile, every iteration and every tree operation
+WARNING - a generator gave up (e.g. too many failed attempts)
+
+Per-tile and per-node messages are expensive to build, so call sites on hot
+paths check logger.isEnabledFor(logging.DEBUG) before formatting anything.
+'''
+
+ROOTLOGGERNAME = "procgen"
+DEFAULTLOGFORMAT = "%(name)s %(levelname)s: %(message)s"
+
+rootLogger = logging.getLogger(ROOTLOGGERNAME)
+rootLogger.addHandler(logging.NullHandler())
+
+
+def getDiagnosticsLogger(name):
+    return logging.getLogger(ROOTLOGGERNAME + "." + name)
+
+
+'''
+Turns on diagnostics output for every generator at the given level. Returns the
+handler that was installed so it can be passed to disableDiagnostics later.
+'''
+def enableDiagnostics(level = logging.DEBUG, stream = None, logFormat = DEFAULTLOGFORMAT):
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(logFormat))
+    rootLogger.addHandler(handler)
+    rootLogger.setLevel(level)
+    return handler
+
+
+def disableDiagnostics(handler = None):
+    if (handler is not None):
+        rootLogger.removeHandler(handler)
+    rootLogger.setLevel(logging.NOTSET)
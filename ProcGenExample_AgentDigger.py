@@ -8,9 +8,13 @@ PROVIDED AS IS WITHOUT WARRANTY OR GUARANTEE THAT IT WILL WORK.
 """
 
 import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
+from matplotlib.colors import ListedColormap
+import numpy as np
+import logging
+import math
 import random
-from random import randint
+
+from ProcGenDiagnostics import getDiagnosticsLogger, enableDiagnostics
 
 '''
 Classes to procedurally generate a map using a blind digger agent.
@@ -48,12 +52,30 @@ The algorithm closely follows that on page 39 of the .pdf:
 
 '''
 Some global variables to store parameters
+
+Tiles are stored as small integers so that a map fits in a compact uint8
+array. TILESYMBOLS maps them back to the original one character codes, and
+TILECOLORS to the colors maps are drawn with.
 '''
-UNDUGTILE = "X"
-CORRIDORTILE = "C"
-ROOMTILE = "R"
+UNDUGTILE = 0
+CORRIDORTILE = 1
+ROOMTILE = 2
+
+TILEDTYPE = np.uint8
+TILESYMBOLS = {UNDUGTILE: "X", CORRIDORTILE: "C", ROOMTILE: "R"}
+TILECOLORS = {UNDUGTILE: "blue", CORRIDORTILE: "grey", ROOMTILE: "orange"}
 
 DIRECTIONLIST = ["up", "down", "left", "right"]
+DIRECTIONSTEPS = {"up": (0, 1), "down": (0, -1), "left": (-1, 0), "right": (1, 0)}
+
+logger = getDiagnosticsLogger("digger")
+
+'''
+Version of the maps generateAgentDiggerMap makes. Bump it whenever a change makes it
+produce a different map for the same seed and parameters, so that maps cached
+by ProcGenCache are not reused.
+'''
+GENERATORVERSION = 3
 
 DEFAULTCHANGEDIRECTIONCHANCE = 1
 DEFAULTROOMBUILDINGCHANCE = 1
@@ -61,70 +83,221 @@ DEFAULTROOMBUILDINGCHANCE = 1
 INCREMENTOFDIRECTIONCHANGE = 0.05
 INCREMENTOFROOMBUILDING = 0.025
 
+# Straight corridors up to this long are dug tile by tile, longer ones as a slice.
+CORRIDORSLICELIMIT = 8
+
+# performDigSegment walks this many steps one at a time before it reads the
+# line ahead, since most segments end within them.
+DIGSEGMENTSCALARSTEPS = 8
+# Fewest tiles ahead performDigSegment reads at once after that.
+DIGSEGMENTWINDOW = 64
+
+# Digger steps between the deltas iterateAgentDiggerMap yields.
+DEFAULTITERATIONSPERDELTA = 100
+
+'''
+Color lookup table for drawing a tile array with imshow (use vmin = 0 and
+vmax = len(TILECOLORS) - 1 so each tile value maps to its own color).
+'''
+def getTileColormap():
+    return ListedColormap([TILECOLORS[tile] for tile in sorted(TILECOLORS)])
+
+'''
+Returns the smallest number of dug tiles for which the dug percentage of a map
+with the given area reaches percentArea, so loops can compare integers instead
+of floats.
+'''
+def getTilesDugTargetForArea(area, percentArea):
+    tilesDugTarget = max(int(math.ceil((percentArea / 100.0) * area)), 0)
+    # Nudge away from any floating point rounding in the estimate above.
+    while (tilesDugTarget > 0 and (float(tilesDugTarget - 1) / float(area)) * 100.0 >= percentArea):
+        tilesDugTarget -= 1
+    while ((float(tilesDugTarget) / float(area)) * 100.0 < percentArea):
+        tilesDugTarget += 1
+    return tilesDugTarget
+
 '''
 The DiggingMap class contains an x by y matrix of the map. Elements
 of the matrix correspond to tiles, and are either undug, corridors, or room tiles.
+
+The matrix is a uint8 numpy array of shape (width, height) indexed as
+tileMap[x, y]. getTileArray() hands out the array itself (not a copy) so
+downstream code can read it directly.
+
+Counts of corridor and room tiles are kept up to date on every transition
+(undug to corridor, undug to room, corridor to room), so tilesDug and
+percentAreaDug are cheap properties that never count a tile twice.
+
+An existing (width, height) uint8 array can be passed as tileArray to wrap it
+without copying, e.g. one map out of a BatchBlindDigger.
+
+Each map owns a random.Random (rng) that diggers working on it draw from unless
+they were given their own, so a seeded rng fully determines the dig.
+
+After startRecordingChanges, every dig that changes a tile also records the
+(x, y, width, height) rectangle it touched. Corridor tiles dug one after the
+other along a line are merged into one rectangle, so a straight corridor costs
+a single entry. takeDigDelta hands out what was recorded since the last call
+as a DigDelta and starts over.
 '''
 
 class DiggingMap(object):
-    def __init__(self, width, height):
+    def __init__(self, width, height, tileArray = None, rng = None):
+        self.rng = rng if rng is not None else random.Random()
         self.area = width * height
         self.width = width
         self.height= height
-        self.tilesDug = 0
-        self.percentAreaDug = (float(self.tilesDug) / float(self.area)) * 100.0
-        tileMap = []
-        for yVal in range(0, height):
-            xList = []
-            for xVal in range(0, width):
-                xList.append(UNDUGTILE)
-            tileMap.append(xList)
-        self.tileMap = tileMap
+        if (tileArray is None):
+            self.tileMap = np.full((width, height), UNDUGTILE, dtype = TILEDTYPE)
+            self.corridorTileCount = 0
+            self.roomTileCount = 0
+        else:
+            self.tileMap = tileArray
+            self.corridorTileCount = int(np.count_nonzero(tileArray == CORRIDORTILE))
+            self.roomTileCount = int(np.count_nonzero(tileArray == ROOMTILE))
+        self.dirtyRectangles = None
+    
+    def startRecordingChanges(self):
+        if (self.dirtyRectangles is None):
+            self.dirtyRectangles = []
+    
+    def stopRecordingChanges(self):
+        self.dirtyRectangles = None
+    
+    def markDirty(self, x, y, width, height):
+        if (self.dirtyRectangles is None):
+            return
+        if (width == 1 and height == 1 and len(self.dirtyRectangles) > 0):
+            lastX, lastY, lastWidth, lastHeight = self.dirtyRectangles[-1]
+            if (lastHeight == 1 and y == lastY and (x == lastX + lastWidth or x == lastX - 1)):
+                self.dirtyRectangles[-1] = (min(x, lastX), y, lastWidth + 1, 1)
+                return
+            if (lastWidth == 1 and x == lastX and (y == lastY + lastHeight or y == lastY - 1)):
+                self.dirtyRectangles[-1] = (x, min(y, lastY), 1, lastHeight + 1)
+                return
+        self.dirtyRectangles.append((x, y, width, height))
+    
+    '''
+    Returns a DigDelta of everything recorded since the last call, with a copy
+    of the tiles in each rectangle. iteration is passed through for consumers.
+    '''
+    def takeDigDelta(self, iteration = None, finished = False):
+        rectangles = self.dirtyRectangles if self.dirtyRectangles is not None else []
+        patches = [self.tileMap[x:x + width, y:y + height].copy() for x, y, width, height in rectangles]
+        if (self.dirtyRectangles is not None):
+            self.dirtyRectangles = []
+        return DigDelta(self.width, self.height, iteration, self.tilesDug, rectangles, patches, finished)
         
     def digRoomTile(self, x, y):
-        print("Attempting to dig room at coordinates " + str(x), str(y))
-        if ((x >= self.width - 1) or (y >= self.height - 1)):
-            print("Coordinate out of range")
-        elif ((x < 0) or (y < 0)):
-            print("Coordinates out of range.")
+        traceEnabled = logger.isEnabledFor(logging.DEBUG)
+        if (traceEnabled):
+            logger.debug("Attempting to dig room at coordinates %s %s", x, y)
+        if ((x >= self.width - 1) or (y >= self.height - 1) or (x < 0) or (y < 0)):
+            if (traceEnabled):
+                logger.debug("Coordinates out of range.")
         else:
-            self.tileMap[x][y] = ROOMTILE
-            self.tilesDug += 1
-            self.percentAreaDug = (float(self.tilesDug) / float(self.area)) * 100.0
+            currentTile = self.tileMap[x, y]
+            if (currentTile == UNDUGTILE):
+                self.roomTileCount += 1
+            elif (currentTile == CORRIDORTILE):
+                self.corridorTileCount -= 1
+                self.roomTileCount += 1
+            if (currentTile != ROOMTILE):
+                self.markDirty(x, y, 1, 1)
+            self.tileMap[x, y] = ROOMTILE
             
     def digCorridorTile(self, x, y):
-        print("Attempting to dig corridor at coordinates " + str(x), str(y))
-        if ((x >= self.width - 1) or (y >= self.height - 1)):
-            print("Coordinate out of range.")
-        elif ((x < 0) or (y < 0)):
-            print("Coordinates out of range.")
-        elif (self.tileMap[x][y] == ROOMTILE):
-            print("Tile is already a room, no need to dig.")
+        traceEnabled = logger.isEnabledFor(logging.DEBUG)
+        if (traceEnabled):
+            logger.debug("Attempting to dig corridor at coordinates %s %s", x, y)
+        if ((x >= self.width - 1) or (y >= self.height - 1) or (x < 0) or (y < 0)):
+            if (traceEnabled):
+                logger.debug("Coordinates out of range.")
+        elif (self.tileMap[x, y] != UNDUGTILE):
+            if (traceEnabled):
+                logger.debug("Tile is already dug, no need to dig.")
         else:
-            self.tileMap[x][y] = CORRIDORTILE
-            self.tilesDug += 1
-            self.percentAreaDug = (float(self.tilesDug) / float(self.area)) * 100.0
+            self.tileMap[x, y] = CORRIDORTILE
+            self.corridorTileCount += 1
+            if (self.dirtyRectangles is not None):
+                self.markDirty(x, y, 1, 1)
+    
+    '''
+    Digs every tile in the rectangle spanning (xMin, yMin) to (xMax, yMax), inclusive.
+    The rectangle is clipped once to the same bounds that digRoomTile enforces
+    and written as a single slice. Only tiles that were previously undug count
+    towards tilesDug; corridor tiles inside the room are converted to room tiles.
+    '''
+    def digRoomRectangle(self, xMin, yMin, xMax, yMax):
+        xStart = max(xMin, 0)
+        yStart = max(yMin, 0)
+        xStop = min(xMax + 1, self.width - 1)
+        yStop = min(yMax + 1, self.height - 1)
+        if (xStart >= xStop or yStart >= yStop):
+            logger.debug("Room rectangle out of range.")
+            return
+        roomSlice = self.tileMap[xStart:xStop, yStart:yStop]
+        corridorsConverted = int(np.count_nonzero(roomSlice == CORRIDORTILE))
+        newRoomTiles = int(np.count_nonzero(roomSlice != ROOMTILE))
+        roomSlice[...] = ROOMTILE
+        self.corridorTileCount -= corridorsConverted
+        self.roomTileCount += newRoomTiles
+        if (newRoomTiles > 0):
+            self.markDirty(xStart, yStart, xStop - xStart, yStop - yStart)
+    
+    @property
+    def undugTileCount(self):
+        return self.area - self.corridorTileCount - self.roomTileCount
+    
+    @property
+    def tilesDug(self):
+        return self.corridorTileCount + self.roomTileCount
+    
+    @property
+    def percentAreaDug(self):
+        return (float(self.corridorTileCount + self.roomTileCount) / float(self.area)) * 100.0
+    
+    def getTilesDugTarget(self, percentArea):
+        return getTilesDugTargetForArea(self.area, percentArea)
     
     def getTileAtLocation(self, x, y):
-        return self.tileMap[x][y]
+        return int(self.tileMap[x, y])
+    
+    '''
+    Digs the corridor tiles (x + dx, y + dy) up to (x + length * dx, y + length * dy)
+    as a single slice, clipped to the same bounds that digCorridorTile enforces.
+    Returns the number of tiles that were undug before.
+    '''
+    def digCorridorLine(self, x, y, dx, dy, length):
+        if (length <= 0):
+            return 0
+        xStart = max(min(x + dx, x + dx * length), 0)
+        xStop = min(max(x + dx, x + dx * length) + 1, self.width - 1)
+        yStart = max(min(y + dy, y + dy * length), 0)
+        yStop = min(max(y + dy, y + dy * length) + 1, self.height - 1)
+        if (xStart >= xStop or yStart >= yStop):
+            return 0
+        lineSlice = self.tileMap[xStart:xStop, yStart:yStop]
+        undugTiles = (lineSlice == UNDUGTILE)
+        newCorridorTiles = int(np.count_nonzero(undugTiles))
+        lineSlice[undugTiles] = CORRIDORTILE
+        self.corridorTileCount += newCorridorTiles
+        if (newCorridorTiles > 0):
+            self.markDirty(xStart, yStart, xStop - xStart, yStop - yStart)
+        return newCorridorTiles
+    
+    def getTileArray(self):
+        return self.tileMap
     
+    '''
+    Draws the whole map as a single image, tile (x, y) covering the unit
+    square at (x, y). See ProcGenRender for drawing without a window.
+    '''
     def plotDiggingMap(self):
-        tileList = []
-        for xVal in range(len(self.tileMap)):
-            for yVal in range(len(self.tileMap[xVal])):                  
-                if self.tileMap[xVal][yVal] == CORRIDORTILE:
-                    newRectangle = Rectangle((xVal, yVal), 1, 1, facecolor = "grey")
-                    tileList.append(newRectangle)
-                if self.tileMap[xVal][yVal] == ROOMTILE:
-                    newRectangle = Rectangle((xVal, yVal), 1, 1, facecolor = "orange")
-                    tileList.append(newRectangle)
-       
         fig = plt.figure()
         ax = fig.gca()  #GCA = get current axes
-        backgroundTile = Rectangle((0, 0), self.width, self.height, facecolor = "blue")
-        ax.add_patch(backgroundTile)
-        for tile in tileList:
-            ax.add_patch(tile)
+        ax.imshow(self.tileMap.T, cmap = getTileColormap(), vmin = 0, vmax = len(TILECOLORS) - 1,
+                  origin = "lower", interpolation = "nearest", extent = (0, self.width, 0, self.height))
 
         ax.set_ylim(0,  self.height - 1)
         ax.set_xlim(0,  self.width - 1)
@@ -135,15 +308,142 @@ class DiggingMap(object):
     def getHeight(self):
         return self.height
 
+'''
+The tiles that changed in a DiggingMap over some stretch of digging.
+rectangles holds (x, y, width, height) tuples and patches the tiles inside
+each of them, as (width, height) arrays indexed [x, y] like the map. Some
+tiles inside a rectangle may not actually have changed, but every changed
+tile is inside one. Later rectangles take precedence where they overlap.
+iteration is the number of digger steps taken so far, and finished is True
+for the last delta of a dig.
+'''
+
+class DigDelta(object):
+    def __init__(self, width, height, iteration, tilesDug, rectangles, patches, finished = False):
+        self.width = width
+        self.height = height
+        self.iteration = iteration
+        self.tilesDug = tilesDug
+        self.rectangles = rectangles
+        self.patches = patches
+        self.finished = finished
+        
+    def __repr__(self):
+        return ("DigDelta: iteration " + str(self.iteration) + ", " + str(len(self.rectangles))
+                + " rectangles, " + str(self.getCellCount()) + " cells")
+    
+    def getCellCount(self):
+        return sum(width * height for x, y, width, height in self.rectangles)
+    
+    '''
+    Writes the patches into tileArray, bringing a copy of the map up to date.
+    '''
+    def applyTo(self, tileArray):
+        for (x, y, width, height), patch in zip(self.rectangles, self.patches):
+            tileArray[x:x + width, y:y + height] = patch
+        return tileArray
+
+'''
+Returns the chance that randint(0, 99) < percentChance.
+'''
+def getRollProbability(percentChance):
+    return min(max(math.ceil(percentChance), 0), 100) / 100.0
+
+'''
+Returns how many steps in a row, starting with this one and at most stepLimit,
+roll against the same whole percent when percentChance grows by increment
+every step. The increments are added one at a time, as performDigIteration
+adds them, so the chance crosses each whole percent on the same step.
+'''
+def getStepsAtRollProbability(percentChance, increment, stepLimit):
+    rollProbability = getRollProbability(percentChance)
+    if (increment == 0 or rollProbability == (1.0 if increment > 0 else 0.0)):
+        return stepLimit
+    rolledPercent = math.ceil(percentChance)
+    steps = 1
+    percentChance = percentChance + increment
+    while (steps < stepLimit and math.ceil(percentChance) == rolledPercent):
+        percentChance = percentChance + increment
+        steps += 1
+    return steps
+
+'''
+Returns percentChance after steps increments, added one at a time.
+'''
+def getRampedChance(percentChance, increment, steps):
+    for step in range(steps):
+        percentChance = percentChance + increment
+    return percentChance
+
+'''
+Returns how many of the next stepLimit steps an agent survives without an
+event, given it has already survived stretchSteps steps at
+stepSurvivalProbability since its survival probability was survivalBase. The
+event comes on the first step at which survivalBase * stepSurvivalProbability
+** steps drops below eventThreshold. The logarithms only give a first guess;
+the answer is settled with the same powers performDigSegment compares one step
+at a time, so it does not depend on how the steps are grouped.
+'''
+def getSurvivedSteps(survivalBase, stepSurvivalProbability, stretchSteps, eventThreshold, stepLimit):
+    if (stepSurvivalProbability == 1.0):
+        return stepLimit
+    estimate = math.log(eventThreshold / survivalBase) / math.log(stepSurvivalProbability) - stretchSteps
+    survivedSteps = min(max(int(estimate), 0), stepLimit)
+    while (survivedSteps > 0
+           and survivalBase * stepSurvivalProbability ** (stretchSteps + survivedSteps) < eventThreshold):
+        survivedSteps -= 1
+    while (survivedSteps < stepLimit
+           and survivalBase * stepSurvivalProbability ** (stretchSteps + survivedSteps + 1) >= eventThreshold):
+        survivedSteps += 1
+    return survivedSteps
+
+'''
+Returns the length tiles from (x, y) in steps of (dx, dy), as a view of tileMap.
+'''
+def getLineTiles(tileMap, x, y, dx, dy, length):
+    if (dx > 0):
+        return tileMap[x:x + length, y]
+    if (dx < 0):
+        return tileMap[x - length + 1:x + 1, y][::-1]
+    if (dy > 0):
+        return tileMap[x, y:y + length]
+    return tileMap[x, y - length + 1:y + 1][::-1]
+
 '''
 The BlindDigger class can dig in DiggingMap. Most of the work is done
 in the performDigIteration function.
+
+All random draws come from rng; if none is given, the digger uses the rng of
+the DiggingMap it is digging in. With a keyedSeed the digger makes the keyed
+draws of BatchBlindDigger instead (see below), and digs the same map as a batch
+agent with that seed.
+
+At an edge of the map the agent turns back, unless it rolled a direction
+change on that step that keeps it on the map. Letting the bounce win would
+trap an agent that walks a row or column of room tiles (where it never rolls
+for a turn) between two edges forever.
+
+performDigSegment is a faster way to dig the same maps. While the agent walks
+straight, nothing but its two chances changes, and they ramp by fixed
+increments, so the chance that the first direction change or room happens on
+any given step ahead is known in advance. performDigSegment draws that step
+once, carves the straight corridor up to it (as one slice, unless it is
+short) and plays out the event step with applyDigStep, exactly as
+performDigIteration would. Near the edges of the map, where the agent bounces,
+it falls back to performDigIteration.
+Maps come out with the same distribution as with performDigIteration, but not
+the same map for the same seed, since the random draws are made differently.
+Keyed draws are made per step, so with a keyedSeed performDigSegment takes
+single steps.
 '''
 
 class BlindDigger(object):
     def __init__(self, directionPercentChance = 5, roomPercentChance = 5, 
                  location = (0, 0), direction = "up", 
-                 roomWidthRange = (3, 7), roomHeightRange = (3, 7)):
+                 roomWidthRange = (3, 7), roomHeightRange = (3, 7), rng = None, keyedSeed = None):
+        self.rng = rng
+        self.seedKey = getSeedKey(keyedSeed) if keyedSeed is not None else None
+        self.iteration = 0
         self.percentChanceOfChangingDirection = directionPercentChance
         self.percentChanceOfBuildingRoom = roomPercentChance
         self.location = location
@@ -157,69 +457,90 @@ class BlindDigger(object):
     def setLocation(self, inputLocation):
         self.location = inputLocation
     
+    '''
+    Draws an integer in [low, high] from rng, or the keyed draw for slot on
+    the current iteration when the digger has a keyedSeed.
+    '''
+    def drawInteger(self, rng, slot, low, high):
+        if (self.seedKey is None):
+            return rng.randint(low, high)
+        return getKeyedRandomInteger(self.seedKey, self.iteration, slot, low, high)
+    
+    def drawDirection(self, rng, slot):
+        if (self.seedKey is None):
+            return rng.choice(DIRECTIONLIST)
+        return DIRECTIONLIST[getKeyedRandomInteger(self.seedKey, self.iteration, slot, 0, len(DIRECTIONLIST) - 1)]
+    
     def initializeDig(self, diggingMap):
-        print("Initializing dig")
-        initialXLocation = randint(0, diggingMap.getWidth() - 1)
-        initialYLocation = randint(0, diggingMap.getHeight() - 1)
+        logger.info("Initializing dig")
+        rng = self.rng if self.rng is not None else diggingMap.rng
+        initialXLocation = self.drawInteger(rng, DIGROLLINITIALX, 0, diggingMap.getWidth() - 1)
+        initialYLocation = self.drawInteger(rng, DIGROLLINITIALY, 0, diggingMap.getHeight() - 1)
         self.location = (initialXLocation, initialYLocation)
         
         diggingMap.digCorridorTile(self.location[0], self.location[1])
         
-        self.direction = random.choice(DIRECTIONLIST)
+        self.direction = self.drawDirection(rng, DIGROLLINITIALDIRECTION)
         
     def performDigIteration(self, diggingMap):
-        print("Performing iteration of digging")
+        traceEnabled = logger.isEnabledFor(logging.DEBUG)
+        if (traceEnabled):
+            logger.debug("Performing iteration of digging at %s heading %s", self.location, self.direction)
+        rng = self.rng if self.rng is not None else diggingMap.rng
         currentTile = diggingMap.getTileAtLocation(self.location[0], self.location[1])
         
         
         # Chance to switch direction
-        directionRoll = randint(0, 99)
+        directionRoll = self.drawInteger(rng, DIGROLLDIRECTION, 0, 99)
+        newDirection = None
         if (directionRoll < self.percentChanceOfChangingDirection and currentTile != ROOMTILE):
-            self.direction = random.choice(DIRECTIONLIST)
+            newDirection = self.drawDirection(rng, DIGROLLDIRECTIONCHOICE)
+
+        roomRoll = self.drawInteger(rng, DIGROLLROOM, 0, 99)
+        roomSize = None
+        if (roomRoll < self.percentChanceOfBuildingRoom and currentTile != ROOMTILE):
+            if (traceEnabled):
+                logger.debug("Building room. Percent chance of room is %s and roll was %s", self.percentChanceOfBuildingRoom, roomRoll)
+            roomSize = (self.drawInteger(rng, DIGROLLROOMWIDTH, self.roomWidthRange[0], self.roomWidthRange[1]),
+                        self.drawInteger(rng, DIGROLLROOMHEIGHT, self.roomHeightRange[0], self.roomHeightRange[1]))
+        
+        self.applyDigStep(diggingMap, currentTile, newDirection, roomSize)
+        self.iteration += 1
+    
+    '''
+    Carries out one step whose rolls have already been made: newDirection is
+    None unless the direction roll succeeded, and roomSize is None unless the
+    room roll did.
+    '''
+    def applyDigStep(self, diggingMap, currentTile, newDirection, roomSize):
+        traceEnabled = logger.isEnabledFor(logging.DEBUG)
+        if (newDirection is not None):
+            self.direction = newDirection
             self.percentChangeOfChangingDirection = DEFAULTCHANGEDIRECTIONCHANCE
         elif (currentTile == ROOMTILE):
             self.percentChangeOfChangingDirection = DEFAULTCHANGEDIRECTIONCHANCE
         else:
             self.percentChanceOfChangingDirection = self.percentChanceOfChangingDirection + INCREMENTOFDIRECTIONCHANGE
 
-        roomRoll = randint(0, 99)
-        if (roomRoll < self.percentChanceOfBuildingRoom and currentTile != ROOMTILE):
-            print("Building room. Percent chance of room is ", self.percentChanceOfBuildingRoom, " and roll was ", roomRoll)
+        if (roomSize is not None):
             # Choose room width
-            roomWidth = randint(self.roomWidthRange[0], self.roomWidthRange[1])
+            roomWidth = roomSize[0]
             roomWidthDiv2 = int(round((roomWidth / 2.0)))
             roomWidthRemainder = roomWidth - roomWidthDiv2
             # Choose room height
-            roomHeight = randint(self.roomHeightRange[0], self.roomHeightRange[1])
+            roomHeight = roomSize[1]
             roomHeightDiv2 = int(round((roomHeight / 2.0)))
             roomHeightRemainder = roomHeight - roomHeightDiv2
             
             
-            print(roomWidthDiv2, roomWidthRemainder, roomHeightDiv2, roomHeightRemainder)
-            # Cover the 4 quarters.
-            # Positive X, Positive Y            
-            for xIncrement in range(0, roomWidthDiv2 + 1):
-                for yIncrement in range(0, roomHeightDiv2 + 1):
-                    print("Building room coord ", xIncrement, yIncrement, " from ", self.location)
-                    diggingMap.digRoomTile(self.location[0] + xIncrement, self.location[1] + yIncrement)
-            # Positive X, Negative Y
-            for xIncrement in range(0, roomWidthDiv2 + 1):
-                for yIncrement in range(0, roomHeightRemainder + 1):
-                    print(xIncrement, yIncrement)
-                    diggingMap.digRoomTile(self.location[0] + xIncrement, self.location[1] - yIncrement)
-                
-            # Negative X, Negative Y
-            for xIncrement in range(0, roomWidthRemainder + 1):
-                for yIncrement in range(0, roomHeightRemainder + 1):
-                    print(xIncrement, yIncrement)
-                    diggingMap.digRoomTile(self.location[0] - xIncrement, self.location[1] - yIncrement)
-                
-            # Negative X, Positive Y
-            for xIncrement in range(0, roomWidthRemainder + 1):
-                for yIncrement in range(0, roomHeightDiv2 + 1):
-                    print(xIncrement, yIncrement)
-                    diggingMap.digRoomTile(self.location[0] - xIncrement, self.location[1] + yIncrement)
-                
+            if (traceEnabled):
+                logger.debug("Room extents: %s %s %s %s", roomWidthDiv2, roomWidthRemainder, roomHeightDiv2, roomHeightRemainder)
+            # The room spans roomWidthRemainder tiles to the left of the agent and
+            # roomWidthDiv2 tiles to its right (likewise for height), all inclusive.
+            diggingMap.digRoomRectangle(self.location[0] - roomWidthRemainder,
+                                        self.location[1] - roomHeightRemainder,
+                                        self.location[0] + roomWidthDiv2,
+                                        self.location[1] + roomHeightDiv2)
             
             self.percentChanceOfBuildingRoom = DEFAULTROOMBUILDINGCHANCE
         elif (currentTile == ROOMTILE):
@@ -237,6 +558,8 @@ class BlindDigger(object):
             self.direction = "up"
         if (self.location[1] == diggingMap.getHeight() - 1):
             self.direction = "down"
+        if (newDirection is not None and self.canStep(diggingMap, newDirection)):
+            self.direction = newDirection
         
         if (self.direction == "up"):
             self.location = (self.location[0], self.location[1] + 1)
@@ -250,26 +573,508 @@ class BlindDigger(object):
         
         diggingMap.digCorridorTile(self.location[0], self.location[1])
     
+    '''
+    True if a step in direction from the current location stays on the map.
+    '''
+    def canStep(self, diggingMap, direction):
+        dx, dy = DIRECTIONSTEPS[direction]
+        x = self.location[0] + dx
+        y = self.location[1] + dy
+        return (x >= 0 and y >= 0 and x < diggingMap.getWidth() and y < diggingMap.getHeight())
+    
+    '''
+    Digs up to the next direction change, room or edge of the map in one go, or
+    until tilesDugTarget tiles are dug, whichever comes first. Returns the
+    number of steps (performDigIteration calls) this stood in for.
+    
+    The event comes on the first step at which the chance of getting that far
+    without one drops below a single uniform draw. Both chances are rounded
+    up to whole percents before they are rolled against, so the chance of an
+    event per step stays the same until one of them passes the next whole
+    percent. While it does, the chance of getting this far is kept as
+    survivalBase times a power of it (see getSurvivedSteps), and the chances
+    are ramped one increment at a time, as performDigIteration ramps them.
+    Most segments end within a few steps, so the first DIGSEGMENTSCALARSTEPS
+    are walked one at a time. After that, the tiles ahead are read in windows
+    of at least DIGSEGMENTWINDOW and skipped a stretch of equal chances at a
+    time. Either way the same numbers are compared, so the map does not
+    depend on DIGSEGMENTSCALARSTEPS or DIGSEGMENTWINDOW. Standing on a room
+    tile leaves the direction chance alone, resets the room chance and never
+    triggers an event.
+    '''
+    def performDigSegment(self, diggingMap, tilesDugTarget):
+        rng = self.rng if self.rng is not None else diggingMap.rng
+        width = diggingMap.getWidth()
+        height = diggingMap.getHeight()
+        x, y = self.location
+        if (self.seedKey is not None or x < 1 or y < 1 or x > width - 2 or y > height - 2):
+            self.performDigIteration(diggingMap)
+            return 1
+        
+        # Steps 0 to stepCount - 1 start inside the edges, so none of them bounces.
+        dx, dy = DIRECTIONSTEPS[self.direction]
+        if (dx > 0):
+            stepCount = width - 1 - x
+        elif (dx < 0):
+            stepCount = x
+        elif (dy > 0):
+            stepCount = height - 1 - y
+        else:
+            stepCount = y
+        
+        tileMap = diggingMap.tileMap
+        eventThreshold = None
+        survivalBase = 1.0
+        stretchProbabilities = None
+        stretchSteps = 0
+        directionChance = self.percentChanceOfChangingDirection
+        roomChance = self.percentChanceOfBuildingRoom
+        tilesToDig = tilesDugTarget - diggingMap.tilesDug
+        eventStep = None
+        step = 0
+        scalarStepCount = min(stepCount, DIGSEGMENTSCALARSTEPS)
+        while (step < scalarStepCount):
+            stepX = x + dx * step
+            stepY = y + dy * step
+            currentTile = tileMap.item(stepX, stepY)
+            if (currentTile == ROOMTILE):
+                roomChance = DEFAULTROOMBUILDINGCHANCE
+            else:
+                directionProbability = getRollProbability(directionChance)
+                roomProbability = getRollProbability(roomChance)
+                if (stretchProbabilities != (directionProbability, roomProbability)):
+                    if (stretchProbabilities is not None):
+                        survivalBase *= stepSurvivalProbability ** stretchSteps
+                    stretchProbabilities = (directionProbability, roomProbability)
+                    stretchSteps = 0
+                    stepSurvivalProbability = (1.0 - directionProbability) * (1.0 - roomProbability)
+                if (eventThreshold is None and stepSurvivalProbability > 0.0):
+                    eventThreshold = 1.0 - rng.random()
+                if (stepSurvivalProbability == 0.0
+                        or survivalBase * stepSurvivalProbability ** (stretchSteps + 1) < eventThreshold):
+                    eventStep = step
+                    break
+                stretchSteps += 1
+                directionChance = directionChance + INCREMENTOFDIRECTIONCHANGE
+                roomChance = roomChance + INCREMENTOFROOMBUILDING
+            step += 1
+            # digCorridorTile never digs the far edge.
+            nextX = stepX + dx
+            nextY = stepY + dy
+            if (nextX < width - 1 and nextY < height - 1 and tileMap.item(nextX, nextY) == UNDUGTILE):
+                tilesToDig -= 1
+                if (tilesToDig <= 0):
+                    break
+        
+        tiles = []
+        lastDiggableStep = stepCount if (dx < 0 or dy < 0) else stepCount - 1
+        while (eventStep is None and tilesToDig > 0 and step < stepCount):
+            if (len(tiles) <= min(stepCount, step + DIGSEGMENTWINDOW)):
+                tiles = getLineTiles(tileMap, x, y, dx, dy,
+                                     min(stepCount + 1, max(2 * len(tiles), step + DIGSEGMENTWINDOW + 1))).tolist()
+            currentTile = tiles[step]
+            stretchEnd = min(stepCount, step + DIGSEGMENTWINDOW)
+            if (currentTile == ROOMTILE):
+                roomChance = DEFAULTROOMBUILDINGCHANCE
+                survivedSteps = 1
+                while (step + survivedSteps < stretchEnd and tiles[step + survivedSteps] == ROOMTILE):
+                    survivedSteps += 1
+            else:
+                directionProbability = getRollProbability(directionChance)
+                roomProbability = getRollProbability(roomChance)
+                if (stretchProbabilities != (directionProbability, roomProbability)):
+                    if (stretchProbabilities is not None):
+                        survivalBase *= stepSurvivalProbability ** stretchSteps
+                    stretchProbabilities = (directionProbability, roomProbability)
+                    stretchSteps = 0
+                    stepSurvivalProbability = (1.0 - directionProbability) * (1.0 - roomProbability)
+                if (eventThreshold is None and stepSurvivalProbability > 0.0):
+                    eventThreshold = 1.0 - rng.random()
+                if (stepSurvivalProbability == 0.0):
+                    eventStep = step
+                    break
+                # Steps step to step + stretchLength - 1 share stepSurvivalProbability.
+                stretchLength = getStepsAtRollProbability(directionChance, INCREMENTOFDIRECTIONCHANGE, stretchEnd - step)
+                stretchLength = getStepsAtRollProbability(roomChance, INCREMENTOFROOMBUILDING, stretchLength)
+                if (ROOMTILE in tiles[step + 1:step + stretchLength]):
+                    stretchLength = tiles.index(ROOMTILE, step + 1, step + stretchLength) - step
+                survivedSteps = getSurvivedSteps(survivalBase, stepSurvivalProbability, stretchSteps,
+                                                 eventThreshold, stretchLength)
+                if (survivedSteps == 0):
+                    eventStep = step
+                    break
+                if (survivedSteps < stretchLength):
+                    eventStep = step + survivedSteps
+            
+            # Each step survived moves the agent onto the next tile, digging it.
+            newTiles = tiles[step + 1:min(step + survivedSteps, lastDiggableStep) + 1].count(UNDUGTILE)
+            if (newTiles >= tilesToDig):
+                for survivedStep in range(survivedSteps):
+                    if (tiles[step + survivedStep + 1] == UNDUGTILE):
+                        tilesToDig -= 1
+                        if (tilesToDig == 0):
+                            survivedSteps = survivedStep + 1
+                            break
+                eventStep = None
+            tilesToDig -= newTiles
+            if (currentTile != ROOMTILE):
+                stretchSteps += survivedSteps
+                directionChance = getRampedChance(directionChance, INCREMENTOFDIRECTIONCHANGE, survivedSteps)
+                roomChance = getRampedChance(roomChance, INCREMENTOFROOMBUILDING, survivedSteps)
+            step += survivedSteps
+            if (eventStep is not None):
+                currentTile = tiles[step]
+        
+        if (step > CORRIDORSLICELIMIT):
+            diggingMap.digCorridorLine(x, y, dx, dy, step)
+        elif (step > 0):
+            for straightStep in range(1, step + 1):
+                diggingMap.digCorridorTile(x + dx * straightStep, y + dy * straightStep)
+        self.location = (x + dx * step, y + dy * step)
+        self.percentChanceOfChangingDirection = directionChance
+        self.percentChanceOfBuildingRoom = roomChance
+        if (eventStep is None):
+            return step
+        
+        # Split the chance of an event on eventStep into room only, room and
+        # direction change, and direction change only. Given the event, the
+        # threshold is uniform over the survival probability this step lost,
+        # so it can pick the kind of event too.
+        if (eventThreshold is None):
+            eventRoll = rng.random() * (1.0 - stepSurvivalProbability)
+        else:
+            survivalProbability = survivalBase * stepSurvivalProbability ** stretchSteps
+            eventRoll = (survivalProbability - eventThreshold) / survivalProbability
+        newDirection = None
+        if (eventRoll >= (1.0 - directionProbability) * roomProbability):
+            newDirection = rng.choice(DIRECTIONLIST)
+        roomSize = None
+        if (eventRoll < roomProbability):
+            roomSize = (rng.randint(self.roomWidthRange[0], self.roomWidthRange[1]),
+                        rng.randint(self.roomHeightRange[0], self.roomHeightRange[1]))
+        self.applyDigStep(diggingMap, currentTile, newDirection, roomSize)
+        return step + 1
+    
+    '''
+    Digs until tilesDugTarget tiles are dug, yielding a DigDelta of the tiles
+    changed roughly every iterationsPerDelta steps and a final one with
+    finished set. Changes made to diggingMap before this starts are only in
+    the first delta if it was already recording them.
+    '''
+    def iterateDig(self, diggingMap, tilesDugTarget, iterationsPerDelta = DEFAULTITERATIONSPERDELTA,
+                   fastStepping = False):
+        diggingMap.startRecordingChanges()
+        try:
+            iteration = 0
+            lastDeltaIteration = 0
+            while (diggingMap.tilesDug < tilesDugTarget):
+                if (fastStepping):
+                    iteration += self.performDigSegment(diggingMap, tilesDugTarget)
+                else:
+                    self.performDigIteration(diggingMap)
+                    iteration += 1
+                if (iteration - lastDeltaIteration >= iterationsPerDelta and diggingMap.tilesDug < tilesDugTarget):
+                    lastDeltaIteration = iteration
+                    yield diggingMap.takeDigDelta(iteration)
+            yield diggingMap.takeDigDelta(iteration, finished = True)
+        finally:
+            diggingMap.stopRecordingChanges()
         
     
 '''
-Main logic function
+Keyed random draws for BatchBlindDigger.
+
+Every draw an agent makes is a pure function of (seed, iteration, slot), computed
+with the splitmix64 mixer, instead of coming from a shared stream. That lets all
+agents in a batch roll at once with numpy, and means a map depends only on its
+own seed: it comes out the same whether it is run alone (a BlindDigger with a
+keyedSeed, or generateAgentDiggerMap with keyedRandom) or alongside any number
+of other seeds. getSeedKey and getKeyedRandomInteger are the single draw
+versions of getSeedKeys and getKeyedRandomIntegers, in plain integers.
 '''
+
+DIGROLLDIRECTION = 0
+DIGROLLDIRECTIONCHOICE = 1
+DIGROLLROOM = 2
+DIGROLLROOMWIDTH = 3
+DIGROLLROOMHEIGHT = 4
+DIGROLLINITIALX = 5
+DIGROLLINITIALY = 6
+DIGROLLINITIALDIRECTION = 7
+DIGROLLSLOTCOUNT = 8
+
+SPLITMIXGAMMA = np.uint64(0x9E3779B97F4A7C15)
+SPLITMIXMULTIPLIERFIRST = np.uint64(0xBF58476D1CE4E5B9)
+SPLITMIXMULTIPLIERSECOND = np.uint64(0x94D049BB133111EB)
+UINT64MASK = 0xFFFFFFFFFFFFFFFF
+
+def splitMix64(values):
+    values = values ^ (values >> np.uint64(30))
+    values = values * SPLITMIXMULTIPLIERFIRST
+    values = values ^ (values >> np.uint64(27))
+    values = values * SPLITMIXMULTIPLIERSECOND
+    return values ^ (values >> np.uint64(31))
+
+def getSeedKeys(seeds):
+    seedArray = np.array([int(seed) & UINT64MASK for seed in seeds], dtype = np.uint64)
+    return splitMix64(seedArray + SPLITMIXGAMMA)
+
+def splitMix64Integer(value):
+    value = value ^ (value >> 30)
+    value = (value * int(SPLITMIXMULTIPLIERFIRST)) & UINT64MASK
+    value = value ^ (value >> 27)
+    value = (value * int(SPLITMIXMULTIPLIERSECOND)) & UINT64MASK
+    return value ^ (value >> 31)
+
+def getSeedKey(seed):
+    return splitMix64Integer(((int(seed) & UINT64MASK) + int(SPLITMIXGAMMA)) & UINT64MASK)
+
+'''
+Returns one integer in [low, high] (inclusive, like randint) per seed key, for
+the given iteration(s) and roll slot.
+'''
+def getKeyedRandomIntegers(seedKeys, iterations, slot, low, high):
+    drawIndex = np.asarray(iterations, dtype = np.uint64) * np.uint64(DIGROLLSLOTCOUNT) + np.uint64(slot + 1)
+    values = splitMix64(seedKeys + drawIndex * SPLITMIXGAMMA)
+    return (values % np.uint64(high - low + 1)).astype(np.int64) + low
+
+def getKeyedRandomInteger(seedKey, iteration, slot, low, high):
+    drawIndex = (iteration * DIGROLLSLOTCOUNT + slot + 1) & UINT64MASK
+    value = splitMix64Integer((seedKey + drawIndex * int(SPLITMIXGAMMA)) & UINT64MASK)
+    return value % (high - low + 1) + low
+
+DIRECTIONXSTEPS = np.array([0, 0, -1, 1], dtype = np.int64)  # Indexed like DIRECTIONLIST
+DIRECTIONYSTEPS = np.array([1, -1, 0, 0], dtype = np.int64)
+
+'''
+The BatchBlindDigger advances one BlindDigger walk per seed, all in lockstep, on
+a (batchSize, width, height) uint8 array. Each iteration follows the same steps
+as BlindDigger.performDigIteration, but rolls for every agent at once using the
+keyed draws above. Agents that have reached their coverage target are masked
+out and stop changing.
+'''
+
+class BatchBlindDigger(object):
+    def __init__(self, seeds, width, height, percentAreaTarget = 40,
+                 directionPercentChance = 5, roomPercentChance = 5,
+                 roomWidthRange = (3, 7), roomHeightRange = (3, 7)):
+        self.seeds = list(seeds)
+        self.seedKeys = getSeedKeys(self.seeds)
+        self.batchSize = len(self.seeds)
+        self.width = width
+        self.height = height
+        self.area = width * height
+        self.tilesDugTarget = getTilesDugTargetForArea(self.area, percentAreaTarget)
+        self.roomWidthRange = roomWidthRange
+        self.roomHeightRange = roomHeightRange
         
-def generateAgentDiggerMap():
-    mapHeight = 50
-    mapWidth = 50
-    digger = BlindDigger()
+        self.tileMaps = np.full((self.batchSize, width, height), UNDUGTILE, dtype = TILEDTYPE)
+        self.corridorTileCounts = np.zeros(self.batchSize, dtype = np.int64)
+        self.roomTileCounts = np.zeros(self.batchSize, dtype = np.int64)
+        self.xLocations = np.zeros(self.batchSize, dtype = np.int64)
+        self.yLocations = np.zeros(self.batchSize, dtype = np.int64)
+        self.directions = np.zeros(self.batchSize, dtype = np.int64)
+        self.percentChancesOfChangingDirection = np.full(self.batchSize, directionPercentChance, dtype = np.float64)
+        self.percentChancesOfBuildingRoom = np.full(self.batchSize, roomPercentChance, dtype = np.float64)
+        self.iterations = np.zeros(self.batchSize, dtype = np.int64)
+    
+    def getTilesDug(self):
+        return self.corridorTileCounts + self.roomTileCounts
+    
+    def getActiveAgents(self):
+        return np.flatnonzero(self.getTilesDug() < self.tilesDugTarget)
+    
+    def getDiggingMap(self, index):
+        return DiggingMap(self.width, self.height, self.tileMaps[index])
+    
+    def initializeDig(self):
+        logger.info("Initializing batch dig of %s maps", self.batchSize)
+        zeroIterations = np.zeros(self.batchSize, dtype = np.int64)
+        self.xLocations = getKeyedRandomIntegers(self.seedKeys, zeroIterations, DIGROLLINITIALX, 0, self.width - 1)
+        self.yLocations = getKeyedRandomIntegers(self.seedKeys, zeroIterations, DIGROLLINITIALY, 0, self.height - 1)
+        self.digCorridorTiles(np.arange(self.batchSize))
+        self.directions = getKeyedRandomIntegers(self.seedKeys, zeroIterations, DIGROLLINITIALDIRECTION, 0, len(DIRECTIONLIST) - 1)
     
-    diggingMap = DiggingMap(mapWidth, mapHeight)
+    '''
+    Digs a corridor tile at the current location of each of the given agents,
+    with the same bounds and room checks as DiggingMap.digCorridorTile.
+    '''
+    def digCorridorTiles(self, agents):
+        xs = self.xLocations[agents]
+        ys = self.yLocations[agents]
+        inRange = (xs >= 0) & (ys >= 0) & (xs < self.width - 1) & (ys < self.height - 1)
+        agents = agents[inRange]
+        xs = xs[inRange]
+        ys = ys[inRange]
+        undug = self.tileMaps[agents, xs, ys] == UNDUGTILE
+        self.tileMaps[agents[undug], xs[undug], ys[undug]] = CORRIDORTILE
+        self.corridorTileCounts[agents[undug]] += 1
+    
+    '''
+    Carves one room per given agent around its current location, the same
+    rectangle BlindDigger.performDigIteration passes to digRoomRectangle.
+    All rooms are gathered into a single fancy-indexed write.
+    '''
+    def digRooms(self, agents, iterations):
+        seedKeys = self.seedKeys[agents]
+        roomWidths = getKeyedRandomIntegers(seedKeys, iterations, DIGROLLROOMWIDTH, self.roomWidthRange[0], self.roomWidthRange[1])
+        roomHeights = getKeyedRandomIntegers(seedKeys, iterations, DIGROLLROOMHEIGHT, self.roomHeightRange[0], self.roomHeightRange[1])
+        # np.rint rounds halves to even, the same as round() in BlindDigger.
+        roomWidthsDiv2 = np.rint(roomWidths / 2.0).astype(np.int64)
+        roomHeightsDiv2 = np.rint(roomHeights / 2.0).astype(np.int64)
+        xs = self.xLocations[agents]
+        ys = self.yLocations[agents]
+        xMins = np.maximum(xs - (roomWidths - roomWidthsDiv2), 0)
+        yMins = np.maximum(ys - (roomHeights - roomHeightsDiv2), 0)
+        xMaxs = np.minimum(xs + roomWidthsDiv2, self.width - 2)
+        yMaxs = np.minimum(ys + roomHeightsDiv2, self.height - 2)
+        
+        xOffsets = np.arange(self.roomWidthRange[1] + 1)
+        yOffsets = np.arange(self.roomHeightRange[1] + 1)
+        roomXs = xMins[:, None, None] + xOffsets[None, :, None]
+        roomYs = yMins[:, None, None] + yOffsets[None, None, :]
+        insideRoom = (roomXs <= xMaxs[:, None, None]) & (roomYs <= yMaxs[:, None, None])
+        
+        roomAgents = np.broadcast_to(agents[:, None, None], insideRoom.shape)[insideRoom]
+        roomXs = np.broadcast_to(roomXs, insideRoom.shape)[insideRoom]
+        roomYs = np.broadcast_to(roomYs, insideRoom.shape)[insideRoom]
+        previousTiles = self.tileMaps[roomAgents, roomXs, roomYs]
+        self.tileMaps[roomAgents, roomXs, roomYs] = ROOMTILE
+        
+        self.corridorTileCounts -= np.bincount(roomAgents, weights = (previousTiles == CORRIDORTILE),
+                                               minlength = self.batchSize).astype(np.int64)
+        self.roomTileCounts += np.bincount(roomAgents, weights = (previousTiles != ROOMTILE),
+                                           minlength = self.batchSize).astype(np.int64)
+    
+    '''
+    Performs one dig iteration for every agent that has not reached its target.
+    Returns how many agents were advanced.
+    '''
+    def performDigIteration(self):
+        agents = self.getActiveAgents()
+        if (len(agents) == 0):
+            return 0
+        seedKeys = self.seedKeys[agents]
+        iterations = self.iterations[agents]
+        currentTiles = self.tileMaps[agents, self.xLocations[agents], self.yLocations[agents]]
+        notOnRoom = currentTiles != ROOMTILE
+        
+        # Chance to switch direction. Like BlindDigger, the chance is left as is
+        # after a switch or while standing on a room tile.
+        directionRolls = getKeyedRandomIntegers(seedKeys, iterations, DIGROLLDIRECTION, 0, 99)
+        changeDirection = (directionRolls < self.percentChancesOfChangingDirection[agents]) & notOnRoom
+        newDirections = getKeyedRandomIntegers(seedKeys, iterations, DIGROLLDIRECTIONCHOICE, 0, len(DIRECTIONLIST) - 1)
+        self.directions[agents[changeDirection]] = newDirections[changeDirection]
+        rampDirection = agents[notOnRoom & ~changeDirection]
+        self.percentChancesOfChangingDirection[rampDirection] = self.percentChancesOfChangingDirection[rampDirection] + INCREMENTOFDIRECTIONCHANGE
+        
+        roomRolls = getKeyedRandomIntegers(seedKeys, iterations, DIGROLLROOM, 0, 99)
+        buildRoom = (roomRolls < self.percentChancesOfBuildingRoom[agents]) & notOnRoom
+        if (buildRoom.any()):
+            self.digRooms(agents[buildRoom], iterations[buildRoom])
+        self.percentChancesOfBuildingRoom[agents[buildRoom | ~notOnRoom]] = DEFAULTROOMBUILDINGCHANCE
+        rampRoom = agents[notOnRoom & ~buildRoom]
+        self.percentChancesOfBuildingRoom[rampRoom] = self.percentChancesOfBuildingRoom[rampRoom] + INCREMENTOFROOMBUILDING
+        
+        # Switch to opposite directions if at the edge, in the same order as
+        # BlindDigger, unless a direction change that stays on the map was rolled.
+        xs = self.xLocations[agents]
+        ys = self.yLocations[agents]
+        directions = self.directions[agents]
+        directions = np.where(xs == 0, DIRECTIONLIST.index("right"), directions)
+        directions = np.where(xs == self.width - 1, DIRECTIONLIST.index("left"), directions)
+        directions = np.where(ys == 0, DIRECTIONLIST.index("up"), directions)
+        directions = np.where(ys == self.height - 1, DIRECTIONLIST.index("down"), directions)
+        turnXs = xs + DIRECTIONXSTEPS[newDirections]
+        turnYs = ys + DIRECTIONYSTEPS[newDirections]
+        keepTurn = changeDirection & (turnXs >= 0) & (turnYs >= 0) & (turnXs < self.width) & (turnYs < self.height)
+        directions = np.where(keepTurn, newDirections, directions)
+        self.directions[agents] = directions
+        self.xLocations[agents] = xs + DIRECTIONXSTEPS[directions]
+        self.yLocations[agents] = ys + DIRECTIONYSTEPS[directions]
+        
+        self.digCorridorTiles(agents)
+        self.iterations[agents] += 1
+        return len(agents)
+    
+    def run(self):
+        self.initializeDig()
+        while (self.performDigIteration() > 0):
+            pass
+        return self.tileMaps
+    
+
+'''
+Main logic function. With fastStepping the digger digs with performDigSegment,
+which makes maps from the same distribution much faster, but a different map
+for the same seed. With keyedRandom the digger makes keyed draws, and digs the
+same map generateAgentDiggerMapBatch digs for seed.
+'''
+        
+def generateAgentDiggerMap(seed = None, mapWidth = 50, mapHeight = 50, percentAreaTarget = 40,
+                           directionPercentChance = 5, roomPercentChance = 5, showPlot = True,
+                           fastStepping = False, keyedRandom = False):
+    diggingMap = DiggingMap(mapWidth, mapHeight, rng = random.Random(seed))
+    digger = getMapDigger(diggingMap, seed, directionPercentChance, roomPercentChance, keyedRandom)
     digger.initializeDig(diggingMap)
     
-    while (diggingMap.percentAreaDug < 40):
-        digger.performDigIteration(diggingMap)
+    tilesDugTarget = diggingMap.getTilesDugTarget(percentAreaTarget)
+    while (diggingMap.tilesDug < tilesDugTarget):
+        if (fastStepping):
+            digger.performDigSegment(diggingMap, tilesDugTarget)
+        else:
+            digger.performDigIteration(diggingMap)
+    
+    if (showPlot):
+        diggingMap.plotDiggingMap()
+    return diggingMap
+
+'''
+Returns the BlindDigger for a map, making keyed draws from seed (or from a
+seed drawn from the map's rng if there is none) when keyedRandom is set.
+'''
+def getMapDigger(diggingMap, seed, directionPercentChance, roomPercentChance, keyedRandom):
+    if (keyedRandom == False):
+        return BlindDigger(directionPercentChance, roomPercentChance)
+    if (seed is None):
+        seed = diggingMap.rng.getrandbits(64)
+    return BlindDigger(directionPercentChance, roomPercentChance, keyedSeed = seed)
+
+'''
+Digs the same map as generateAgentDiggerMap, yielding a DigDelta of the tiles
+changed every iterationsPerDelta steps instead of plotting the result. The
+first delta includes the starting tile, so applying every delta in turn to an
+all undug (mapWidth, mapHeight) array rebuilds the map. The generator returns
+the DiggingMap when it is done, e.g.
+
+for delta in iterateAgentDiggerMap(seed = 1):
+    delta.applyTo(previewTiles)
+'''
+def iterateAgentDiggerMap(seed = None, mapWidth = 50, mapHeight = 50, percentAreaTarget = 40,
+                          directionPercentChance = 5, roomPercentChance = 5, fastStepping = False,
+                          iterationsPerDelta = DEFAULTITERATIONSPERDELTA, keyedRandom = False):
+    diggingMap = DiggingMap(mapWidth, mapHeight, rng = random.Random(seed))
+    digger = getMapDigger(diggingMap, seed, directionPercentChance, roomPercentChance, keyedRandom)
+    diggingMap.startRecordingChanges()
+    digger.initializeDig(diggingMap)
     
-    diggingMap.plotDiggingMap()
+    tilesDugTarget = diggingMap.getTilesDugTarget(percentAreaTarget)
+    yield from digger.iterateDig(diggingMap, tilesDugTarget, iterationsPerDelta, fastStepping)
+    return diggingMap
+
+'''
+Digs one map per seed with a BatchBlindDigger and returns the
+(len(seeds), mapWidth, mapHeight) array of tiles. Map i is the map
+generateAgentDiggerMap(seeds[i], ..., keyedRandom = True) digs.
+'''
+def generateAgentDiggerMapBatch(seeds, mapWidth = 50, mapHeight = 50, percentAreaTarget = 40,
+                                directionPercentChance = 5, roomPercentChance = 5):
+    batchDigger = BatchBlindDigger(seeds, mapWidth, mapHeight, percentAreaTarget,
+                                   directionPercentChance, roomPercentChance)
+    return batchDigger.run()
     
 if __name__ == "__main__":
+    enableDiagnostics(logging.INFO)
     generateAgentDiggerMap()
        
 
@@ -7,12 +7,24 @@ Created on Fri Oct 23 13:46:42 2015
 PROVIDED AS IS WITHOUT WARRANTY OR GUARANTEE THAT IT WILL WORK.
 """
 
+from bisect import bisect_right
 from collections import defaultdict
+from itertools import accumulate
+import cProfile
 import matplotlib.pyplot as plt
+from matplotlib.collections import PatchCollection
 from matplotlib.patches import Rectangle
+import numpy as np
+import logging
+import pstats
 import random
-from random import randint
+import math
 from math import sqrt
+import time
+import tracemalloc
+
+from ProcGenDiagnostics import getDiagnosticsLogger, enableDiagnostics
+from ProcGenExample_AgentDigger import UNDUGTILE, CORRIDORTILE, ROOMTILE, TILEDTYPE
 
 '''
 Classes and functions to procedurally generate a map of rectangular rooms.
@@ -42,8 +54,83 @@ parent
 It uses a binary tree to partition the space. Each leaf represents a
 box of space in which a "sub area" (i.e., another box) can be placed.
 Once the sub areas are placed, corridors (also boxes) are used to connect them.
+
+Every function that makes random choices takes an rng argument (anything with
+randint and choice, normally a random.Random). The AreaTree owns one and passes
+it down, so a seeded tree fully determines the map and separate trees can be
+generated concurrently without sharing state. Called without an rng, the Box
+and AreaNode functions fall back to the global random module.
+'''
+
+logger = getDiagnosticsLogger("bsp")
+
+'''
+Version of the maps generateBSPMap makes. Bump it whenever a change makes it
+produce a different map for the same seed and parameters, so that maps cached
+by ProcGenCache are not reused.
 '''
+GENERATORVERSION = 1
 
+'''
+Parameters for sub areas (rooms). A sub area must keep MAGICPADDINGNUMBER
+units away from every wall of its cell, be at least MAGICWIDTHTHRESHOLD wide and
+MAGICHEIGHTTHRESHOLD tall, and cover at least MAGICSUBAREAFRACTION of the cell.
+
+Sub areas can be placed two ways:
+SUBAREAPLACEMENTREJECTION - the original approach. Draw a random origin and size and
+                            start over until the draw meets all of the rules.
+SUBAREAPLACEMENTDIRECT    - work out which origins and sizes meet the rules and draw
+                            from those directly, with the same probabilities the
+                            rejection loop would end up with. The cost per cell is
+                            bounded by its width plus height.
+Either way, a cell that can never hold a sub area is reported with a ValueError
+instead of looping forever.
+'''
+MAGICPADDINGNUMBER = 3
+MAGICWIDTHTHRESHOLD = 6
+MAGICHEIGHTTHRESHOLD = 6
+MAGICSUBAREAFRACTION = 0.20
+
+SUBAREAPLACEMENTREJECTION = "rejection"
+SUBAREAPLACEMENTDIRECT = "direct"
+SUBAREAPLACEMENTMODES = (SUBAREAPLACEMENTREJECTION, SUBAREAPLACEMENTDIRECT)
+
+'''
+Number of times a subtree that fails to connect is regenerated before the
+repair moves up to its parent. See AreaTree.connectSubAreasWithRepair.
+'''
+MAXLOCALREPAIRRETRIES = 5
+
+'''
+The rejection loop draws an origin uniformly and then a size uniformly from 0 up
+to upperLimit - origin, so each origin contributes 1 / (upperLimit - origin + 1)
+to every size it allows. Returns the running totals of those weights for the
+origins start through end.
+'''
+def getOriginPrefixWeights(start, end, upperLimit):
+    return list(accumulate(1.0 / (upperLimit - origin + 1) for origin in range(start, end + 1)))
+
+'''
+Draws an index in [low, high] given running totals of the weights of each index.
+'''
+def drawWeightedIndex(prefixWeights, low, high, rng):
+    weightBefore = prefixWeights[low - 1] if low > 0 else 0.0
+    target = weightBefore + rng.random() * (prefixWeights[high] - weightBefore)
+    return min(max(bisect_right(prefixWeights, target, low, high + 1), low), high)
+
+
+'''
+Thresholds, in number of pairs of Boxes compared, for how
+BoxHelper.returnIndicesOfClosestSubAreas finds the closest pair. Up to
+BRUTEFORCEPAIRLIMIT pairs every pair is checked in a plain loop, up to
+VECTORIZEDPAIRLIMIT every pair is checked at once with numpy, and beyond that a
+uniform grid over the centers of the second list is searched outward from each
+center of the first list, closest candidates first.
+'''
+BRUTEFORCEPAIRLIMIT = 64
+VECTORIZEDPAIRLIMIT = 16384
+CLOSESTPAIRNOTFOUND = 1000000000 # Arbitrarily large magic number
+GRIDPRUNINGTOLERANCE = 1e-9
 
 '''
 BoxHelperClass to do operations on Boxes. This class doesn't do much
@@ -59,21 +146,32 @@ class BoxHelper(object):
     centers. This is used to prevent very distance Boxes from being connected
     if they are chosen from the list at random. As such, this reduces the chance
     of really large corridors that travel over existing rooms.
+    
+    The strategy is chosen by the size of the lists, and all of them return the
+    same indices: ties go to the earliest Box of the first list, then of the second.
     '''
-    def returnIndicesOfClosestSubAreas(self, boxListFirst, boxListSecond):      
+    def returnIndicesOfClosestSubAreas(self, boxListFirst, boxListSecond):
+        pairCount = len(boxListFirst) * len(boxListSecond)
+        if (pairCount <= BRUTEFORCEPAIRLIMIT):
+            return self.returnIndicesOfClosestSubAreasBruteForce(boxListFirst, boxListSecond)
+        if (pairCount <= VECTORIZEDPAIRLIMIT):
+            return self.returnIndicesOfClosestSubAreasVectorized(boxListFirst, boxListSecond)
+        return self.returnIndicesOfClosestSubAreasGrid(boxListFirst, boxListSecond)
+    
+    def returnIndicesOfClosestSubAreasBruteForce(self, boxListFirst, boxListSecond):
         listToReturn = [0, 0]
         firstListIndex = 0
         secondListIndex = 0
-        centroidDistance = 1000000000 # Arbitrarily large magic number        
+        centroidDistance = CLOSESTPAIRNOTFOUND
         for boxFromFirstList in boxListFirst:
             #Find first box centroid
-            centerXFirst = boxFromFirstList.origin[0] + (boxFromFirstList.width / 2.0)
-            centerYFirst = boxFromFirstList.origin[1] + (boxFromFirstList.height / 2.0)
+            centerXFirst = boxFromFirstList.cx
+            centerYFirst = boxFromFirstList.cy
             secondListIndex = 0            
             for boxFromSecondList in boxListSecond:
                 #Find second box centroid
-                centerXSecond = boxFromSecondList.origin[0] + (boxFromSecondList.width / 2.0)
-                centerYSecond = boxFromSecondList.origin[1] + (boxFromSecondList.height / 2.0)
+                centerXSecond = boxFromSecondList.cx
+                centerYSecond = boxFromSecondList.cy
                 distXSquared = (centerXSecond - centerXFirst) * (centerXSecond - centerXFirst)
                 distYSquared = (centerYSecond - centerYFirst) * (centerYSecond - centerYFirst) 
                 distance = sqrt(distXSquared + distYSquared)
@@ -83,6 +181,112 @@ class BoxHelper(object):
                 secondListIndex += 1
             firstListIndex += 1
         return listToReturn
+    
+    def getCentroids(self, boxList):
+        centersX = np.array([box.cx for box in boxList], dtype = np.float64)
+        centersY = np.array([box.cy for box in boxList], dtype = np.float64)
+        return centersX, centersY
+    
+    '''
+    Computes every distance at once. argmin returns the first minimum in row
+    major order, which is the same pair the loop in the brute force version keeps.
+    '''
+    def returnIndicesOfClosestSubAreasVectorized(self, boxListFirst, boxListSecond):
+        if (len(boxListFirst) == 0 or len(boxListSecond) == 0):
+            return [0, 0]
+        centersXFirst, centersYFirst = self.getCentroids(boxListFirst)
+        centersXSecond, centersYSecond = self.getCentroids(boxListSecond)
+        distX = centersXSecond[np.newaxis, :] - centersXFirst[:, np.newaxis]
+        distY = centersYSecond[np.newaxis, :] - centersYFirst[:, np.newaxis]
+        distances = np.sqrt(distX * distX + distY * distY)
+        closestIndex = int(np.argmin(distances))
+        firstListIndex, secondListIndex = divmod(closestIndex, len(boxListSecond))
+        if (not (distances[firstListIndex, secondListIndex] < CLOSESTPAIRNOTFOUND)):
+            return [0, 0]
+        return [firstListIndex, secondListIndex]
+    
+    '''
+    Buckets the centers of the second list into square cells and, for each center
+    of the first list, searches rings of cells outward until no closer center can
+    remain. The first list is visited in order of distance to the bounding box of
+    the second list, so once that distance exceeds the best pair found the rest
+    of the first list can be skipped. When two halves of a map are connected only
+    the Boxes near the dividing line end up being compared.
+    '''
+    def returnIndicesOfClosestSubAreasGrid(self, boxListFirst, boxListSecond):
+        if (len(boxListFirst) == 0 or len(boxListSecond) == 0):
+            return [0, 0]
+        centersXFirst, centersYFirst = self.getCentroids(boxListFirst)
+        centersXSecond, centersYSecond = self.getCentroids(boxListSecond)
+        minimumX = float(centersXSecond.min())
+        minimumY = float(centersYSecond.min())
+        maximumX = float(centersXSecond.max())
+        maximumY = float(centersYSecond.max())
+        
+        # Aim for about one center per cell.
+        cellSize = sqrt(max((maximumX - minimumX) * (maximumY - minimumY), 1.0) / len(boxListSecond))
+        cellSize = max(cellSize, (maximumX - minimumX) / 4096.0, (maximumY - minimumY) / 4096.0, 1e-6)
+        columnCount = int((maximumX - minimumX) / cellSize) + 1
+        rowCount = int((maximumY - minimumY) / cellSize) + 1
+        columns = np.minimum(((centersXSecond - minimumX) / cellSize).astype(np.int64), columnCount - 1)
+        rows = np.minimum(((centersYSecond - minimumY) / cellSize).astype(np.int64), rowCount - 1)
+        grid = defaultdict(list)
+        for secondListIndex in range(len(boxListSecond)):
+            grid[(int(columns[secondListIndex]), int(rows[secondListIndex]))].append(secondListIndex)
+        
+        # Distance from each center of the first list to the bounding box of the second.
+        outsideX = np.maximum(np.maximum(minimumX - centersXFirst, centersXFirst - maximumX), 0.0)
+        outsideY = np.maximum(np.maximum(minimumY - centersYFirst, centersYFirst - maximumY), 0.0)
+        boundingBoxDistances = np.sqrt(outsideX * outsideX + outsideY * outsideY)
+        
+        xSecond = centersXSecond.tolist()
+        ySecond = centersYSecond.tolist()
+        best = (float(CLOSESTPAIRNOTFOUND), 0, 0)
+        for firstListIndex in np.argsort(boundingBoxDistances, kind = "stable").tolist():
+            if (boundingBoxDistances[firstListIndex] > best[0] + GRIDPRUNINGTOLERANCE * (1.0 + best[0])):
+                break
+            centerXFirst = float(centersXFirst[firstListIndex])
+            centerYFirst = float(centersYFirst[firstListIndex])
+            column = int(math.floor((centerXFirst - minimumX) / cellSize))
+            row = int(math.floor((centerYFirst - minimumY) / cellSize))
+            # The first ring of cells that overlaps the grid, and the last one needed to cover it.
+            firstRing = max(0, -column, column - (columnCount - 1), -row, row - (rowCount - 1))
+            lastRing = max(column, columnCount - 1 - column, row, rowCount - 1 - row)
+            for ring in range(firstRing, lastRing + 1):
+                # Every center in this ring is at least (ring - 1) cells away.
+                if ((ring - 1) * cellSize > best[0] + GRIDPRUNINGTOLERANCE * (1.0 + best[0])):
+                    break
+                for cell in self.iterGridRing(column, row, ring, columnCount, rowCount):
+                    for secondListIndex in grid.get(cell, ()):
+                        distX = xSecond[secondListIndex] - centerXFirst
+                        distY = ySecond[secondListIndex] - centerYFirst
+                        candidate = (sqrt(distX * distX + distY * distY), firstListIndex, secondListIndex)
+                        if (candidate < best):
+                            best = candidate
+        if (not (best[0] < CLOSESTPAIRNOTFOUND)):
+            return [0, 0]
+        return [best[1], best[2]]
+    
+    '''
+    Yields the cells of the grid that are exactly ring cells away (in both
+    directions) from the cell at (column, row).
+    '''
+    def iterGridRing(self, column, row, ring, columnCount, rowCount):
+        if (ring == 0):
+            yield (column, row)
+            return
+        firstColumn = max(column - ring, 0)
+        lastColumn = min(column + ring, columnCount - 1)
+        for ringRow in (row - ring, row + ring):
+            if (0 <= ringRow < rowCount):
+                for ringColumn in range(firstColumn, lastColumn + 1):
+                    yield (ringColumn, ringRow)
+        firstRow = max(row - ring + 1, 0)
+        lastRow = min(row + ring - 1, rowCount - 1)
+        for ringColumn in (column - ring, column + ring):
+            if (0 <= ringColumn < columnCount):
+                for ringRow in range(firstRow, lastRow + 1):
+                    yield (ringColumn, ringRow)
 
 
 '''
@@ -92,17 +296,77 @@ that is used for plotting.
 
 This class also contains some member functions to divide a box into two
 equal boxes, and to randomly generate a "sub area" from the given box area.
+
+A tree holds a few Boxes per node, so Box uses __slots__ rather than a
+per-instance dictionary. Along with its lower left corner (x0, y0), width and
+height it stores the geometry derived from them: the other extent (x1, y1),
+the center (cx, cy) and the area, so the corridor code reads them as plain
+attributes. They are only kept up to date through setGeometry and the
+setters built on it, so change a Box through those rather than by assigning
+x0, y0, width or height.
 '''
 
 class Box(object):
+    __slots__ = ("x0", "y0", "width", "height", "x1", "y1", "cx", "cy", "area")
+    
     def __init__(self, origin = (0,0), width = 0, height = 0):
-        self.origin = origin
-        self.height = height
+        self.setGeometry(origin[0], origin[1], width, height)
+    
+    '''
+    Sets the corner and size of the Box at once, and the geometry derived
+    from them.
+    '''
+    def setGeometry(self, x0, y0, width, height):
+        self.x0 = x0
+        self.y0 = y0
         self.width = width
+        self.height = height
+        self.x1 = x0 + width
+        self.y1 = y0 + height
+        self.cx = x0 + (width / 2.0)
+        self.cy = y0 + (height / 2.0)
         self.area = width * height
     
+    @property
+    def origin(self):
+        return (self.x0, self.y0)
+    
+    @origin.setter
+    def origin(self, origin):
+        self.setGeometry(origin[0], origin[1], self.width, self.height)
+    
+    def copy(self):
+        return Box((self.x0, self.y0), self.width, self.height)
+    
+    '''
+    Length of the overlap of the two Boxes along X (or Y). Negative values are
+    the size of the gap between them.
+    '''
+    def getOverlapX(self, otherBox):
+        return min(self.x1, otherBox.x1) - max(self.x0, otherBox.x0)
+    
+    def getOverlapY(self, otherBox):
+        return min(self.y1, otherBox.y1) - max(self.y0, otherBox.y0)
+    
+    '''
+    True if the two Boxes share some area; Boxes that only touch do not count.
+    '''
+    def intersects(self, otherBox):
+        return (self.x0 < otherBox.x1 and otherBox.x0 < self.x1 and
+                self.y0 < otherBox.y1 and otherBox.y0 < self.y1)
+    
+    '''
+    Returns the Box where the two Boxes overlap, or None if they do not.
+    '''
+    def getIntersection(self, otherBox):
+        if (self.intersects(otherBox) == False):
+            return None
+        x0 = max(self.x0, otherBox.x0)
+        y0 = max(self.y0, otherBox.y0)
+        return Box((x0, y0), min(self.x1, otherBox.x1) - x0, min(self.y1, otherBox.y1) - y0)
+    
     def __repr__(self):
-        printString = "Box:\nOrigin:(" + str(self.origin[0]) + "," + str(self.origin[1]) + ")\n"
+        printString = "Box:\nOrigin:(" + str(self.x0) + "," + str(self.y0) + ")\n"
         printString += "Width: " + str(self.width) + "\tHeight: " + str(self.height) + "\n"
         printString += "Area: " + str(self.area)
         return printString
@@ -111,21 +375,19 @@ class Box(object):
         return self.height
         
     def setHeight(self, height):
-        self.height = height
-        self.area = self.height * self.width
+        self.setGeometry(self.x0, self.y0, self.width, height)
     
     def getOrigin(self):
         return self.origin
         
     def setOrigin(self, origin):
-        self.origin = origin
+        self.setGeometry(origin[0], origin[1], self.width, self.height)
     
     def getWidth(self):
         return self.width
         
     def setWidth(self, width):
-        self.width = width
-        self.area = self.height * self.width
+        self.setGeometry(self.x0, self.y0, width, self.height)
     
     def getArea(self):
         return self.area
@@ -133,9 +395,9 @@ class Box(object):
     '''    
     Returns a list of boxes that are a random division of itself in half.
     '''
-    def partitionBox(self):
+    def partitionBox(self, rng = random):
         boxesToReturn = []
-        divideParallelWithWidth = random.choice([True, False])
+        divideParallelWithWidth = rng.choice([True, False])
         
         # A few extra conditions to try to avoid getting to unbalanced:
         # If very wide, divide parallel with height
@@ -146,24 +408,24 @@ class Box(object):
             divideParallelWithWidth = True
 
         if (divideParallelWithWidth == True):
-            print("Dividing along width")
+            logger.debug("Dividing along width")
             # If first box were (0,0), 20, 50
             # Then partition should be:
             # (0, 0), 20, 25
             # (0, 0 + 25), 20, 25
-            originalOrigin = self.origin
+            originalOrigin = (self.x0, self.y0)
             halfHeight = self.height / 2.0
             firstBox = Box((originalOrigin[0], originalOrigin[1]), self.width, halfHeight)
             secondBox = Box((originalOrigin[0], originalOrigin[1] + halfHeight), self.width, halfHeight)
             boxesToReturn.append(firstBox)
             boxesToReturn.append(secondBox)
         else:
-            print("Dividing along height")
+            logger.debug("Dividing along height")
             # If first box were (0,0), 20, 50
             # Then partition should be:
             # (0, 0), 10, 50
             # (0 + 10, 0), 10, 50
-            originalOrigin = self.origin
+            originalOrigin = (self.x0, self.y0)
             halfWidth = self.width / 2.0
             firstBox = Box((originalOrigin[0], originalOrigin[1]), halfWidth, self.height)
             secondBox = Box((originalOrigin[0] + halfWidth, originalOrigin[1]), halfWidth, self.height)
@@ -171,11 +433,43 @@ class Box(object):
             boxesToReturn.append(secondBox)
         return boxesToReturn
 
+    '''
+    Returns (xStart, xEnd, yStart, yEnd) such that a sub area with origin (x, y) and
+    size (width, height) keeps its padding exactly when xStart <= x and
+    x + width <= xEnd (likewise for y), or None if no sub area fits in this box.
+    '''
+    def getSubAreaPlacementRanges(self):
+        xStart = int(math.ceil(self.x0 + MAGICPADDINGNUMBER))
+        xEnd = int(math.floor(self.x0 + self.width - MAGICPADDINGNUMBER))
+        yStart = int(math.ceil(self.y0 + MAGICPADDINGNUMBER))
+        yEnd = int(math.floor(self.y0 + self.height - MAGICPADDINGNUMBER))
+        maximumWidth = xEnd - xStart
+        maximumHeight = yEnd - yStart
+        if (maximumWidth < MAGICWIDTHTHRESHOLD or maximumHeight < MAGICHEIGHTTHRESHOLD
+            or maximumWidth * maximumHeight < (MAGICSUBAREAFRACTION * self.area)):
+            return None
+        return (xStart, xEnd, yStart, yEnd)
+    
+    def canHoldSubArea(self, placementMode = SUBAREAPLACEMENTREJECTION):
+        if (self.getSubAreaPlacementRanges() is not None):
+            return True
+        # The rejection loop gives up on the rules and keeps a 1 by 1 box once
+        # that is large enough to end the loop.
+        return (placementMode == SUBAREAPLACEMENTREJECTION and (MAGICSUBAREAFRACTION * self.area) <= 1)
+    
     '''
     Create a sub area within a box. This sub area represents a room, and is a Box itself.
+    The number of sub areas drawn and rejected is added to sampleCounts[countKey]
+    when sampleCounts is given.
     '''
     
-    def constructSubArea(self):
+    def constructSubArea(self, rng = random, placementMode = SUBAREAPLACEMENTREJECTION, sampleCounts = None, countKey = None):
+        if (placementMode == SUBAREAPLACEMENTDIRECT):
+            return self.constructSubAreaDirectly(rng)
+        if (placementMode != SUBAREAPLACEMENTREJECTION):
+            raise ValueError("Unknown sub area placement mode: " + str(placementMode))
+        if (self.canHoldSubArea(placementMode) == False):
+            raise ValueError("No sub area fits in box at " + str(self.origin) + " of size " + str(self.width) + " by " + str(self.height))
         #8: create a room within the cell by randomly
         #   choosing two points (top left and bottom right)
         #   within its boundaries
@@ -185,37 +479,36 @@ class Box(object):
         randomWidth = 0
         randomHeight = 0
         boxToReturn = Box()
-        MAGICPADDINGNUMBER = 3  # I guess this should be a global parameter or something?
-        MAGICWIDTHTHRESHOLD = 6  # More magic numbers
-        MAGICHEIGHTTHRESHOLD = 6  # Even more magic numbers
-        while (boxToReturn.area < (0.20 * self.area)):  # Another magic number for minimum size of the sub area
-            originalOrigin = self.origin
+        traceEnabled = logger.isEnabledFor(logging.DEBUG)
+        sampleCount = 0
+        while (boxToReturn.area < (MAGICSUBAREAFRACTION * self.area)):
+            sampleCount += 1
+            originalOrigin = (self.x0, self.y0)
             xLowerBound = int(originalOrigin[0])
             xUpperBound = int(originalOrigin[0] + self.width)
             yLowerBound = int(originalOrigin[1])
             yUpperBound = int(originalOrigin[1] + self.height)
             
-            randomOriginX = randint(xLowerBound, xUpperBound)
-            randomOriginY = randint(yLowerBound, yUpperBound)
+            randomOriginX = rng.randint(xLowerBound, xUpperBound)
+            randomOriginY = rng.randint(yLowerBound, yUpperBound)
             
-            widthUpperBound = int((self.width + self.origin[0]) - randomOriginX)
-            heightUpperBound = int((self.height + self.origin[1]) - randomOriginY)
+            widthUpperBound = int((self.width + self.x0) - randomOriginX)
+            heightUpperBound = int((self.height + self.y0) - randomOriginY)
 
-            randomWidth = randint(0, widthUpperBound)
-            randomHeight = randint(0, heightUpperBound)
+            randomWidth = rng.randint(0, widthUpperBound)
+            randomHeight = rng.randint(0, heightUpperBound)
     
             
-            boxToReturn.setHeight(randomHeight)
-            boxToReturn.setWidth(randomWidth)
-            boxToReturn.setOrigin((randomOriginX, randomOriginY))
+            boxToReturn.setGeometry(randomOriginX, randomOriginY, randomWidth, randomHeight)
             
             # Just to make sure the boxes are away from the wall a bit.
-            distanceFromRightWall = (self.origin[0] + self.width) - (boxToReturn.origin[0] + boxToReturn.width) 
-            distanceFromLeftWall = (boxToReturn.origin[0] - self.origin[0])
-            distanceFromTopWall = (self.origin[1] + self.height) - (boxToReturn.origin[1] + boxToReturn.height) 
-            distanceFromBottomWall = (boxToReturn.origin[1] - self.origin[1])
+            distanceFromRightWall = self.x1 - boxToReturn.x1
+            distanceFromLeftWall = boxToReturn.x0 - self.x0
+            distanceFromTopWall = self.y1 - boxToReturn.y1
+            distanceFromBottomWall = boxToReturn.y0 - self.y0
             
-            print(distanceFromRightWall, distanceFromLeftWall, distanceFromTopWall, distanceFromBottomWall)
+            if (traceEnabled):
+                logger.debug("Distances from walls: %s %s %s %s", distanceFromRightWall, distanceFromLeftWall, distanceFromTopWall, distanceFromBottomWall)
         
             # Perform another round if things aren't quite how we want them.            
             if (distanceFromRightWall < MAGICPADDINGNUMBER
@@ -224,13 +517,62 @@ class Box(object):
                 or distanceFromBottomWall < MAGICPADDINGNUMBER
                 or boxToReturn.getHeight() < MAGICHEIGHTTHRESHOLD
                 or boxToReturn.getWidth() < MAGICWIDTHTHRESHOLD):                  
-                    boxToReturn.setHeight(1)
-                    boxToReturn.setWidth(1)
+                    boxToReturn.setGeometry(boxToReturn.x0, boxToReturn.y0, 1, 1)
         
-        print("The following box:")
-        print(self)
-        print("Generated the sub area:")
-        print(boxToReturn)
+        if (sampleCounts is not None):
+            sampleCounts[countKey] += sampleCount - 1
+        if (traceEnabled):
+            logger.debug("The following box:\n%r\nGenerated the sub area:\n%r", self, boxToReturn)
+        return boxToReturn
+    
+    '''
+    Same as constructSubArea, but draws the sub area straight from the origins
+    and sizes that meet the padding, size and area rules, weighted so that every
+    sub area is as likely as it would be from the rejection loop.
+    '''
+    def constructSubAreaDirectly(self, rng = random):
+        placementRanges = self.getSubAreaPlacementRanges()
+        if (placementRanges is None):
+            raise ValueError("No sub area fits in box at " + str(self.origin) + " of size " + str(self.width) + " by " + str(self.height))
+        xStart, xEnd, yStart, yEnd = placementRanges
+        maximumWidth = xEnd - xStart
+        maximumHeight = yEnd - yStart
+        minimumArea = MAGICSUBAREAFRACTION * self.area
+        
+        # Running totals of the origin weights; the weight of a size is the
+        # total over all origins that leave room for it.
+        xOriginWeights = getOriginPrefixWeights(xStart, xEnd, int(self.x0 + self.width))
+        yOriginWeights = getOriginPrefixWeights(yStart, yEnd, int(self.y0 + self.height))
+        heightWeights = [yOriginWeights[maximumHeight - height] for height in range(0, maximumHeight + 1)]
+        heightPrefixWeights = list(accumulate(heightWeights))
+        
+        # For each width, the shortest height that still covers minimumArea,
+        # and the combined weight of all of the heights that are allowed with it.
+        widthPrefixWeights = []
+        shortestHeights = []
+        runningWeight = 0.0
+        for width in range(0, maximumWidth + 1):
+            shortestHeight = MAGICHEIGHTTHRESHOLD
+            if (width > 0):
+                shortestHeight = max(shortestHeight, int(math.ceil(minimumArea / width)))
+                while (shortestHeight > MAGICHEIGHTTHRESHOLD and not (width * (shortestHeight - 1) < minimumArea)):
+                    shortestHeight -= 1
+                while (width * shortestHeight < minimumArea):
+                    shortestHeight += 1
+            shortestHeights.append(shortestHeight)
+            if (width >= MAGICWIDTHTHRESHOLD and shortestHeight <= maximumHeight):
+                allowedHeightWeight = heightPrefixWeights[maximumHeight] - heightPrefixWeights[shortestHeight - 1]
+                runningWeight += xOriginWeights[maximumWidth - width] * allowedHeightWeight
+            widthPrefixWeights.append(runningWeight)
+        
+        randomWidth = drawWeightedIndex(widthPrefixWeights, MAGICWIDTHTHRESHOLD, maximumWidth, rng)
+        randomHeight = drawWeightedIndex(heightPrefixWeights, shortestHeights[randomWidth], maximumHeight, rng)
+        randomOriginX = xStart + drawWeightedIndex(xOriginWeights, 0, maximumWidth - randomWidth, rng)
+        randomOriginY = yStart + drawWeightedIndex(yOriginWeights, 0, maximumHeight - randomHeight, rng)
+        
+        boxToReturn = Box((randomOriginX, randomOriginY), randomWidth, randomHeight)
+        if (logger.isEnabledFor(logging.DEBUG)):
+            logger.debug("The following box:\n%r\nGenerated the sub area directly:\n%r", self, boxToReturn)
         return boxToReturn
         
 
@@ -246,147 +588,170 @@ nodes will only have two children for many of the functions to work properly.
 Also, the idea for nodes to contain the Box information came relatively late
 in the process, so that was haphazardly bolted on near the end (e.g., the class
 was renamed to "AreaNode")
+
+Each node keeps a link to its parent node (None for the root) so an AreaTree
+can walk upwards from any node without searching. Nodes are found, added,
+partitioned and deleted through the AreaTree that holds them, which keeps its
+node table and leaf pairs in step with the children of every node.
+
+Operations over a whole subtree (drawing, building sub areas, connecting them,
+printing) are built on iterPreOrder and iterPostOrder, which walk the subtree
+with an explicit stack instead of recursing. They visit children in the same
+order the recursive versions did, but the depth of the tree is not limited by
+the Python recursion limit.
 '''
         
 class AreaNode(object):
-    def __init__(self, name, children, box = Box(), parent = "NULL" ):
+    def __init__(self, name, children, box = None, parent = None):
         self.name = name
+        self.parent = parent
         self.children = children  # Dictionary of child nodes, where keys are the name of the child node.
-        self.box = box
-        self.subArea = box
+        self.box = box if box is not None else Box()
+        self.subArea = self.box.copy()
         self.childrenAreConnected = False
         self.connection = Box()
+        self.shapeCache = None  # See getSubAreaShapeList.
         
     def __repr__(self, level = 0):
-        nodeString = ("\t" * level) + repr(str(self.name)) + "\n"
-        for nodeName in self.children:
-            nodeString += self.children[nodeName].__repr__(level + 1)
-        return nodeString
-    
-    def searchNode(self, nodeNameToFind, traversalList = [], traversalLevel = 0, nameWasFound = False):
-        for nodeName in self.children:    
-            if (nameWasFound != True):
-                nameWasFound = self.children[nodeName].searchNode(nodeNameToFind, traversalList, traversalLevel + 1, nameWasFound)
-            if (nodeName == nodeNameToFind):
-                nameWasFound = True
-                for level in range(0, traversalLevel + 1):
-                    traversalList.append("FILLER")
-                traversalList[traversalLevel] = nodeName
-                return True
-        
-            if (nameWasFound == True):
-                if (traversalList[traversalLevel] == "FILLER"):
-                    traversalList[traversalLevel] = nodeName
-                    return True              
-
-    def deleteNode(self, nodeNameToFind, traversalList = [], traversalLevel = 0, nameWasFound = False):
-        for nodeName in self.children:
-            if (nameWasFound != True):
-                nameWasFound = self.children[nodeName].deleteNode(nodeNameToFind, traversalList, traversalLevel + 1, nameWasFound)
-            if (nodeName == nodeNameToFind):
-                print("Found " + nodeName + ". Deleting.")                
-                self.children.pop(nodeName, None)
-                return True
-
-    def addNode(self, nodeNameToFind, nodeNameToAdd, box, traversalLevel = 0, nameWasFound = False):
-        for nodeName in self.children:
-            if (nameWasFound != True):
-                nameWasFound = self.children[nodeName].addNode(nodeNameToFind, nodeNameToAdd, box, traversalLevel + 1, nameWasFound)
-            if (nodeName == nodeNameToFind):
-                print("Found " + nodeName + ". Adding " + nodeNameToAdd)
-                newNode = AreaNode(nodeNameToAdd, defaultdict(AreaNode), box)
-                self.children[nodeNameToFind].children[nodeNameToAdd] = newNode
-                return True
-        
+        nodeStrings = []
+        for node, depth in self.iterPreOrderWithDepth(level):
+            nodeStrings.append(("\t" * depth) + repr(str(node.name)) + "\n")
+        return "".join(nodeStrings)
+    
+    '''
+    Yields (node, depth) for this node and all of its descendants, parents
+    before children. level is the depth reported for this node.
+    '''
+    def iterPreOrderWithDepth(self, level = 0):
+        nodeStack = [(self, level)]
+        while (len(nodeStack) > 0):
+            node, depth = nodeStack.pop()
+            yield node, depth
+            # Push in reverse so the first child is visited first.
+            for nodeName in reversed(node.children):
+                nodeStack.append((node.children[nodeName], depth + 1))
+    
+    def iterPreOrder(self):
+        for node, depth in self.iterPreOrderWithDepth():
+            yield node
+    
+    '''
+    Yields this node and all of its descendants, children before parents.
+    '''
+    def iterPostOrder(self):
+        nodeStack = [(self, False)]
+        while (len(nodeStack) > 0):
+            node, childrenVisited = nodeStack.pop()
+            if (childrenVisited == True):
+                yield node
+            else:
+                nodeStack.append((node, True))
+                for nodeName in reversed(node.children):
+                    nodeStack.append((node.children[nodeName], False))
+    
     def getRectangles(self, rectangleList, color):
-        for nodeName in self.children:
-            self.children[nodeName].getRectangles(rectangleList, color)
-            nodeBox = Rectangle(self.children[nodeName].box.getOrigin(), 
-                                self.children[nodeName].box.getWidth(), 
-                                self.children[nodeName].box.getHeight(), facecolor=color)
-            rectangleList.append(nodeBox)
+        for node in self.iterPostOrder():
+            if (node is not self):
+                nodeBox = Rectangle(node.box.getOrigin(), 
+                                    node.box.getWidth(), 
+                                    node.box.getHeight(), facecolor=color)
+                rectangleList.append(nodeBox)
 
     def getSubAreaShapes(self, shapeList):
-        for nodeName in self.children:        
-            self.children[nodeName].getSubAreaShapes(shapeList)        
-        if (len(self.children) == 0):
-            nodeBox = self.subArea
-            shapeList.append(nodeBox)
-        if (self.childrenAreConnected == True):
-            shapeList.append(self.connection)
+        shapeList.extend(self.getSubAreaShapeList())
+    
+    '''
+    Returns the sub areas and connectors of this subtree in post order, the
+    same list getSubAreaShapes fills. The list of a node that can no longer
+    change (a leaf, or a node whose children are connected) is cached on the
+    node, and a node builds its list by concatenating the lists of its children,
+    so only the part of the subtree that is not cached yet is walked. The
+    returned list is shared with the cache and must not be modified.
+    '''
+    def getSubAreaShapeList(self):
+        if (self.shapeCache is not None):
+            return self.shapeCache
+        uncachedLists = {}  # Lists of nodes that are not final yet, until their parent takes them.
+        nodeStack = [(self, False)]
+        while (len(nodeStack) > 0):
+            node, childrenVisited = nodeStack.pop()
+            if (childrenVisited == False):
+                nodeStack.append((node, True))
+                for childNode in node.children.values():
+                    if (childNode.shapeCache is None):
+                        nodeStack.append((childNode, False))
+                continue
+            shapeList = []
+            for childNode in node.children.values():
+                if (childNode.shapeCache is not None):
+                    shapeList.extend(childNode.shapeCache)
+                else:
+                    shapeList.extend(uncachedLists.pop(id(childNode)))
+            if (len(node.children) == 0):
+                shapeList.append(node.subArea)
+            if (node.childrenAreConnected == True):
+                shapeList.append(node.connection)
+            if (len(node.children) == 0 or node.childrenAreConnected == True):
+                node.shapeCache = shapeList
+            uncachedLists[id(node)] = shapeList
+        return uncachedLists[id(self)]
+    
+    '''
+    Drops the cached shape lists of this node and of every ancestor, whose
+    lists include it. Called whenever a sub area, connection or child changes.
+    '''
+    def invalidateShapeCache(self):
+        node = self
+        while (node is not None):
+            node.shapeCache = None
+            node = node.parent
                 
     def getSubAreaRectangles(self, rectangleList, boxColor, connectorColor):      
-        for nodeName in self.children:
-            self.children[nodeName].getSubAreaRectangles(rectangleList, boxColor, connectorColor)
-            if (len(self.children[nodeName].children) == 0):
-                nodeBox = Rectangle(self.children[nodeName].subArea.getOrigin(), 
-                                    self.children[nodeName].subArea.getWidth(), 
-                                    self.children[nodeName].subArea.getHeight(), facecolor=boxColor)
+        for node in self.iterPostOrder():
+            if (node is not self and len(node.children) == 0):
+                nodeBox = Rectangle(node.subArea.getOrigin(), 
+                                    node.subArea.getWidth(), 
+                                    node.subArea.getHeight(), facecolor=boxColor)
                 rectangleList.append(nodeBox)
-            if (self.childrenAreConnected == True):
-                nodeBox = Rectangle(self.connection.getOrigin(),
-                                    self.connection.getWidth(),
-                                    self.connection.getHeight(), facecolor=connectorColor)
+            if (node.childrenAreConnected == True):
+                nodeBox = Rectangle(node.connection.getOrigin(),
+                                    node.connection.getWidth(),
+                                    node.connection.getHeight(), facecolor=connectorColor)
                 rectangleList.append(nodeBox)
             
-    def partitionNode(self, nodeNameToFind, partitionNames, 
-                      box = Box(), traversalLevel = 0,
-                      nameWasFound = False):
-        for nodeName in self.children:
-            if (nameWasFound != True):
-                nameWasFound = self.children[nodeName].partitionNode(nodeNameToFind, partitionNames, box, traversalLevel + 1, nameWasFound)
-            if (nodeName == nodeNameToFind):
-                print("Found " + nodeName + ". Partitioning.")
-                #First, need to check how many children it has.
-                if (len(self.children[nodeName].children) == 0):
-                    #Then we need to determine if and how to divide the current box.
-                    #First, find if the box is large enough to partition.
-                    MAGICMINIMUMAREA = 10
-                    print("Area of " + nodeName + " is " + str(self.children[nodeName].box.getArea()) )
-                    if (self.children[nodeName].box.getArea() > MAGICMINIMUMAREA):
-                        boxes = self.children[nodeName].box.partitionBox();
-                        self.addNode(nodeName, partitionNames[0], boxes[0])
-                        self.addNode(nodeName, partitionNames[1], boxes[1])
-                        print(self.children[nodeName])
-                    else:
-                        print("Insufficient area to partition. Not partitioning")
-                else:
-                    print("Node already has children. Not partitioning.")
-                return True
-            
-    def getNodeArea(self, nodeNameToFind, area, traversalLevel = 0, nameWasFound = False):
-         for nodeName in self.children:
-            if (nameWasFound != True):
-                nameWasFound = self.children[nodeName].getNodeArea(nodeNameToFind, area, traversalLevel + 1, nameWasFound)
-            if (nodeName == nodeNameToFind):
-                print("Found " + nodeName + ". Returning area of " + str(self.children[nodeName].box.getArea()))                
-                area.append(self.children[nodeName].box.getArea())
-                return True
-
-    def constructSubArea(self):
-        for nodeName in self.children:
-            self.children[nodeName].constructSubArea()
-            print("Constructing sub area for: " + nodeName)
-            subAreaBox = self.children[nodeName].box.constructSubArea()
-            self.children[nodeName].subArea = subAreaBox
+    def constructSubArea(self, rng = random, placementMode = SUBAREAPLACEMENTREJECTION, stats = None):
+        for node in self.iterPostOrder():
+            if (node is not self):
+                logger.debug("Constructing sub area for: %s", node.name)
+                sampleCounts = stats.getRejectedSampleCounts(node) if stats is not None else None
+                node.subArea = node.box.constructSubArea(rng, placementMode, sampleCounts, node.name)
+                node.shapeCache = None
+        self.invalidateShapeCache()
         
     def resetSubArea(self):
-        for nodeName in self.children:
-            self.children[nodeName].resetSubArea()
-            print("Resetting sub area for: " + nodeName)
-            self.children[nodeName].subArea = Box()
-            self.children[nodeName].childrenAreConnected = False
-            self.children[nodeName].connection = Box()
+        for node in self.iterPostOrder():
+            if (node is not self):
+                logger.debug("Resetting sub area for: %s", node.name)
+                node.subArea = Box()
+                node.childrenAreConnected = False
+                node.connection = Box()
+                node.shapeCache = None
+        self.invalidateShapeCache()
         
     def getListOfLeafPairs(self, listOfLeafPairs):        
-        tempListOfChildren = []
-        for nodeName in self.children:
-            self.children[nodeName].getListOfLeafPairs(listOfLeafPairs)
-            if (len(self.children[nodeName].children) == 0):
-                tempListOfChildren.append(nodeName)
-        if (len(tempListOfChildren) == 2): 
-            print(tempListOfChildren[0] + " and " + tempListOfChildren[1] + " have no children")
-            listOfLeafPairs.append((tempListOfChildren[0], tempListOfChildren[1]))
+        for node in self.iterPostOrder():
+            tempListOfChildren = [nodeName for nodeName in node.children if len(node.children[nodeName].children) == 0]
+            if (len(tempListOfChildren) == 2): 
+                logger.debug("%s and %s have no children", tempListOfChildren[0], tempListOfChildren[1])
+                listOfLeafPairs.append((tempListOfChildren[0], tempListOfChildren[1]))
+
+    '''
+    Connects the children of every node in this subtree, children before parents.
+    See connectChildren.
+    '''
+    def connectSubArea(self, li_subAreasSuccessfullyConnected, rng = random, stats = None):
+        for node in self.iterPostOrder():
+            node.connectChildren(li_subAreasSuccessfullyConnected, rng, stats)
 
     '''
     One of the major functions, and one of the ugliest.
@@ -400,32 +765,28 @@ class AreaNode(object):
     The strange list variable, li_subAreasSuccessfullyConnected, is used because
     I couldn't figure out how to declare a static variable in Python, and I couldn't
     assign an integer or boolean. Evidently, lists are mutable and I could modify it 
-    and have it maintained during recursion.
-    
+    and have it maintained from one node to the next.
     
+    This only connects this node's own two children; connectSubArea calls it for
+    every node of a subtree, children first. The number of connectors tried is
+    added to stats.corridorAttempts when stats is given.
     '''
-    def connectSubArea(self, li_subAreasSuccessfullyConnected):
-        tempListOfChildren = []
-        for nodeName in self.children:
-            self.children[nodeName].connectSubArea(li_subAreasSuccessfullyConnected)
-            tempListOfChildren.append(nodeName)
+    def connectChildren(self, li_subAreasSuccessfullyConnected, rng = random, stats = None):
+        tempListOfChildren = list(self.children)
         if (len(tempListOfChildren) == 2 and li_subAreasSuccessfullyConnected != [False]):
             if (self.childrenAreConnected == False):
-                print("Adding connection that connects children: " + tempListOfChildren[0] + " and " + tempListOfChildren[1] + " of parent node: " + self.name)
+                traceEnabled = logger.isEnabledFor(logging.DEBUG)
+                if (traceEnabled):
+                    logger.debug("Adding connection that connects children: %s and %s of parent node: %s", tempListOfChildren[0], tempListOfChildren[1], self.name)
 
-                # Obtain a list of boxes for each child.
-                shapeListFirstChild = []
-                shapeListSecondChild = []
-                
-                self.children[tempListOfChildren[0]].getSubAreaShapes(shapeListFirstChild)
-                self.children[tempListOfChildren[1]].getSubAreaShapes(shapeListSecondChild)
+                # Obtain a list of boxes for each child. These are cached on the
+                # children, so they are only read from here on.
+                shapeListFirstChild = self.children[tempListOfChildren[0]].getSubAreaShapeList()
+                shapeListSecondChild = self.children[tempListOfChildren[1]].getSubAreaShapeList()
                 
                 # Generate a potential connection between the two lists
-                print("Attempting to connect:")
-                print("Child 1's shapes: ")
-                print(shapeListFirstChild)
-                print("With Child 2's shapes: ")
-                print(shapeListSecondChild)
+                if (traceEnabled):
+                    logger.debug("Attempting to connect:\nChild 1's shapes: \n%r\nWith Child 2's shapes: \n%r", shapeListFirstChild, shapeListSecondChild)
                 
                 boxHelper = BoxHelper()
                 # Start by choosing the boxes that have the closest centers.
@@ -434,6 +795,7 @@ class AreaNode(object):
                 choiceFromSecondList = shapeListSecondChild[indexList[1]]
                 
                 terminationIterator = 0                
+                attemptCount = 0
                 while (self.childrenAreConnected == False):
                     
                     if (terminationIterator > 100):
@@ -441,40 +803,41 @@ class AreaNode(object):
                         # necessary for the given sub areas. If we try to reconstruct
                         # the sub areas, it will invalidate the previous connections made.
                         # At this point, we should probably abort and start again.
-                        print("Termination iterator condition met. Setting exit status to false.")
+                        logger.info("Termination iterator condition met for node %s. Setting exit status to false.", self.name)
                         if (len(li_subAreasSuccessfullyConnected) == 0):                        
                             li_subAreasSuccessfullyConnected.append(False)
                         else:
                             li_subAreasSuccessfullyConnected[0] = False
                         #raw_input("Press enter to continue")
                         break
+                    attemptCount += 1
                     
                     # Variable to track whether or not the shapes with the closest area will work
                     closestFailed = False
                     
                     # Find overlaps in the X and Y dimensions
                     # X borders (min, max) Y borders (min, max)
-                    xMinFirstShape = choiceFromFirstList.origin[0]
-                    xMaxFirstShape = choiceFromFirstList.origin[0] + choiceFromFirstList.width
+                    xMinFirstShape = choiceFromFirstList.x0
+                    xMaxFirstShape = choiceFromFirstList.x1
                     
-                    yMinFirstShape = choiceFromFirstList.origin[1]
-                    yMaxFirstShape = choiceFromFirstList.origin[1] + choiceFromFirstList.height
+                    yMinFirstShape = choiceFromFirstList.y0
+                    yMaxFirstShape = choiceFromFirstList.y1
                     
-                    xMinSecondShape = choiceFromSecondList.origin[0]
-                    xMaxSecondShape = choiceFromSecondList.origin[0] + choiceFromSecondList.width
+                    xMinSecondShape = choiceFromSecondList.x0
+                    xMaxSecondShape = choiceFromSecondList.x1
                     
-                    yMinSecondShape = choiceFromSecondList.origin[1]
-                    yMaxSecondShape = choiceFromSecondList.origin[1] + choiceFromSecondList.height  
+                    yMinSecondShape = choiceFromSecondList.y0
+                    yMaxSecondShape = choiceFromSecondList.y1
             
                     #Magic variable to determine the size of corridors.
                     CORRIDORSIZE = 4
                     
-                    print("Attempting to connect:")
-                    print(choiceFromFirstList)
-                    print(choiceFromSecondList)
+                    if (traceEnabled):
+                        logger.debug("Attempting to connect:\n%r\n%r", choiceFromFirstList, choiceFromSecondList)
                     
                     if (xMinFirstShape >= xMinSecondShape and xMinFirstShape <= xMaxSecondShape):
-                        print("First shape X starts after second, and starts before end of second")
+                        if (traceEnabled):
+                            logger.debug("First shape X starts after second, and starts before end of second")
                         # Need to travel along the Y to connect them. First, find the delimiting X space we can connect.
                         xConnectorLowerLimit = xMinFirstShape
                         xConnectorUpperLimit = min(xMaxFirstShape, xMaxSecondShape)
@@ -482,7 +845,7 @@ class AreaNode(object):
                             closestFailed = True
                             terminationIterator += 1 
                         else:
-                            xCenter = randint(xConnectorLowerLimit + (CORRIDORSIZE / 2.0), xConnectorUpperLimit - (CORRIDORSIZE / 2.0))
+                            xCenter = rng.randint(xConnectorLowerLimit + (CORRIDORSIZE / 2.0), xConnectorUpperLimit - (CORRIDORSIZE / 2.0))
                             
                             #Find where on the Y axis this needs to be located. Origin needs to be at the minimum maxX, and maximum minX
                             xOrigin = xCenter -2 
@@ -490,9 +853,9 @@ class AreaNode(object):
                             
                             yWidth = max(yMinFirstShape, yMinSecondShape) - yOrigin
                             
-                            print("The constructed connector will be:")
                             newConnector = Box((xOrigin, yOrigin), CORRIDORSIZE, yWidth)
-                            print(newConnector)
+                            if (traceEnabled):
+                                logger.debug("The constructed connector will be:\n%r", newConnector)
                             
                             self.connection = newConnector
                             
@@ -505,7 +868,8 @@ class AreaNode(object):
                         
                         
                     elif (yMinFirstShape >= yMinSecondShape and yMinFirstShape <= yMaxSecondShape):
-                        print("First shape Y starts after second, and starts before end of second")
+                        if (traceEnabled):
+                            logger.debug("First shape Y starts after second, and starts before end of second")
                         # Need to travel along the X to connect them. First, find the delimiting Y space we can connect.
                         yConnectorLowerLimit = yMinFirstShape
                         yConnectorUpperLimit = min(yMaxFirstShape, yMaxSecondShape)
@@ -513,7 +877,7 @@ class AreaNode(object):
                             closestFailed = True
                             terminationIterator += 1 
                         else:
-                            yCenter = randint(yConnectorLowerLimit + (CORRIDORSIZE / 2.0), yConnectorUpperLimit - (CORRIDORSIZE / 2.0))
+                            yCenter = rng.randint(yConnectorLowerLimit + (CORRIDORSIZE / 2.0), yConnectorUpperLimit - (CORRIDORSIZE / 2.0))
                             
                             #Find where on the X axis this needs to be located. Origin needs to be at the minimum maxX, and maximum minX
                             xOrigin = min(xMaxFirstShape, xMaxSecondShape)
@@ -521,9 +885,9 @@ class AreaNode(object):
                             
                             xWidth = max(xMinFirstShape, xMinSecondShape) - xOrigin
                             
-                            print("The constructed connector will be:")
                             newConnector = Box((xOrigin, yOrigin), xWidth, CORRIDORSIZE)
-                            print(newConnector)
+                            if (traceEnabled):
+                                logger.debug("The constructed connector will be:\n%r", newConnector)
                             
                             self.connection = newConnector
                         
@@ -535,7 +899,8 @@ class AreaNode(object):
                             
                     
                     elif (xMinSecondShape >= xMinFirstShape and xMinSecondShape <= xMaxFirstShape):
-                        print("Second shape X starts after first, and starts before end of first.")
+                        if (traceEnabled):
+                            logger.debug("Second shape X starts after first, and starts before end of first.")
                         # Need to travel along the Y to connect them. First, find the delimiting X space we can connect.
                         xConnectorLowerLimit = xMinSecondShape
                         xConnectorUpperLimit = min(xMaxFirstShape, xMaxSecondShape)
@@ -543,7 +908,7 @@ class AreaNode(object):
                             closestFailed = True
                             terminationIterator += 1 
                         else:
-                            xCenter = randint(xConnectorLowerLimit + (CORRIDORSIZE / 2.0), xConnectorUpperLimit - (CORRIDORSIZE / 2.0))
+                            xCenter = rng.randint(xConnectorLowerLimit + (CORRIDORSIZE / 2.0), xConnectorUpperLimit - (CORRIDORSIZE / 2.0))
                             
                             #Find where on the Y axis this needs to be located. Origin needs to be at the minimum maxX, and maximum minX
                             xOrigin = xCenter -2 
@@ -551,9 +916,9 @@ class AreaNode(object):
                             
                             yWidth = max(yMinFirstShape, yMinSecondShape) - yOrigin
                             
-                            print("The constructed connector will be:")
                             newConnector = Box((xOrigin, yOrigin), CORRIDORSIZE, yWidth)
-                            print(newConnector)
+                            if (traceEnabled):
+                                logger.debug("The constructed connector will be:\n%r", newConnector)
                             
                             self.connection = newConnector
                             
@@ -564,7 +929,8 @@ class AreaNode(object):
                                     #raw_input("Press enter to continue")
                         
                     elif (yMinSecondShape >= yMinFirstShape and yMinSecondShape <= yMaxFirstShape):
-                        print("Second shape Y starts after first, and starts before end of first.")
+                        if (traceEnabled):
+                            logger.debug("Second shape Y starts after first, and starts before end of first.")
                         # Need to travel along the X to connect them. First, find the delimiting Y space we can connect.
                         yConnectorLowerLimit = yMinSecondShape
                         yConnectorUpperLimit = min(yMaxFirstShape, yMaxSecondShape)
@@ -572,7 +938,7 @@ class AreaNode(object):
                             closestFailed = True
                             terminationIterator += 1                             
                         else:
-                            yCenter = randint(yConnectorLowerLimit + (CORRIDORSIZE / 2.0), yConnectorUpperLimit - (CORRIDORSIZE / 2.0))
+                            yCenter = rng.randint(yConnectorLowerLimit + (CORRIDORSIZE / 2.0), yConnectorUpperLimit - (CORRIDORSIZE / 2.0))
                             
                             #Find where on the X axis this needs to be located. Origin needs to be at the minimum maxX, and maximum minX
                             xOrigin = min(xMaxFirstShape, xMaxSecondShape)
@@ -580,9 +946,9 @@ class AreaNode(object):
                         
                             xWidth = max(xMinFirstShape, xMinSecondShape) - xOrigin
                             
-                            print("The constructed connector will be:")
                             newConnector = Box((xOrigin, yOrigin), xWidth, CORRIDORSIZE)
-                            print(newConnector)
+                            if (traceEnabled):
+                                logger.debug("The constructed connector will be:\n%r", newConnector)
                             
                             self.connection = newConnector    
                             self.childrenAreConnected = True
@@ -592,17 +958,16 @@ class AreaNode(object):
                                     #raw_input("Press enter to continue")
                     
                     else:
-                        print("Unable to make connection between:")
-                        print(choiceFromFirstList)
-                        print(choiceFromSecondList)
+                        if (traceEnabled):
+                            logger.debug("Unable to make connection between:\n%r\n%r", choiceFromFirstList, choiceFromSecondList)
                         closestFailed = True
                         terminationIterator += 1
                 
                     # If choosing the closest sub areas fails, we start picking at random.
                     # This should probably be picking the second clostest Boxes rather than at random.
                     if (closestFailed == True):
-                        indexList[0] = randint(0, len(shapeListFirstChild) - 1)
-                        indexList[1] = randint(0, len(shapeListSecondChild) - 1)
+                        indexList[0] = rng.randint(0, len(shapeListFirstChild) - 1)
+                        indexList[1] = rng.randint(0, len(shapeListSecondChild) - 1)
                         choiceFromFirstList = shapeListFirstChild[indexList[0]]
                         choiceFromSecondList = shapeListSecondChild[indexList[1]]        
                     else:
@@ -610,106 +975,305 @@ class AreaNode(object):
                         choiceFromFirstList = shapeListFirstChild[indexList[0]]
                         choiceFromSecondList = shapeListSecondChild[indexList[1]]     
 
+                if (stats is not None):
+                    stats.corridorAttempts[self.name] += attemptCount
+
                  
              
 '''
 Tree class to contain the root node. This class doesn't do much
 other than maintain the abstraction of the tree; it mostly just calls
-Node member functions using the rood node.
+Node member functions using the rood node. It also owns the random number
+generator (rng) that all of the node and Box operations draw from.
+
+Node names are unique within a tree, and the tree keeps a dictionary from name
+to node (nodeTable) that is updated whenever nodes are added or deleted. Finding
+a node by name is therefore O(1), as are partitioning, area queries and
+deletion, and searchNode rebuilds its path by following parent links.
+
+The tree also keeps a live set of sibling leaf pairs: for every node with exactly
+two leaf children, the names of those children. It is updated in O(1) whenever
+a node gains or loses children, and getRandomLeafPair draws from it without
+building a list.
+
+When a node cannot connect its children, connectSubAreasWithRepair regenerates
+only that node's subtree instead of the whole map, moving up to the parent when
+a subtree keeps failing. localRetryCount holds how many subtree regenerations
+the last call needed.
+
+When stats holds a BSPGenerationStats, building and connecting sub areas add
+their rejected samples and corridor attempts to it.
 
 The only unique function is that it can draw the tree, but maybe that
 should be refactored into a graphics plotting class.
 '''
 class AreaTree(object):
-    def __init__(self, rootNode):
+    def __init__(self, rootNode, rng = None):
         self.rootNode = rootNode
+        self.rng = rng if rng is not None else random.Random()
+        self.rootNode.parent = None
+        self.nodeTable = {}
+        self.leafPairs = {}  # Parent node name -> names of its two leaf children.
+        self.leafPairParents = []  # Keys of leafPairs, for drawing a random pair in O(1).
+        self.leafPairIndices = {}  # Parent node name -> index in leafPairParents.
+        self.localRetryCount = 0
+        self.stats = None
+        self.registerSubtree(rootNode)
+        for node in list(self.nodeTable.values()):
+            self.refreshLeafPair(node)
+    
+    def registerSubtree(self, subtreeRoot):
+        nodeStack = [subtreeRoot]
+        while (len(nodeStack) > 0):
+            node = nodeStack.pop()
+            if (node.name in self.nodeTable and self.nodeTable[node.name] is not node):
+                raise ValueError("Duplicate node name in tree: " + str(node.name))
+            self.nodeTable[node.name] = node
+            for childName in node.children:
+                node.children[childName].parent = node
+                nodeStack.append(node.children[childName])
+    
+    def unregisterSubtree(self, subtreeRoot):
+        nodeStack = [subtreeRoot]
+        while (len(nodeStack) > 0):
+            node = nodeStack.pop()
+            self.nodeTable.pop(node.name, None)
+            self.removeLeafPair(node.name)
+            nodeStack.extend(node.children.values())
+    
+    def addLeafPair(self, parentName, leafPair):
+        if (parentName not in self.leafPairs):
+            self.leafPairIndices[parentName] = len(self.leafPairParents)
+            self.leafPairParents.append(parentName)
+        self.leafPairs[parentName] = leafPair
+    
+    def removeLeafPair(self, parentName):
+        if (parentName in self.leafPairs):
+            # Swap the last entry into the removed slot to keep removal O(1).
+            index = self.leafPairIndices.pop(parentName)
+            lastParentName = self.leafPairParents.pop()
+            if (lastParentName != parentName):
+                self.leafPairParents[index] = lastParentName
+                self.leafPairIndices[lastParentName] = index
+            del self.leafPairs[parentName]
+    
+    '''
+    Re-evaluates whether the given node has exactly two leaf children, which
+    is only needed when its children or grandchildren change.
+    '''
+    def refreshLeafPair(self, node):
+        if (node is None):
+            return
+        leafChildNames = [childName for childName in node.children if len(node.children[childName].children) == 0]
+        if (len(leafChildNames) == 2):
+            self.addLeafPair(node.name, (leafChildNames[0], leafChildNames[1]))
+        else:
+            self.removeLeafPair(node.name)
+    
+    '''
+    Returns the names of a pair of sibling leaves, drawn from the live set
+    with rng (the tree's own by default). Raises ValueError if no node has
+    exactly two leaf children.
+    '''
+    def getRandomLeafPair(self, rng = None):
+        if (len(self.leafPairParents) == 0):
+            raise ValueError("No pair of sibling leaves to draw from in tree rooted at " + str(self.rootNode.name))
+        rng = rng if rng is not None else self.rng
+        return self.leafPairs[rng.choice(self.leafPairParents)]
+    
+    def getNode(self, nodeName):
+        return self.nodeTable.get(nodeName)
     
     def __repr__(self):
         return "Tree structure:\n\n" + self.rootNode.__repr__()
+    
+    def iterPreOrder(self):
+        return self.rootNode.iterPreOrder()
+    
+    def iterPreOrderWithDepth(self):
+        return self.rootNode.iterPreOrderWithDepth()
+    
+    def iterPostOrder(self):
+        return self.rootNode.iterPostOrder()
         
+    '''
+    Returns the names of the nodes from the root down to the given node. As
+    before, the root itself gives [0] and a missing node gives [None].
+    '''
     def searchNode(self, nodeNameToFind):
-        traversalList = []
-        print("\nInitiating search for: " + str(nodeNameToFind))
-        if (self.rootNode.name == nodeNameToFind):
-            print("Root node has value " + nodeNameToFind)
-            traversalList.append(0)
+        logger.debug("Initiating search for: %s", nodeNameToFind)
+        node = self.nodeTable.get(nodeNameToFind)
+        if (node is None):
+            traversalList = [None]
+        elif (node is self.rootNode):
+            logger.debug("Root node has value %s", nodeNameToFind)
+            traversalList = [0]
         else:
-            self.rootNode.searchNode(nodeNameToFind, traversalList, 1, False)
-            if (len(traversalList) != 0):
-                traversalList[0] = self.rootNode.name
-            else:
-                traversalList = [None]
-        print("Finished searching")
-        print("TraversalList:")
-        print(traversalList)
+            traversalList = []
+            while (node is not None):
+                traversalList.append(node.name)
+                node = node.parent
+            traversalList.reverse()
+        logger.debug("Finished searching. TraversalList: %s", traversalList)
         return traversalList
     
     def deleteNode(self, nodeToDelete):
-        print("Deleting " + nodeToDelete)
-        self.rootNode.deleteNode(nodeToDelete)
+        logger.debug("Deleting %s", nodeToDelete)
+        node = self.nodeTable.get(nodeToDelete)
+        if (node is None or node is self.rootNode):
+            logger.debug("%s is not a deletable node. Not deleting.", nodeToDelete)
+            return
+        parentNode = node.parent
+        parentNode.children.pop(nodeToDelete, None)
+        parentNode.invalidateShapeCache()
+        self.unregisterSubtree(node)
+        node.parent = None
+        self.refreshLeafPair(parentNode)
+        self.refreshLeafPair(parentNode.parent)
         
     def addNode(self, nodeParentName, nodeNameToAdd, box):
-        print("Adding " + nodeNameToAdd + " to node " + nodeParentName)
-        if (self.rootNode.name == nodeParentName):
-            newNode = AreaNode(nodeNameToAdd, defaultdict(AreaNode), box)
-            self.rootNode.children[nodeNameToAdd] = newNode
-        else:
-            self.rootNode.addNode(nodeParentName, nodeNameToAdd, box, 1, False)
+        logger.debug("Adding %s to node %s", nodeNameToAdd, nodeParentName)
+        parentNode = self.nodeTable.get(nodeParentName)
+        if (parentNode is None):
+            logger.debug("%s not found. Not adding %s", nodeParentName, nodeNameToAdd)
+            return
+        if (nodeNameToAdd in self.nodeTable):
+            raise ValueError("Duplicate node name in tree: " + str(nodeNameToAdd))
+        newNode = AreaNode(nodeNameToAdd, defaultdict(AreaNode), box, parentNode)
+        parentNode.children[nodeNameToAdd] = newNode
+        parentNode.invalidateShapeCache()
+        self.nodeTable[nodeNameToAdd] = newNode
+        self.refreshLeafPair(parentNode)
+        self.refreshLeafPair(parentNode.parent)
         
     def partitionNode(self, nodeNameToPartition, partitionNames):
-        print("Partitioning " + nodeNameToPartition)
-        if (nodeNameToPartition == self.rootNode.name):
-            if (len(self.rootNode.children) == 0):
-                MAGICMINIMUMAREA = 10
-                print("Area of " + self.rootNode.name + " is " + str(self.rootNode.box.getArea()) )
-                if (self.rootNode.box.getArea() > MAGICMINIMUMAREA):
-                    boxes = self.rootNode.box.partitionBox();
-                    self.addNode(nodeNameToPartition, partitionNames[0], boxes[0])
-                    self.addNode(nodeNameToPartition, partitionNames[1], boxes[1])
-                    print(self.rootNode.children)
-                else:
-                    print("Insufficient area to partition. Not partitioning")
+        logger.debug("Partitioning %s", nodeNameToPartition)
+        node = self.nodeTable.get(nodeNameToPartition)
+        if (node is None):
+            logger.debug("%s not found. Not partitioning", nodeNameToPartition)
+        elif (len(node.children) == 0):
+            MAGICMINIMUMAREA = 10
+            logger.debug("Area of %s is %s", node.name, node.box.getArea())
+            if (node.box.getArea() > MAGICMINIMUMAREA):
+                boxes = node.box.partitionBox(self.rng)
+                self.addNode(nodeNameToPartition, partitionNames[0], boxes[0])
+                self.addNode(nodeNameToPartition, partitionNames[1], boxes[1])
+                logger.debug("Children of %s: %s", node.name, list(node.children))
             else:
-                print("Node already has children. Not partitioning.")
+                logger.debug("Insufficient area to partition. Not partitioning")
         else:
-            self.rootNode.partitionNode(nodeNameToPartition, partitionNames, Box(), 1, False)
+            logger.debug("Node already has children. Not partitioning.")
     
     def getNodeArea(self, nodeNameToFind):
-        area = [] #For whatever reason I have to pass this as a list for it to be modified.
-        if (nodeNameToFind == self.rootNode.name):
-            area.append(self.rootNode.box.area)
-        else:
-            self.rootNode.getNodeArea(nodeNameToFind, area)
-        return area[0]
+        return self.nodeTable[nodeNameToFind].box.getArea()
                 
-    def constructSubAreas(self):
-        print("Creating sub areas")
-        self.rootNode.subArea = self.rootNode.box.constructSubArea()
-        self.rootNode.constructSubArea()
+    '''
+    Returns the names of the nodes whose boxes can never hold a sub area.
+    '''
+    def getInfeasibleSubAreaNodes(self, placementMode = SUBAREAPLACEMENTREJECTION):
+        return [node.name for node in self.iterPreOrder() if node.box.canHoldSubArea(placementMode) == False]
+    
+    def constructSubAreas(self, placementMode = SUBAREAPLACEMENTREJECTION):
+        logger.info("Creating sub areas")
+        infeasibleNodeNames = self.getInfeasibleSubAreaNodes(placementMode)
+        if (len(infeasibleNodeNames) > 0):
+            raise ValueError("No sub area fits in nodes: " + ", ".join(str(name) for name in infeasibleNodeNames))
+        sampleCounts = self.stats.getRejectedSampleCounts(self.rootNode) if self.stats is not None else None
+        self.rootNode.subArea = self.rootNode.box.constructSubArea(self.rng, placementMode, sampleCounts,
+                                                                   self.rootNode.name)
+        self.rootNode.constructSubArea(self.rng, placementMode, self.stats)
     
     def resetSubAreas(self):
-        print("Resetting sub areas")
+        logger.info("Resetting sub areas")
         self.rootNode.subArea = Box()
         self.rootNode.childrenAreConnected = False
         self.rootNode.connection = Box()
         self.rootNode.resetSubArea()
     
     def connectSubAreas(self, li_areasAreConnected):
-        print("Connecting sub areas")
-        self.rootNode.connectSubArea(li_areasAreConnected)
+        logger.info("Connecting sub areas")
+        self.rootNode.connectSubArea(li_areasAreConnected, self.rng, self.stats)
+    
+    '''
+    Throws away the sub areas and connections of the given node's subtree,
+    including the node's own connection, and builds them again. Returns True
+    if the subtree could be connected.
+    '''
+    def regenerateSubtree(self, node, placementMode = SUBAREAPLACEMENTREJECTION):
+        node.childrenAreConnected = False
+        node.connection = Box()
+        node.resetSubArea()
+        node.constructSubArea(self.rng, placementMode, self.stats)
+        li_subtreeIsConnected = []
+        node.connectSubArea(li_subtreeIsConnected, self.rng, self.stats)
+        return li_subtreeIsConnected != [False]
+    
+    '''
+    Same as connectSubAreas, but when a node fails to connect its children only
+    that node's subtree is regenerated, keeping every other connected subtree.
+    After maxLocalRetries failed regenerations of a subtree, the parent's subtree
+    is regenerated instead, up to the root. li_areasAreConnected is filled in the
+    same way as by connectSubAreas. Returns the number of subtree regenerations,
+    which is also kept in localRetryCount.
+    '''
+    def connectSubAreasWithRepair(self, li_areasAreConnected, placementMode = SUBAREAPLACEMENTREJECTION,
+                                  maxLocalRetries = MAXLOCALREPAIRRETRIES):
+        logger.info("Connecting sub areas with local repair")
+        self.localRetryCount = 0
+        connectionWasMade = False
+        for node in self.iterPostOrder():
+            li_nodeIsConnected = []
+            node.connectChildren(li_nodeIsConnected, self.rng, self.stats)
+            if (li_nodeIsConnected == [True]):
+                connectionWasMade = True
+            if (li_nodeIsConnected != [False]):
+                continue
+            
+            # Regenerating a subtree does not change the shape of the tree, so
+            # the traversal can carry on afterwards; nodes that the repair
+            # connected are skipped by connectChildren.
+            repairNode = node
+            retriesAtThisNode = 0
+            while (True):
+                if (retriesAtThisNode >= maxLocalRetries):
+                    if (repairNode.parent is None):
+                        logger.warning("Local repair failed at the root after %s retries. Terminating.", self.localRetryCount)
+                        li_areasAreConnected.append(False)
+                        return self.localRetryCount
+                    repairNode = repairNode.parent
+                    retriesAtThisNode = 0
+                    logger.info("Backtracking local repair to node %s", repairNode.name)
+                logger.debug("Regenerating subtree of node %s", repairNode.name)
+                self.localRetryCount += 1
+                retriesAtThisNode += 1
+                if (self.regenerateSubtree(repairNode, placementMode) == True):
+                    connectionWasMade = True
+                    break
+        logger.info("Local repair regenerated %s subtrees", self.localRetryCount)
+        if (connectionWasMade == True):
+            li_areasAreConnected.append(True)
+        return self.localRetryCount
+    
+    '''
+    Returns the rooms and connectors as a tile grid in the same format as
+    DiggingMap.getTileArray. See rasterizeAreaTree.
+    '''
+    def getTileArray(self, width = None, height = None):
+        return rasterizeAreaTree(self, width, height)
     
     def getListOfLeafPairs(self, leafPairList):
-        print("Getting list of leaf pairs")
-        self.rootNode.getListOfLeafPairs(leafPairList)
+        logger.debug("Getting list of leaf pairs")
+        for parentName in self.leafPairParents:
+            leafPairList.append(self.leafPairs[parentName])
             
-    def showAreaTree(self):
-        fig = plt.figure()
-        ax = fig.gca()  #GCA = get current axes
-        #This gets plotted, but isn't seen since things are drawn over it.
+    '''
+    Returns the root box, the node boxes, the rooms and the connectors as a
+    single PatchCollection, in the order they are drawn. One collection is
+    drawn far faster than one patch per rectangle.
+    '''
+    def getPatchCollection(self):
+        #The root gets drawn, but isn't seen since things are drawn over it.
         nodeBox = Rectangle(self.rootNode.box.getOrigin(), self.rootNode.box.getWidth(), self.rootNode.box.getHeight(), facecolor="grey")       
-        ax.add_patch(nodeBox)
-        ax.set_ylim(self.rootNode.box.getOrigin()[0],  self.rootNode.box.getOrigin()[0] + self.rootNode.box.getHeight())
-        ax.set_xlim(self.rootNode.box.getOrigin()[1],  self.rootNode.box.getOrigin()[1] + self.rootNode.box.getWidth())
         
         nodeColor = "blue"
         rectangleList = []
@@ -720,15 +1284,402 @@ class AreaTree(object):
         subAreaRectangleList = []
         self.rootNode.getSubAreaRectangles(subAreaRectangleList, roomColor, corridorColor)
         
-        for rectangle in reversed(rectangleList):   #Need to reverse it so the smaller rectangles get drawn over the larger
-            ax.add_patch(rectangle)
-            
-        for rectangle in reversed(subAreaRectangleList):
-            ax.add_patch(rectangle)
-            
+        #Need to reverse them so the smaller rectangles get drawn over the larger
+        patchList = [nodeBox] + rectangleList[::-1] + subAreaRectangleList[::-1]
+        return PatchCollection(patchList, match_original = True)
+    
+    def showAreaTree(self):
+        fig = plt.figure()
+        ax = fig.gca()  #GCA = get current axes
+        ax.add_collection(self.getPatchCollection())
+        ax.set_ylim(self.rootNode.box.getOrigin()[0],  self.rootNode.box.getOrigin()[0] + self.rootNode.box.getHeight())
+        ax.set_xlim(self.rootNode.box.getOrigin()[1],  self.rootNode.box.getOrigin()[1] + self.rootNode.box.getWidth())
         fig.show()
         
 
+'''
+Compact representation of an AreaTree as parallel numpy arrays, for keeping
+many generated layouts in memory at once. Nodes are numbered in pre-order
+(the root is node 0) and every array is indexed by node number:
+
+bounds               - (x, y, width, height) of the node's box
+splitAxes            - how the node was divided: SPLITALONGWIDTH (children are
+                       stacked along y), SPLITALONGHEIGHT (children are side by
+                       side along x) or SPLITNONE for leaves
+childIndices         - node numbers of the first and second child, -1 if absent
+parentIndices        - node number of the parent, -1 for the root
+rooms                - (x, y, width, height) of the node's sub area
+connectors           - (x, y, width, height) of the connection between its children
+childrenAreConnected - whether that connection has been made
+
+Rectangles are stored as float32, which holds the integer and halved
+coordinates produced by Box.partitionBox exactly for any practical map size.
+
+Node names are not stored when they follow the naming used by generateBSPMap
+("root", then "A" and "B", then the parent's name plus "_0" or "_1"), since
+toAreaTree can rebuild them. Trees with other names keep them in nodeNames.
+'''
+
+SPLITNONE = -1
+SPLITALONGWIDTH = 0
+SPLITALONGHEIGHT = 1
+
+FLATRECTANGLEDTYPE = np.float32
+FLATINDEXDTYPE = np.int32
+
+def getConventionalChildNames(parentName):
+    if (parentName == "root"):
+        return ("A", "B")
+    return (parentName + "_0", parentName + "_1")
+
+def getBoxValues(box):
+    return (box.x0, box.y0, box.width, box.height)
+
+def getBoxFromValues(values):
+    return Box((values[0], values[1]), values[2], values[3])
+
+class FlatAreaTree(object):
+    def __init__(self, nodeCount, nodeNames = None):
+        self.nodeCount = nodeCount
+        self.bounds = np.zeros((nodeCount, 4), dtype = FLATRECTANGLEDTYPE)
+        self.splitAxes = np.full(nodeCount, SPLITNONE, dtype = np.int8)
+        self.childIndices = np.full((nodeCount, 2), -1, dtype = FLATINDEXDTYPE)
+        self.parentIndices = np.full(nodeCount, -1, dtype = FLATINDEXDTYPE)
+        self.rooms = np.zeros((nodeCount, 4), dtype = FLATRECTANGLEDTYPE)
+        self.connectors = np.zeros((nodeCount, 4), dtype = FLATRECTANGLEDTYPE)
+        self.childrenAreConnected = np.zeros(nodeCount, dtype = np.bool_)
+        self.nodeNames = nodeNames
+    
+    def __repr__(self):
+        return "FlatAreaTree: " + str(self.nodeCount) + " nodes, " + str(self.getByteSize()) + " bytes"
+    
+    def getByteSize(self):
+        return (self.bounds.nbytes + self.splitAxes.nbytes + self.childIndices.nbytes
+                + self.parentIndices.nbytes + self.rooms.nbytes + self.connectors.nbytes
+                + self.childrenAreConnected.nbytes)
+    
+    def getLeafIndices(self):
+        return np.flatnonzero(self.childIndices[:, 0] < 0)
+    
+    def getRoomRectangles(self):
+        return self.rooms[self.getLeafIndices()]
+    
+    def getConnectorRectangles(self):
+        return self.connectors[self.childrenAreConnected]
+    
+    def getTileArray(self, width = None, height = None):
+        return rasterizeFlatAreaTree(self, width, height)
+    
+    def getNodeNames(self):
+        if (self.nodeNames is not None):
+            return list(self.nodeNames)
+        nodeNames = ["root"] + [None] * (self.nodeCount - 1)
+        for nodeIndex in range(self.nodeCount):
+            childNames = getConventionalChildNames(nodeNames[nodeIndex])
+            for childSlot in range(2):
+                childIndex = self.childIndices[nodeIndex, childSlot]
+                if (childIndex >= 0):
+                    nodeNames[childIndex] = childNames[childSlot]
+        return nodeNames
+    
+    '''
+    Rebuilds the AreaTree/AreaNode object graph, including sub areas and
+    connections.
+    '''
+    def toAreaTree(self, rng = None):
+        nodeNames = self.getNodeNames()
+        bounds = self.bounds.tolist()
+        rooms = self.rooms.tolist()
+        connectors = self.connectors.tolist()
+        nodes = []
+        for nodeIndex in range(self.nodeCount):
+            node = AreaNode(nodeNames[nodeIndex], defaultdict(AreaNode), getBoxFromValues(bounds[nodeIndex]))
+            node.subArea = getBoxFromValues(rooms[nodeIndex])
+            node.connection = getBoxFromValues(connectors[nodeIndex])
+            node.childrenAreConnected = bool(self.childrenAreConnected[nodeIndex])
+            nodes.append(node)
+        # Pre-order numbering means a parent always comes before its children.
+        for nodeIndex in range(1, self.nodeCount):
+            parentNode = nodes[self.parentIndices[nodeIndex]]
+            parentNode.children[nodes[nodeIndex].name] = nodes[nodeIndex]
+        return AreaTree(nodes[0], rng)
+
+'''
+Builds a FlatAreaTree from an AreaTree. Nodes may have at most two children.
+'''
+def flattenAreaTree(tree):
+    nodeList = list(tree.iterPreOrder())
+    nodeIndices = {}
+    for nodeIndex, node in enumerate(nodeList):
+        nodeIndices[id(node)] = nodeIndex
+    
+    namesAreConventional = (nodeList[0].name == "root")
+    flatTree = FlatAreaTree(len(nodeList))
+    bounds = []
+    rooms = []
+    connectors = []
+    for nodeIndex, node in enumerate(nodeList):
+        if (len(node.children) > 2):
+            raise ValueError("Node " + str(node.name) + " has more than two children")
+        bounds.append(getBoxValues(node.box))
+        rooms.append(getBoxValues(node.subArea))
+        connectors.append(getBoxValues(node.connection))
+        flatTree.childrenAreConnected[nodeIndex] = node.childrenAreConnected
+        
+        childNodes = list(node.children.values())
+        conventionalNames = getConventionalChildNames(node.name)
+        for childSlot, childNode in enumerate(childNodes):
+            childIndex = nodeIndices[id(childNode)]
+            flatTree.childIndices[nodeIndex, childSlot] = childIndex
+            flatTree.parentIndices[childIndex] = nodeIndex
+            if (childNode.name != conventionalNames[childSlot]):
+                namesAreConventional = False
+        if (len(childNodes) == 2):
+            if (childNodes[0].box.x0 == childNodes[1].box.x0):
+                flatTree.splitAxes[nodeIndex] = SPLITALONGWIDTH
+            else:
+                flatTree.splitAxes[nodeIndex] = SPLITALONGHEIGHT
+    
+    flatTree.bounds[:] = bounds
+    flatTree.rooms[:] = rooms
+    flatTree.connectors[:] = connectors
+    if (not namesAreConventional):
+        flatTree.nodeNames = [node.name for node in nodeList]
+    return flatTree
+
+
+'''
+Rasterization of rooms and connectors into a tile grid in the same format as
+DiggingMap: a TILEDTYPE array indexed [x, y] holding UNDUGTILE, CORRIDORTILE
+and ROOMTILE, with tile (0, 0) at the origin of the root box.
+
+Rectangle edges are rounded to the nearest tile boundary with halves rounded
+up (floor(edge + 0.5)), so the halved coordinates from Box.partitionBox are
+handled the same way everywhere: a rectangle from x = 2.5 to x = 7.5 covers
+tiles 3 through 7. Rectangles with a negative width or height are treated as
+spanning the same edges, and anything outside the grid is clipped. Connectors
+are drawn first and rooms are drawn over them.
+
+Up to RASTERIZESLICELIMIT rectangles are written one slice assignment each.
+Beyond that all of them are drawn in one pass with a difference array (+1 and
+-1 at the corners, then cumulative sums along both axes), whose cost depends
+on the size of the grid rather than on the number of rectangles.
+'''
+RASTERIZESLICELIMIT = 64
+
+'''
+Converts rows of (x, y, width, height) into clipped tile ranges
+[xStart, xEnd) and [yStart, yEnd), dropping rectangles that cover no tiles.
+'''
+def getTileRanges(rectangles, originX, originY, width, height):
+    rectangles = np.asarray(rectangles, dtype = np.float64).reshape(-1, 4)
+    xEdges = np.stack((rectangles[:, 0], rectangles[:, 0] + rectangles[:, 2]), axis = 1) - originX
+    yEdges = np.stack((rectangles[:, 1], rectangles[:, 1] + rectangles[:, 3]), axis = 1) - originY
+    xEdges.sort(axis = 1)
+    yEdges.sort(axis = 1)
+    xRanges = np.clip(np.floor(xEdges + 0.5), 0, width).astype(np.int64)
+    yRanges = np.clip(np.floor(yEdges + 0.5), 0, height).astype(np.int64)
+    coversTiles = (xRanges[:, 1] > xRanges[:, 0]) & (yRanges[:, 1] > yRanges[:, 0])
+    return xRanges[coversTiles], yRanges[coversTiles]
+
+def rasterizeRectangles(tileArray, rectangles, tile, originX = 0, originY = 0):
+    width, height = tileArray.shape
+    xRanges, yRanges = getTileRanges(rectangles, originX, originY, width, height)
+    if (len(xRanges) <= RASTERIZESLICELIMIT):
+        for (xStart, xEnd), (yStart, yEnd) in zip(xRanges.tolist(), yRanges.tolist()):
+            tileArray[xStart:xEnd, yStart:yEnd] = tile
+        return tileArray
+    coverage = np.zeros((width + 1, height + 1), dtype = np.int32)
+    np.add.at(coverage, (xRanges[:, 0], yRanges[:, 0]), 1)
+    np.add.at(coverage, (xRanges[:, 1], yRanges[:, 0]), -1)
+    np.add.at(coverage, (xRanges[:, 0], yRanges[:, 1]), -1)
+    np.add.at(coverage, (xRanges[:, 1], yRanges[:, 1]), 1)
+    np.cumsum(coverage, axis = 0, out = coverage)
+    np.cumsum(coverage, axis = 1, out = coverage)
+    tileArray[coverage[:width, :height] > 0] = tile
+    return tileArray
+
+'''
+Builds the tile grid for a layout given as (x, y, width, height) rows of rooms
+and connectors inside the box rootBounds. The grid is as large as the rounded
+root box unless width and height are given.
+'''
+def rasterizeLayout(roomRectangles, connectorRectangles, rootBounds, width = None, height = None):
+    originX, originY, rootWidth, rootHeight = rootBounds
+    if (width is None):
+        width = int(math.floor(originX + rootWidth + 0.5) - math.floor(originX + 0.5))
+    if (height is None):
+        height = int(math.floor(originY + rootHeight + 0.5) - math.floor(originY + 0.5))
+    tileArray = np.full((width, height), UNDUGTILE, dtype = TILEDTYPE)
+    rasterizeRectangles(tileArray, connectorRectangles, CORRIDORTILE, originX, originY)
+    rasterizeRectangles(tileArray, roomRectangles, ROOMTILE, originX, originY)
+    return tileArray
+
+def rasterizeAreaTree(tree, width = None, height = None):
+    roomRectangles = []
+    connectorRectangles = []
+    for node in tree.iterPostOrder():
+        if (node is not tree.rootNode and len(node.children) == 0):
+            roomRectangles.append(getBoxValues(node.subArea))
+        if (node.childrenAreConnected == True):
+            connectorRectangles.append(getBoxValues(node.connection))
+    return rasterizeLayout(roomRectangles, connectorRectangles, getBoxValues(tree.rootNode.box), width, height)
+
+def rasterizeFlatAreaTree(flatTree, width = None, height = None):
+    leafIndices = flatTree.getLeafIndices()
+    roomRectangles = flatTree.rooms[leafIndices[leafIndices != 0]]  # The root is never a room.
+    return rasterizeLayout(roomRectangles, flatTree.getConnectorRectangles(),
+                           flatTree.bounds[0].tolist(), width, height)
+
+
+'''
+Counters and timings of one generateBSPMap call, collected when it is called
+with collectStats = True or a profile:
+
+phaseTimes          - wall time in seconds of each phase: "partition" (steps
+                      1 to 6), "construct" and "connect" (steps 7 and 8 and
+                      steps 9 and 10, summed over every attempt; with local
+                      repair the regenerated subtrees count as "connect") and
+                      "generate" (the whole call)
+partitionIterations - passes through the partition loop
+leafRejectedSamples - leaf name -> sub areas (rooms) drawn and thrown away by
+                      the rejection loop, summed over every attempt
+internalRejectedSamples - the same for the root and the other internal nodes,
+                      whose sub areas are drawn but never become rooms
+corridorAttempts    - internal node name -> connectors tried between its
+                      children, summed over every attempt (at most 101 per
+                      attempt)
+connectAttempts     - times the sub areas of the whole tree were built and
+                      connected; each one after the first is a full reset
+localRetries        - subtree regenerations of the local repair
+nodeCount, leafCount and depth describe the tree (the root has depth 0).
+Sub areas placed with SUBAREAPLACEMENTDIRECT are never rejected, so both
+rejected sample tables are None in that mode rather than empty.
+
+profile = PROFILECPROFILE keeps a pstats.Stats of the call in profile, and
+profile = PROFILETRACEMALLOC keeps a tracemalloc snapshot in profile and the
+peak memory the call allocated, in bytes, in peakMemory.
+'''
+PROFILECPROFILE = "cprofile"
+PROFILETRACEMALLOC = "tracemalloc"
+PROFILEMODES = (PROFILECPROFILE, PROFILETRACEMALLOC)
+
+class BSPGenerationStats(object):
+    def __init__(self, profileMode = None, placementMode = SUBAREAPLACEMENTREJECTION):
+        if (profileMode is not None and profileMode not in PROFILEMODES):
+            raise ValueError("Unknown profile mode: " + str(profileMode))
+        self.phaseTimes = defaultdict(float)
+        self.partitionIterations = 0
+        self.leafRejectedSamples = None
+        self.internalRejectedSamples = None
+        if (placementMode == SUBAREAPLACEMENTREJECTION):
+            self.leafRejectedSamples = defaultdict(int)
+            self.internalRejectedSamples = defaultdict(int)
+        self.corridorAttempts = defaultdict(int)
+        self.connectAttempts = 0
+        self.localRetries = 0
+        self.nodeCount = 0
+        self.leafCount = 0
+        self.depth = 0
+        self.connected = False
+        self.profileMode = profileMode
+        self.profiler = None
+        self.startedTracing = False
+        self.profile = None
+        self.peakMemory = None
+
+    def __repr__(self):
+        if (self.leafRejectedSamples is None):
+            rejectedSamplesText = "rejected samples not applicable, "
+        else:
+            rejectedSamplesText = ("rejected samples " + str(self.getTotalRejectedSamples(self.leafRejectedSamples))
+                                   + " in leaves and " + str(self.getTotalRejectedSamples(self.internalRejectedSamples))
+                                   + " in internal nodes, ")
+        return ("BSPGenerationStats: " + str(self.nodeCount) + " nodes, depth " + str(self.depth) + ", "
+                + str(self.connectAttempts) + " connect attempts, " + str(self.fullResets) + " full resets, "
+                + str(self.localRetries) + " local retries, " + rejectedSamplesText
+                + str(self.getTotalCorridorAttempts()) + " corridor attempts, times "
+                + ", ".join(phaseName + " " + "%.4f" % seconds for phaseName, seconds in self.phaseTimes.items()))
+
+    @property
+    def fullResets(self):
+        return max(self.connectAttempts - 1, 0)
+
+    def addPhaseTime(self, phaseName, seconds):
+        self.phaseTimes[phaseName] += seconds
+
+    '''
+    Returns the table rejected samples of node are counted in, or None if
+    they are not counted.
+    '''
+    def getRejectedSampleCounts(self, node):
+        if (len(node.children) == 0):
+            return self.leafRejectedSamples
+        return self.internalRejectedSamples
+
+    def getTotalRejectedSamples(self, sampleCounts):
+        if (sampleCounts is None):
+            return None
+        return sum(sampleCounts.values())
+
+    def getTotalCorridorAttempts(self):
+        return sum(self.corridorAttempts.values())
+
+    def recordTree(self, tree, connected):
+        self.nodeCount = len(tree.nodeTable)
+        self.leafCount = 0
+        self.depth = 0
+        for node, depth in tree.rootNode.iterPreOrderWithDepth():
+            if (len(node.children) == 0):
+                self.leafCount += 1
+            self.depth = max(self.depth, depth)
+        self.localRetries = tree.localRetryCount
+        self.connected = connected
+
+    def startProfiling(self):
+        if (self.profileMode == PROFILECPROFILE):
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif (self.profileMode == PROFILETRACEMALLOC):
+            self.startedTracing = not tracemalloc.is_tracing()
+            if (self.startedTracing):
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self.peakMemory = tracemalloc.get_traced_memory()[0]
+
+    def stopProfiling(self):
+        if (self.profileMode == PROFILECPROFILE):
+            self.profiler.disable()
+            self.profile = pstats.Stats(self.profiler)
+            self.profiler = None
+        elif (self.profileMode == PROFILETRACEMALLOC):
+            self.peakMemory = tracemalloc.get_traced_memory()[1] - self.peakMemory
+            self.profile = tracemalloc.take_snapshot()
+            if (self.startedTracing):
+                tracemalloc.stop()
+
+    '''
+    Returns the counters as a dictionary of plain values, e.g. for JSON.
+    '''
+    def getSummary(self):
+        return {"phaseTimes": dict(self.phaseTimes),
+                "partitionIterations": self.partitionIterations,
+                "leafRejectedSamples": self.getTotalRejectedSamples(self.leafRejectedSamples),
+                "maximumLeafRejectedSamples": (max(self.leafRejectedSamples.values(), default = 0)
+                                               if self.leafRejectedSamples is not None else None),
+                "internalRejectedSamples": self.getTotalRejectedSamples(self.internalRejectedSamples),
+                "corridorAttempts": self.getTotalCorridorAttempts(),
+                "maximumCorridorAttempts": max(self.corridorAttempts.values(), default = 0),
+                "connectAttempts": self.connectAttempts,
+                "fullResets": self.fullResets,
+                "localRetries": self.localRetries,
+                "nodeCount": self.nodeCount,
+                "leafCount": self.leafCount,
+                "depth": self.depth,
+                "connected": self.connected,
+                "peakMemory": self.peakMemory}
+
+
 '''
 Prototype implementation of the binary space partitioning method 
 of map construction used here.
@@ -747,24 +1698,65 @@ within its boundaries
 rooms in the nodes of the BSP tree with children of the same
 parent
 10:repeat 9 until the children of the root node are connected
+
+With collectStats = True, or a profile (PROFILECPROFILE or PROFILETRACEMALLOC),
+a (tree, stats) pair is returned instead, stats being the BSPGenerationStats
+of the call and tree None if generation failed.
 '''
 
-def generateBSPMap():
+def generateBSPMap(seed = None, mapWidth = 256, mapHeight = 256, minimumAreaFraction = 0.03125,
+                   placementMode = SUBAREAPLACEMENTREJECTION, localRepair = False, showPlot = True,
+                   collectStats = False, profile = None):
+    stats = None
+    if (collectStats == True or profile is not None):
+        stats = BSPGenerationStats(profile, placementMode)
+        stats.startProfiling()
+    try:
+        startTime = time.perf_counter()
+        rng = random.Random(seed)
+        tree = partitionAreaTree(rng, mapWidth, mapHeight, minimumAreaFraction, stats)
+        partitionTime = time.perf_counter()
+        tree.stats = stats
+        connected = connectAreaTree(tree, placementMode, localRepair)
+    finally:
+        if (stats is not None):
+            stats.stopProfiling()
+    if (stats is not None):
+        stats.addPhaseTime("partition", partitionTime - startTime)
+        stats.addPhaseTime("generate", time.perf_counter() - startTime)
+        stats.recordTree(tree, connected)
+        logger.info("%r", stats)
+    if (connected == True):
+        logger.info("%r", tree)
+        if (showPlot):
+            tree.showAreaTree()
+    else:
+        tree = None
+    if (stats is not None):
+        return (tree, stats)
+    return tree
+
+'''
+Steps 1 through 6: builds the tree of cells, partitioning until the cells are
+no larger than minimumAreaFraction of the map.
+'''
+def partitionAreaTree(rng, mapWidth, mapHeight, minimumAreaFraction, stats = None):
     # 1: start with the entire area (root node of the BSP tree)
-    rootNodeBox = Box((0, 0), 256, 256) #The dimensions should be evenly divisible by 2
+    rootNodeBox = Box((0, 0), mapWidth, mapHeight) #The dimensions should be evenly divisible by 2
     rootNode = AreaNode("root", defaultdict(AreaNode), rootNodeBox)
-    tree = AreaTree(rootNode)
+    tree = AreaTree(rootNode, rng)
     firstPartitionNames = ("A", "B")
     # 2: divide the area along a horizontal or vertical line
     tree.partitionNode("root", firstPartitionNames)
     currentArea = rootNodeBox.getArea()
     currentPartitionNames = firstPartitionNames
-    MAGICMINIMUMAREA = (0.03125) * 256 * 256
-    #MAGICMINIMUMAREA = (0.10) * 256 * 256
+    MAGICMINIMUMAREA = minimumAreaFraction * mapWidth * mapHeight
     
     while (currentArea > MAGICMINIMUMAREA):
+        if (stats is not None):
+            stats.partitionIterations += 1
         # 3: select one of the two new partition cells
-        chosenIndex = random.choice([0, 1])
+        chosenIndex = rng.choice([0, 1])
         chosenPartition = currentPartitionNames[chosenIndex]    
         if (chosenIndex == 0):    
             otherPartition = currentPartitionNames[1]
@@ -772,33 +1764,58 @@ def generateBSPMap():
             otherPartition = currentPartitionNames[0]
         
         #4: if this cell is bigger than the minimal acceptable size:
-        print("Chosen partition " + chosenPartition + " has node area " + str(tree.getNodeArea(chosenPartition)))
+        chosenArea = tree.getNodeArea(chosenPartition)
+        logger.debug("Chosen partition %s has node area %s", chosenPartition, chosenArea)
 
-        if (tree.getNodeArea(chosenPartition) > MAGICMINIMUMAREA):
+        if (chosenArea > MAGICMINIMUMAREA):
             #5: go to step 2 (using this cell as the area to be divided)
             newPartitionNames = (chosenPartition + "_0", chosenPartition + "_1")
             tree.partitionNode(chosenPartition, newPartitionNames)
         
         #6: select the other partition cell, and go to step 4
-        if (tree.getNodeArea(otherPartition) > MAGICMINIMUMAREA):
+        otherArea = tree.getNodeArea(otherPartition)
+        if (otherArea > MAGICMINIMUMAREA):
             newPartitionNames = (otherPartition + "_0", otherPartition + "_1")
             tree.partitionNode(otherPartition, newPartitionNames)
         
-        currentArea = min([tree.getNodeArea(chosenPartition), tree.getNodeArea(otherPartition)])
+        currentArea = min(chosenArea, otherArea)
 
-        partitionNameList = []
-        tree.getListOfLeafPairs(partitionNameList)
-        currentPartitionNames = random.choice(partitionNameList)
+        currentPartitionNames = tree.getRandomLeafPair()
         
+    return tree
+
+'''
+Steps 7 through 10: places a sub area in every cell and connects them,
+starting over (or repairing locally, see AreaTree.connectSubAreasWithRepair)
+when the connections cannot be made. Returns True if the whole tree is
+connected. Phase times and attempts are added to tree.stats when it is set.
+'''
+def connectAreaTree(tree, placementMode = SUBAREAPLACEMENTREJECTION, localRepair = False):
     #7: for every partition cell:
     #8: create a room within the cell by randomly
     #   choosing two points (top left and bottom right)
     #   within its boundaries
     li_areasAreConnected = []
     terminationIterator = 0
-    while (li_areasAreConnected == [False] or li_areasAreConnected == []):     
+    stats = tree.stats
+    if (localRepair == True):
+        # Only the subtrees that fail to connect are built again; see
+        # AreaTree.connectSubAreasWithRepair. Giving up here means even
+        # rebuilding from the root failed repeatedly.
+        phaseStartTime = time.perf_counter()
+        tree.resetSubAreas()
+        tree.constructSubAreas(placementMode)
+        constructedTime = time.perf_counter()
+        tree.connectSubAreasWithRepair(li_areasAreConnected, placementMode)
+        if (stats is not None):
+            stats.connectAttempts += 1
+            stats.addPhaseTime("construct", constructedTime - phaseStartTime)
+            stats.addPhaseTime("connect", time.perf_counter() - constructedTime)
+    while (localRepair == False and (li_areasAreConnected == [False] or li_areasAreConnected == [])):     
+        phaseStartTime = time.perf_counter()
         tree.resetSubAreas()        
-        tree.constructSubAreas()
+        tree.constructSubAreas(placementMode)
+        constructedTime = time.perf_counter()
 
         #9: starting from the lowest layers, draw corridors to connect
         #   rooms in the nodes of the BSP tree with children of the same
@@ -806,17 +1823,19 @@ def generateBSPMap():
         #10:repeat 9 until the children of the root node are connected
         li_areasAreConnected = []
         tree.connectSubAreas(li_areasAreConnected)
+        if (stats is not None):
+            stats.connectAttempts += 1
+            stats.addPhaseTime("construct", constructedTime - phaseStartTime)
+            stats.addPhaseTime("connect", time.perf_counter() - constructedTime)
         terminationIterator += 1
         if (terminationIterator > 50):
-            print("Attempted too many iterations. Terminating.")
-            print(li_areasAreConnected)
+            logger.warning("Attempted too many iterations. Terminating. Connection status: %s", li_areasAreConnected)
             break
 
-    if (li_areasAreConnected == [True]):
-        print(tree)
-        tree.showAreaTree()
+    return (li_areasAreConnected == [True])
 
 if __name__ == "__main__":
+    enableDiagnostics(logging.INFO)
     generateBSPMap()
        
 
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Map farm: generates many maps in parallel across a pool of processes.
+
+PROVIDED AS IS WITHOUT WARRANTY OR GUARANTEE THAT IT WILL WORK.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import logging
+import os
+import time
+
+from ProcGenCache import GenerationCache
+from ProcGenDiagnostics import getDiagnosticsLogger, enableDiagnostics
+from ProcGenExample_AgentDigger import generateAgentDiggerMap
+from ProcGenExample_BSP import generateBSPMap
+from ProcGenMapFormat import MAPFILEEXTENSION, saveGeneratedMap
+from ProcGenRender import saveTileImage
+
+'''
+Every map is independent and fully determined by its seed, so a batch of maps
+is spread over a ProcessPoolExecutor one seed per task. Seeds are handed to the
+workers in chunks (the chunksize argument of Executor.map) so that the number
+of round trips to the workers, and with it the IPC overhead, stays bounded no
+matter how many maps are requested. Results come back in seed order.
+
+Usage from the command line, e.g.:
+python ProcGenFarm.py digger --seed-start 0 --count 10000 --jobs 32
+
+With a thumbnail directory, each worker also writes a PNG of every map it
+generates (see ProcGenRender.saveTileImage), named <kind>_<seed>.png. With an
+output directory it saves every map as <kind>_<seed>.pgmap (see
+ProcGenMapFormat), recording the seed and parameters it was generated with.
+With a cache directory, maps go through a ProcGenCache.GenerationCache on that
+directory (one per worker, sharing the directory), so building the same maps
+again only reads them back.
+'''
+
+logger = getDiagnosticsLogger("farm")
+
+GENERATORS = {"digger": generateAgentDiggerMap,
+              "bsp": generateBSPMap}
+
+'''
+Number of chunks to aim for per worker when no chunk size is given. A few
+chunks per worker keeps the workers evenly loaded when some maps take longer
+than others, while still keeping the number of submissions small.
+'''
+CHUNKSPERWORKER = 4
+
+# The GenerationCache of this process for each cache directory.
+farmCaches = {}
+
+
+def getFarmMapPath(directory, generatorKind, seed, extension):
+    return os.path.join(directory, generatorKind + "_" + str(seed) + extension)
+
+
+def getFarmCache(cacheDirectory):
+    if (cacheDirectory not in farmCaches):
+        farmCaches[cacheDirectory] = GenerationCache(cacheDirectory)
+    return farmCaches[cacheDirectory]
+
+
+def generateFarmMap(generatorKind, parameters, seed, thumbnailDirectory = None, thumbnailScale = 1,
+                    outputDirectory = None, cacheDirectory = None):
+    if (cacheDirectory is not None):
+        result = getFarmCache(cacheDirectory).generate(generatorKind, seed, **parameters)
+    else:
+        result = GENERATORS[generatorKind](seed = seed, showPlot = False, **parameters)
+    if (thumbnailDirectory is not None and result is not None):
+        saveTileImage(result.getTileArray(), getFarmMapPath(thumbnailDirectory, generatorKind, seed, ".png"), thumbnailScale)
+    if (outputDirectory is not None and result is not None):
+        mapParameters = dict(parameters, seed = seed)
+        saveGeneratedMap(getFarmMapPath(outputDirectory, generatorKind, seed, MAPFILEEXTENSION), result, mapParameters)
+    return result
+
+
+def getDefaultChunkSize(seedCount, jobs):
+    return max(1, seedCount // (jobs * CHUNKSPERWORKER))
+
+
+'''
+Generates one map of the given kind ("digger" or "bsp") per seed and returns
+the results in the same order as the seeds. parameters are passed through as
+keyword arguments to the generator (e.g. mapWidth, mapHeight). With jobs = 1
+the maps are generated in this process without a pool. If thumbnailDirectory
+is given, a PNG with thumbnailScale pixels per tile is written there per map,
+and if outputDirectory is given every map is saved there as a map file. Maps
+are looked up in and added to a GenerationCache on cacheDirectory if given.
+'''
+def farmMaps(generatorKind, seeds, parameters = None, jobs = None, chunkSize = None,
+             thumbnailDirectory = None, thumbnailScale = 1, outputDirectory = None, cacheDirectory = None):
+    if (generatorKind not in GENERATORS):
+        raise ValueError("Unknown generator kind: " + str(generatorKind))
+    seeds = list(seeds)
+    parameters = dict(parameters) if parameters is not None else {}
+    jobs = jobs if jobs is not None else (os.cpu_count() or 1)
+    for directory in (thumbnailDirectory, outputDirectory):
+        if (directory is not None):
+            os.makedirs(directory, exist_ok = True)
+    generateMap = partial(generateFarmMap, generatorKind, parameters,
+                          thumbnailDirectory = thumbnailDirectory, thumbnailScale = thumbnailScale,
+                          outputDirectory = outputDirectory, cacheDirectory = cacheDirectory)
+
+    if (jobs == 1 or len(seeds) <= 1):
+        return [generateMap(seed) for seed in seeds]
+
+    if (chunkSize is None):
+        chunkSize = getDefaultChunkSize(len(seeds), jobs)
+    logger.info("Farming %s %s maps over %s workers in chunks of %s", len(seeds), generatorKind, jobs, chunkSize)
+    with ProcessPoolExecutor(max_workers = jobs) as executor:
+        return list(executor.map(generateMap, seeds, chunksize = chunkSize))
+
+
+def getParametersFromArguments(arguments):
+    parameters = {}
+    if (arguments.width is not None):
+        parameters["mapWidth"] = arguments.width
+    if (arguments.height is not None):
+        parameters["mapHeight"] = arguments.height
+    if (arguments.kind == "digger"):
+        if (arguments.coverage is not None):
+            parameters["percentAreaTarget"] = arguments.coverage
+        if (arguments.direction_chance is not None):
+            parameters["directionPercentChance"] = arguments.direction_chance
+        if (arguments.room_chance is not None):
+            parameters["roomPercentChance"] = arguments.room_chance
+        if (arguments.fast_stepping):
+            parameters["fastStepping"] = True
+    elif (arguments.minimum_area_fraction is not None):
+        parameters["minimumAreaFraction"] = arguments.minimum_area_fraction
+    return parameters
+
+
+def buildArgumentParser():
+    parser = argparse.ArgumentParser(description = "Generate many maps in parallel.")
+    parser.add_argument("kind", choices = sorted(GENERATORS), help = "Which generator to run")
+    parser.add_argument("--seed-start", type = int, default = 0, help = "First seed to generate")
+    parser.add_argument("--count", type = int, default = 100, help = "Number of consecutive seeds to generate")
+    parser.add_argument("--jobs", type = int, default = os.cpu_count() or 1, help = "Number of worker processes")
+    parser.add_argument("--chunksize", type = int, default = None, help = "Seeds sent to a worker per submission")
+    parser.add_argument("--width", type = int, default = None, help = "Map width")
+    parser.add_argument("--height", type = int, default = None, help = "Map height")
+    parser.add_argument("--coverage", type = float, default = None, help = "Digger: percent of the map to dig")
+    parser.add_argument("--direction-chance", type = float, default = None, help = "Digger: initial percent chance of changing direction")
+    parser.add_argument("--room-chance", type = float, default = None, help = "Digger: initial percent chance of building a room")
+    parser.add_argument("--fast-stepping", action = "store_true", help = "Digger: dig straight corridors in one go (same distribution, different maps per seed)")
+    parser.add_argument("--minimum-area-fraction", type = float, default = None, help = "BSP: smallest cell as a fraction of the map area")
+    parser.add_argument("--thumbnail-dir", default = None, help = "Write a PNG of every map to this directory")
+    parser.add_argument("--thumbnail-scale", type = int, default = 1, help = "Pixels per tile in thumbnails")
+    parser.add_argument("--output-dir", default = None, help = "Save every map as a map file in this directory")
+    parser.add_argument("--cache-dir", default = None, help = "Reuse maps cached in this directory and cache new ones there")
+    parser.add_argument("--verbose", action = "store_true", help = "Log progress")
+    return parser
+
+
+def main(argumentList = None):
+    arguments = buildArgumentParser().parse_args(argumentList)
+    if (arguments.verbose):
+        enableDiagnostics(logging.INFO)
+    seeds = range(arguments.seed_start, arguments.seed_start + arguments.count)
+    parameters = getParametersFromArguments(arguments)
+
+    startTime = time.perf_counter()
+    results = farmMaps(arguments.kind, seeds, parameters, arguments.jobs, arguments.chunksize,
+                       arguments.thumbnail_dir, arguments.thumbnail_scale, arguments.output_dir,
+                       arguments.cache_dir)
+    elapsedTime = time.perf_counter() - startTime
+
+    failedCount = sum(1 for result in results if result is None)
+    mapsPerSecond = len(results) / elapsedTime if elapsedTime > 0 else float("inf")
+    print("Generated %d %s maps (%d failed) in %.3f s with %d jobs: %.1f maps/second"
+          % (len(results), arguments.kind, failedCount, elapsedTime, arguments.jobs, mapsPerSecond))
+    return results
+
+
+if __name__ == "__main__":
+    main()
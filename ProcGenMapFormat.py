@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Versioned binary file format for generated maps.
+
+PROVIDED AS IS WITHOUT WARRANTY OR GUARANTEE THAT IT WILL WORK.
+"""
+
+import io
+import json
+import os
+import struct
+
+import numpy as np
+
+from ProcGenExample_AgentDigger import DiggingMap
+from ProcGenExample_BSP import AreaTree, FlatAreaTree, flattenAreaTree
+
+'''
+A map file holds one generated map:
+
+preamble - MAPFORMATMAGIC (8 bytes), then the format version and the length of
+           the header in bytes, both little endian uint32
+header   - UTF-8 JSON: the generator kind, the map width and height, the
+           generation parameters (seed, size, probabilities, ...) and the
+           layout of the sections
+sections - raw little endian arrays, each starting on a SECTIONALIGNMENT byte
+           boundary after the header. Offsets in the header are relative to
+           the first section, so the header can be written without knowing
+           its own length in advance.
+
+Every file has these sections:
+tiles      - the tile grid as uint8 with shape (width, height), indexed [x, y]
+             exactly like DiggingMap.tileMap
+rooms      - (x, y, width, height) float32 rows, one per room
+connectors - (x, y, width, height) float32 rows, one per connector
+BSP maps also keep the arrays of their FlatAreaTree (sections "flat.<name>"),
+so the tree itself can be rebuilt. Digger maps do not track rooms as
+rectangles, so their tables are empty.
+
+loadMapFile reads only the preamble and header and memory maps the rest, so
+opening a map costs the same however large it is, and only the pages of the
+sections actually used are ever read from disk. Files are written to a
+temporary name and then renamed, so a reader never sees half a file.
+
+Like ProcGenRender, the write functions return the file as bytes instead when
+no path is given, and readMapBytes opens such bytes without touching disk.
+'''
+
+MAPFORMATMAGIC = b"PGMAP\r\n\x1a"
+MAPFORMATVERSION = 1
+MAPFILEEXTENSION = ".pgmap"
+SECTIONALIGNMENT = 64
+MAPFILEPREAMBLE = struct.Struct("<8sII")
+
+FLATTREESECTIONPREFIX = "flat."
+FLATTREEARRAYNAMES = ("bounds", "splitAxes", "childIndices", "parentIndices",
+                      "rooms", "connectors", "childrenAreConnected")
+
+RECTANGLEDTYPE = np.float32
+KINDDIGGER = "digger"
+KINDBSP = "bsp"
+
+
+def getAlignedOffset(offset):
+    return -(-offset // SECTIONALIGNMENT) * SECTIONALIGNMENT
+
+
+def getRectangleTable(rectangles):
+    return np.asarray(rectangles, dtype = RECTANGLEDTYPE).reshape(-1, 4)
+
+
+'''
+Writes a map file. sections is a list of (name, array) pairs stored after the
+tile grid; parameters must be serializable as JSON.
+'''
+def writeMapFile(path, kind, tileArray, roomRectangles = None, connectorRectangles = None,
+                 parameters = None, sections = None, headerFields = None):
+    width, height = np.shape(tileArray)
+    sectionList = [("tiles", tileArray),
+                   ("rooms", getRectangleTable(roomRectangles if roomRectangles is not None else [])),
+                   ("connectors", getRectangleTable(connectorRectangles if connectorRectangles is not None else []))]
+    sectionList.extend(sections if sections is not None else [])
+
+    sectionLayout = {}
+    sectionArrays = []
+    sectionEnd = 0
+    for name, array in sectionList:
+        array = np.ascontiguousarray(array)
+        array = array.astype(array.dtype.newbyteorder("<"), copy = False)
+        sectionLayout[name] = {"offset": sectionEnd, "shape": list(array.shape), "dtype": array.dtype.str}
+        sectionArrays.append((sectionEnd, array))
+        sectionEnd = getAlignedOffset(sectionEnd + array.nbytes)
+
+    header = {"kind": kind, "width": int(width), "height": int(height),
+              "parameters": parameters if parameters is not None else {},
+              "sections": sectionLayout}
+    header.update(headerFields if headerFields is not None else {})
+    headerBytes = json.dumps(header, sort_keys = True).encode("utf-8")
+    dataOffset = getAlignedOffset(MAPFILEPREAMBLE.size + len(headerBytes))
+
+    def writeSections(mapFile):
+        mapFile.write(MAPFILEPREAMBLE.pack(MAPFORMATMAGIC, MAPFORMATVERSION, len(headerBytes)))
+        mapFile.write(headerBytes)
+        for sectionOffset, array in sectionArrays:
+            mapFile.seek(dataOffset + sectionOffset)
+            mapFile.write(array.tobytes())
+        # Pad the last section out to its alignment.
+        fileEnd = mapFile.seek(0, io.SEEK_END)
+        mapFile.write(bytes(dataOffset + sectionEnd - fileEnd))
+
+    if (path is None):
+        mapBuffer = io.BytesIO()
+        writeSections(mapBuffer)
+        return mapBuffer.getvalue()
+    temporaryPath = path + ".tmp" + str(os.getpid())
+    with open(temporaryPath, "wb") as mapFile:
+        writeSections(mapFile)
+    os.replace(temporaryPath, path)
+    return None
+
+
+def saveDiggingMap(path, diggingMap, parameters = None):
+    return writeMapFile(path, KINDDIGGER, diggingMap.getTileArray(), parameters = parameters)
+
+
+def saveAreaTree(path, tree, parameters = None):
+    flatTree = flattenAreaTree(tree)
+    sections = [(FLATTREESECTIONPREFIX + name, getattr(flatTree, name)) for name in FLATTREEARRAYNAMES]
+    headerFields = {"nodeNames": flatTree.nodeNames} if flatTree.nodeNames is not None else None
+    return writeMapFile(path, KINDBSP, tree.getTileArray(), flatTree.getRoomRectangles(),
+                 flatTree.getConnectorRectangles(), parameters, sections, headerFields)
+
+
+'''
+Saves the result of either generator.
+'''
+def saveGeneratedMap(path, generatedMap, parameters = None):
+    if (isinstance(generatedMap, AreaTree)):
+        return saveAreaTree(path, generatedMap, parameters)
+    elif (isinstance(generatedMap, DiggingMap)):
+        return saveDiggingMap(path, generatedMap, parameters)
+    else:
+        raise TypeError("Cannot save a map of type " + type(generatedMap).__name__)
+
+
+'''
+An opened map file. The arrays it hands out are read only views of the file,
+so they cost nothing until they are used. The to* functions copy what they
+need into ordinary, writable objects.
+'''
+class MapFile(object):
+    def __init__(self, path, header, rawData, dataOffset):
+        self.path = path
+        self.header = header
+        self.rawData = rawData
+        self.dataOffset = dataOffset
+        self.kind = header["kind"]
+        self.width = header["width"]
+        self.height = header["height"]
+        self.parameters = header["parameters"]
+
+    def __repr__(self):
+        return "MapFile: " + self.kind + " " + str(self.width) + "x" + str(self.height) + " " + str(self.parameters)
+
+    def hasArray(self, name):
+        return name in self.header["sections"]
+
+    def getArray(self, name):
+        section = self.header["sections"][name]
+        dtype = np.dtype(section["dtype"])
+        shape = tuple(section["shape"])
+        start = self.dataOffset + section["offset"]
+        byteCount = int(np.prod(shape, dtype = np.int64)) * dtype.itemsize
+        return self.rawData[start:start + byteCount].view(dtype).reshape(shape)
+
+    def getTileArray(self):
+        return self.getArray("tiles")
+
+    def getRoomRectangles(self):
+        return self.getArray("rooms")
+
+    def getConnectorRectangles(self):
+        return self.getArray("connectors")
+
+    def toDiggingMap(self, rng = None):
+        return DiggingMap(self.width, self.height, np.array(self.getTileArray()), rng)
+
+    def toFlatAreaTree(self):
+        if (not self.hasArray(FLATTREESECTIONPREFIX + "bounds")):
+            raise ValueError("Map file " + str(self.path) + " does not hold a BSP tree")
+        bounds = self.getArray(FLATTREESECTIONPREFIX + "bounds")
+        flatTree = FlatAreaTree(len(bounds), self.header.get("nodeNames"))
+        for name in FLATTREEARRAYNAMES:
+            getattr(flatTree, name)[...] = self.getArray(FLATTREESECTIONPREFIX + name)
+        return flatTree
+
+    def toAreaTree(self, rng = None):
+        return self.toFlatAreaTree().toAreaTree(rng)
+
+
+'''
+Checks the preamble of a map file and returns the length of its header.
+'''
+def getHeaderLength(preamble, path):
+    if (len(preamble) < MAPFILEPREAMBLE.size):
+        raise ValueError(str(path) + " is not a map file")
+    magic, version, headerLength = MAPFILEPREAMBLE.unpack(preamble)
+    if (magic != MAPFORMATMAGIC):
+        raise ValueError(str(path) + " is not a map file")
+    if (version > MAPFORMATVERSION):
+        raise ValueError(str(path) + " uses map format version " + str(version)
+                         + ", newer than the supported version " + str(MAPFORMATVERSION))
+    return headerLength
+
+
+'''
+Opens a map file. With memoryMap = False the whole file is read into memory
+instead, e.g. when many files would otherwise be kept open.
+'''
+def loadMapFile(path, memoryMap = True):
+    with open(path, "rb") as mapFile:
+        headerLength = getHeaderLength(mapFile.read(MAPFILEPREAMBLE.size), path)
+        header = json.loads(mapFile.read(headerLength).decode("utf-8"))
+    dataOffset = getAlignedOffset(MAPFILEPREAMBLE.size + headerLength)
+    if (memoryMap):
+        rawData = np.memmap(path, dtype = np.uint8, mode = "r")
+    else:
+        rawData = np.fromfile(path, dtype = np.uint8)
+    return MapFile(path, header, rawData, dataOffset)
+
+
+'''
+Opens a map file held in memory, e.g. as returned by writeMapFile without a
+path. The arrays it hands out are read only views of data.
+'''
+def readMapBytes(data, path = None):
+    headerLength = getHeaderLength(data[:MAPFILEPREAMBLE.size], path)
+    header = json.loads(data[MAPFILEPREAMBLE.size:MAPFILEPREAMBLE.size + headerLength].decode("utf-8"))
+    dataOffset = getAlignedOffset(MAPFILEPREAMBLE.size + headerLength)
+    return MapFile(path, header, np.frombuffer(data, dtype = np.uint8), dataOffset)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Headless rendering of generated maps to PNG images.
+
+PROVIDED AS IS WITHOUT WARRANTY OR GUARANTEE THAT IT WILL WORK.
+"""
+
+import io
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import to_rgb
+from matplotlib.figure import Figure
+import matplotlib.image
+import numpy as np
+
+from ProcGenExample_AgentDigger import TILECOLORS, getTileColormap
+
+'''
+Nothing here goes through pyplot. Figures are created directly on an Agg
+canvas, so rendering needs no display, never opens a window, and a figure is
+freed as soon as it goes out of scope, which matters when drawing thousands.
+
+saveTileImage   - draws a tile grid (DiggingMap.getTileArray or
+                  AreaTree.getTileArray) pixel by pixel through a color lookup
+                  table, without a figure at all. This is the fast path used
+                  for thumbnails.
+renderTileArray - draws a tile grid as a single imshow on a figure with axes.
+renderAreaTree  - draws the boxes, rooms and connectors of a BSP tree as a
+                  single PatchCollection.
+
+Each of them writes a PNG to path when one is given, and otherwise returns the
+PNG as bytes. Tile (x, y) is drawn with y increasing upwards, as in the
+interactive plots.
+'''
+
+DEFAULTDPI = 100
+
+
+'''
+Returns a (number of tile values, 3) uint8 array of the RGB color of each tile.
+'''
+def getTileColorTable():
+    colorTable = np.zeros((max(TILECOLORS) + 1, 3), dtype = np.uint8)
+    for tile, color in TILECOLORS.items():
+        colorTable[tile] = np.round(np.array(to_rgb(color)) * 255.0)
+    return colorTable
+
+
+'''
+Returns the RGB image of a tile grid with tileSize by tileSize pixels per tile.
+'''
+def getTileImage(tileArray, tileSize = 1):
+    # Image rows run from the top down, so flip y to keep y = 0 at the bottom.
+    image = getTileColorTable()[np.asarray(tileArray).T[::-1]]
+    if (tileSize > 1):
+        image = np.repeat(np.repeat(image, tileSize, axis = 0), tileSize, axis = 1)
+    return image
+
+
+def writePNG(saveFunction, path):
+    if (path is not None):
+        saveFunction(path)
+        return None
+    pngBuffer = io.BytesIO()
+    saveFunction(pngBuffer)
+    return pngBuffer.getvalue()
+
+
+def saveTileImage(tileArray, path = None, tileSize = 1):
+    image = getTileImage(tileArray, tileSize)
+    return writePNG(lambda target: matplotlib.image.imsave(target, image, format = "png"), path)
+
+
+def getFigure(figureSize, dpi):
+    figure = Figure(figsize = figureSize, dpi = dpi)
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def renderTileArray(tileArray, path = None, dpi = DEFAULTDPI, figureSize = None):
+    width, height = np.shape(tileArray)
+    figure = getFigure(figureSize, dpi)
+    ax = figure.gca()
+    ax.imshow(np.asarray(tileArray).T, cmap = getTileColormap(), vmin = 0, vmax = len(TILECOLORS) - 1,
+              origin = "lower", interpolation = "nearest", extent = (0, width, 0, height))
+    return writePNG(lambda target: figure.savefig(target, format = "png"), path)
+
+
+def renderAreaTree(tree, path = None, dpi = DEFAULTDPI, figureSize = None):
+    rootBox = tree.rootNode.box
+    figure = getFigure(figureSize, dpi)
+    ax = figure.gca()
+    ax.add_collection(tree.getPatchCollection())
+    ax.set_xlim(rootBox.x0, rootBox.x1)
+    ax.set_ylim(rootBox.y0, rootBox.y1)
+    return writePNG(lambda target: figure.savefig(target, format = "png"), path)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Regression tests for the blind digger, run with pytest.
+
+PROVIDED AS IS WITHOUT WARRANTY OR GUARANTEE THAT IT WILL WORK.
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+from ProcGenExample_AgentDigger import (BatchBlindDigger, BlindDigger, DiggingMap, generateAgentDiggerMap,
+                                        generateAgentDiggerMapBatch)
+
+'''
+Digger maps that once never finished: the agent walked a row of room tiles
+between the two edges of the map forever. Each is dug every way a map can be
+dug, giving up after REGRESSIONSTEPSPERTILE steps per tile.
+'''
+DIGGERREGRESSIONCASES = ({"seed": 32, "mapWidth": 40, "mapHeight": 40},
+                         {"seed": 87, "mapWidth": 30, "mapHeight": 30})
+REGRESSIONSTEPSPERTILE = 100
+PERCENTAREATARGET = 40
+KEYEDSEEDS = (1, 2, 3)
+KEYEDSIZE = 30
+
+
+@pytest.mark.parametrize("case", DIGGERREGRESSIONCASES)
+@pytest.mark.parametrize("fastStepping", (False, True))
+def testBlindDiggerFinishes(case, fastStepping):
+    diggingMap = DiggingMap(case["mapWidth"], case["mapHeight"], rng = random.Random(case["seed"]))
+    digger = BlindDigger()
+    digger.initializeDig(diggingMap)
+    tilesDugTarget = diggingMap.getTilesDugTarget(PERCENTAREATARGET)
+    maximumSteps = REGRESSIONSTEPSPERTILE * case["mapWidth"] * case["mapHeight"]
+    steps = 0
+    while (diggingMap.tilesDug < tilesDugTarget and steps < maximumSteps):
+        if (fastStepping):
+            steps += digger.performDigSegment(diggingMap, tilesDugTarget)
+        else:
+            digger.performDigIteration(diggingMap)
+            steps += 1
+    assert diggingMap.tilesDug >= tilesDugTarget
+
+
+@pytest.mark.parametrize("case", DIGGERREGRESSIONCASES)
+def testBatchBlindDiggerFinishes(case):
+    batchDigger = BatchBlindDigger([case["seed"]], case["mapWidth"], case["mapHeight"], PERCENTAREATARGET)
+    batchDigger.initializeDig()
+    maximumSteps = REGRESSIONSTEPSPERTILE * case["mapWidth"] * case["mapHeight"]
+    steps = 0
+    while (steps < maximumSteps and batchDigger.performDigIteration() > 0):
+        steps += 1
+    assert len(batchDigger.getActiveAgents()) == 0
+
+
+'''
+A BlindDigger with keyed draws digs the same map as a BatchBlindDigger agent
+with the same seed.
+'''
+def testKeyedDiggerMatchesBatch():
+    batchTiles = generateAgentDiggerMapBatch(KEYEDSEEDS, KEYEDSIZE, KEYEDSIZE)
+    for seed, tiles in zip(KEYEDSEEDS, batchTiles):
+        diggingMap = generateAgentDiggerMap(seed, KEYEDSIZE, KEYEDSIZE, showPlot = False, keyedRandom = True)
+        assert np.array_equal(tiles, diggingMap.getTileArray()), seed